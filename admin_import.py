@@ -0,0 +1,284 @@
+"""Export the workflow graph in neo4j-admin import format.
+
+Instead of building the graph with LOAD CSV ... MERGE statements against
+a running server, this resolves all nodes and relationships in Python
+(see graph_model.GraphBuilder) and writes them as node and relationship
+files that a single offline
+
+    neo4j-admin import --nodes=... --relationships=...
+
+call loads into an empty database. The generated files come with a
+manifest that verify_export checks without needing a database.
+
+neo4j-admin import creates no indexes or constraints, so the statements
+creating those of graph_model.SCHEMA are written to schema.cypher and
+have to be run once the server is started, e.g. with cypher-shell or
+WorkflowGraphDatabase.ensure_schema. Without them later MERGE based
+imports fall back to label scans.
+"""
+
+import argparse
+import csv
+import json
+import os
+import time
+
+from graph_model import SCHEMA, GraphBuilder, schema_statement
+
+
+MANIFEST_NAME = 'manifest.json'
+SCHEMA_NAME = 'schema.cypher'
+ID_COLUMN = 'uid:ID'
+
+
+def _node_files(builder):
+    """Group nodes by label as label -> (property names, rows)."""
+
+    by_label = {}
+    for nid, (label, props) in builder.nodes.items():
+        by_label.setdefault(label, []).append((nid, props))
+    ret = {}
+    for label, nodes in sorted(by_label.items()):
+        keys = sorted({k for _, props in nodes for k in props})
+        ret[label] = (keys, sorted(nodes))
+    return ret
+
+
+def _relationship_files(builder):
+    """Group relationships by type as type -> (property names, rows)."""
+
+    by_type = {}
+    for (start, rel_type, end), props in builder.relationships.items():
+        by_type.setdefault(rel_type, []).append((start, end, props))
+    ret = {}
+    for rel_type, rels in sorted(by_type.items()):
+        keys = sorted({k for _, _, props in rels for k in props})
+        ret[rel_type] = (keys, sorted(rels, key=lambda r: r[:2]))
+    return ret
+
+
+def _typed_header(keys, rows):
+    """Return the header names of property columns with their types.
+
+    Properties holding integers in all rows are declared as :int,
+    those holding numbers as :float, everything else is imported as
+    string.
+    """
+
+    header = []
+    for k in keys:
+        values = [props[k] for props in rows if k in props]
+        if values and all(
+            isinstance(v, int) and not isinstance(v, bool) for v in values
+        ):
+            header.append('{0}:int'.format(k))
+        elif values and all(
+            isinstance(v, (int, float)) and not isinstance(v, bool) for v in values
+        ):
+            header.append('{0}:float'.format(k))
+        else:
+            header.append(k)
+    return header
+
+
+def write_admin_import_files(builder, out_dir):
+    """Write the graph held by builder as neo4j-admin import files.
+
+    All nodes share a single id space. The deterministic node ids are
+    stored as the uid property of every node. The statements creating
+    the indexes and constraints are written to SCHEMA_NAME. Returns the
+    manifest that is also written to out_dir.
+    """
+
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = {'nodes': {}, 'relationships': {}, 'created': time.time()}
+
+    for label, (keys, nodes) in _node_files(builder).items():
+        fn = 'nodes_{0}.csv'.format(label)
+        with open(os.path.join(out_dir, fn), 'w', newline='') as o:
+            w = csv.writer(o)
+            w.writerow(
+                [ID_COLUMN] + _typed_header(keys, [p for _, p in nodes])
+                + [':LABEL']
+            )
+            for nid, props in nodes:
+                w.writerow(
+                    [nid] + [props.get(k, '') for k in keys] + [label]
+                )
+        manifest['nodes'][label] = {'file': fn, 'count': len(nodes)}
+
+    for rel_type, (keys, rels) in _relationship_files(builder).items():
+        fn = 'relationships_{0}.csv'.format(rel_type)
+        with open(os.path.join(out_dir, fn), 'w', newline='') as o:
+            w = csv.writer(o)
+            w.writerow(
+                [':START_ID'] + _typed_header(keys, [p for _, _, p in rels])
+                + [':END_ID', ':TYPE']
+            )
+            for start, end, props in rels:
+                w.writerow(
+                    [start] + [props.get(k, '') for k in keys]
+                    + [end, rel_type]
+                )
+        manifest['relationships'][rel_type] = {
+            'file': fn, 'count': len(rels)
+        }
+
+    with open(os.path.join(out_dir, SCHEMA_NAME), 'w') as o:
+        for entry in SCHEMA:
+            o.write(schema_statement(*entry) + ';\n')
+    manifest['schema'] = SCHEMA_NAME
+
+    with open(os.path.join(out_dir, MANIFEST_NAME), 'w') as o:
+        json.dump(manifest, o, indent=2)
+    return manifest
+
+
+def admin_import_command(out_dir, database='graph.db'):
+    """Return the neo4j-admin import call for the files in out_dir."""
+
+    with open(os.path.join(out_dir, MANIFEST_NAME)) as i:
+        manifest = json.load(i)
+    cmd = [
+        'neo4j-admin', 'import',
+        '--database={0}'.format(database),
+        '--multiline-fields=true'
+    ]
+    for entry in manifest['nodes'].values():
+        cmd.append('--nodes={0}'.format(
+            os.path.join(out_dir, entry['file'])
+        ))
+    for entry in manifest['relationships'].values():
+        cmd.append('--relationships={0}'.format(
+            os.path.join(out_dir, entry['file'])
+        ))
+    return cmd
+
+
+def verify_export(out_dir):
+    """Check the consistency of exported neo4j-admin import files.
+
+    Verifies headers, that node ids are unique, that every relationship
+    connects two exported nodes, that no relationship is duplicated and
+    that row counts match the manifest.
+
+    Returns a list of problems found, which is empty for a valid export.
+    """
+
+    problems = []
+    with open(os.path.join(out_dir, MANIFEST_NAME)) as i:
+        manifest = json.load(i)
+
+    ids = set()
+    for label, entry in manifest['nodes'].items():
+        with open(os.path.join(out_dir, entry['file']), newline='') as i:
+            reader = csv.reader(i)
+            header = next(reader)
+            if header[0] != ID_COLUMN or header[-1] != ':LABEL':
+                problems.append(
+                    '{0}: unexpected header {1}'.format(entry['file'], header)
+                )
+                continue
+            count = 0
+            for row in reader:
+                count += 1
+                if row[0] in ids:
+                    problems.append(
+                        '{0}: duplicate node id {1}'.format(
+                            entry['file'], row[0]
+                        )
+                    )
+                ids.add(row[0])
+                if row[-1] != label:
+                    problems.append(
+                        '{0}: node {1} has label {2}'.format(
+                            entry['file'], row[0], row[-1]
+                        )
+                    )
+        if count != entry['count']:
+            problems.append(
+                '{0}: {1} nodes, manifest says {2}'.format(
+                    entry['file'], count, entry['count']
+                )
+            )
+
+    for rel_type, entry in manifest['relationships'].items():
+        with open(os.path.join(out_dir, entry['file']), newline='') as i:
+            reader = csv.reader(i)
+            header = next(reader)
+            if header[0] != ':START_ID' or header[-2:] != [':END_ID', ':TYPE']:
+                problems.append(
+                    '{0}: unexpected header {1}'.format(entry['file'], header)
+                )
+                continue
+            count = 0
+            seen = set()
+            for row in reader:
+                count += 1
+                start, end = row[0], row[-2]
+                for nid in (start, end):
+                    if nid not in ids:
+                        problems.append(
+                            '{0}: dangling node id {1}'.format(
+                                entry['file'], nid
+                            )
+                        )
+                if (start, end) in seen:
+                    problems.append(
+                        '{0}: duplicate relationship {1}->{2}'.format(
+                            entry['file'], start, end
+                        )
+                    )
+                seen.add((start, end))
+                if row[-1] != rel_type:
+                    problems.append(
+                        '{0}: relationship of type {1}'.format(
+                            entry['file'], row[-1]
+                        )
+                    )
+        if count != entry['count']:
+            problems.append(
+                '{0}: {1} relationships, manifest says {2}'.format(
+                    entry['file'], count, entry['count']
+                )
+            )
+
+    return problems
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        description='Export the workflow graph for neo4j-admin import'
+    )
+    arg_parser.add_argument("-ti", "--tool_inputs_file", required=True, help="Tool inputs file")
+    arg_parser.add_argument("-to", "--tool_outputs_file", required=True, help="Tool outputs file")
+    arg_parser.add_argument("-wf", "--workflow_file", required=True, help="Workflow file")
+    arg_parser.add_argument("-tuf", "--tool_usage_file", required=True, help="Tool usage file")
+    arg_parser.add_argument("-o", "--out_dir", required=True, help="Directory to write the import files to")
+    arg_parser.add_argument("-db", "--database", default="graph.db", help="Name of the database to import into")
+    args = vars(arg_parser.parse_args())
+
+    s_time = time.time()
+    builder = GraphBuilder.from_csv_files(
+        tool_inputs_file=args["tool_inputs_file"],
+        tool_outputs_file=args["tool_outputs_file"],
+        workflow_file=args["workflow_file"],
+        tool_usage_file=args["tool_usage_file"]
+    )
+    manifest = write_admin_import_files(builder, args["out_dir"])
+    e_time = time.time()
+    print("Exported %d nodes and %d relationships (%d rows skipped) in %d seconds" % (
+        sum(e['count'] for e in manifest['nodes'].values()),
+        sum(e['count'] for e in manifest['relationships'].values()),
+        builder.skipped,
+        int(e_time - s_time)
+    ))
+    problems = verify_export(args["out_dir"])
+    for problem in problems:
+        print(problem)
+    if problems:
+        raise SystemExit(1)
+    print("Import with:")
+    print(" ".join(admin_import_command(args["out_dir"], args["database"])))
+    print("Then start the server and create the indexes and constraints, which the import does not:")
+    print("cypher-shell -u neo4j < %s" % os.path.join(args["out_dir"], SCHEMA_NAME))
@@ -0,0 +1,287 @@
+"""Benchmark the import and query paths of the workflow graph.
+
+Runs the import of a set of input files (e.g. generated with
+synthetic_data.py) and the query patterns of the query file, either
+against a Neo4j server or against the in-process graph_engine, and
+writes per-statement import times, rows/sec and query latency
+percentiles to a JSON file. Two result files can be compared to spot
+regressions between versions.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import time
+from collections import Counter
+
+from graph_model import iter_rows
+
+
+# Query patterns of the query file, parameterized by tool names
+NEO4J_QUERIES = {
+    'shortest_path': (
+        "MATCH (a:Tool {name: $a}), (b:Tool {name: $b}), "
+        "p = shortestPath((a)-[*]-(b)) WHERE length(p) > 1 RETURN p"
+    ),
+    'tool_chain': (
+        "MATCH p = (a:Tool {name: $a}) -[:HAS_VERSION] ->(v:Version) -[:GENERATES_OUTPUT] ->(o:ToolOutput) "
+        "-[:IS_CONNECTED_BY] ->(wc:WorkflowConnection) -[:TO_INPUT] ->(i:ToolInput) -[:FEEDS_INTO] ->(iv:Version) "
+        "<-[:HAS_VERSION] -(ot:Tool{name: $b}) RETURN a,v,o,wc,i,iv,ot"
+    ),
+    'output_datatypes': (
+        "MATCH p = (a:Tool {name: $a}) -[:HAS_VERSION] ->(v:Version) -[:GENERATES_OUTPUT] ->(o:ToolOutput) "
+        "-[:HAS_DATATYPE] ->(dt:Datatype) RETURN a,v,o,dt"
+    ),
+    'next_tools': (
+        "MATCH (a:Tool {name: $a}) -[:HAS_VERSION] ->(v:Version) -[:GENERATES_OUTPUT] ->(o:ToolOutput) "
+        "-[:IS_CONNECTED_BY] ->(wc:WorkflowConnection) -[:TO_INPUT] ->(i:ToolInput) -[:FEEDS_INTO] ->(iv:Version) "
+        "<-[:HAS_VERSION] -(ot:Tool) RETURN DISTINCT ot.name"
+    ),
+    'next_tools_materialized': (
+        "MATCH (a:Tool {name: $a}) -[:FOLLOWED_BY] ->(ot:Tool) RETURN ot.name"
+    ),
+    'popular_next_versions': (
+        "MATCH (a:Tool {name: $a}) -[:HAS_VERSION] ->(v:Version) -[:GENERATES_OUTPUT] ->(o:ToolOutput) "
+        "-[:IS_CONNECTED_BY] ->(wc:WorkflowConnection) -[:TO_INPUT] ->(i:ToolInput) -[:FEEDS_INTO] ->(iv:Version) "
+        "-[:USAGE] ->(tu:ToolUsage) WHERE tu.usage > 1000 RETURN DISTINCT iv LIMIT 10"
+    )
+}
+
+
+def percentiles(samples, points=(50, 90, 99)):
+    """Return nearest-rank percentiles, mean and max of samples."""
+
+    ordered = sorted(samples)
+    ret = {}
+    for p in points:
+        rank = max(1, -(-p * len(ordered) // 100))
+        ret['p{0}'.format(p)] = ordered[rank - 1]
+    ret['mean'] = sum(ordered) / len(ordered)
+    ret['max'] = ordered[-1]
+    return ret
+
+
+def tool_pairs(workflow_file, n=20):
+    """Return the n most frequently connected (tool, next tool) pairs."""
+
+    counts = Counter(
+        (row[1], row[4]) for row in iter_rows(workflow_file)
+    )
+    return [pair for pair, _ in counts.most_common(n)]
+
+
+def _git_version():
+    try:
+        return subprocess.run(
+            ['git', 'describe', '--always', '--dirty'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _time_queries(run, pairs, repeat, rng):
+    """Time run(name, a, b) for every query over random tool pairs."""
+
+    latencies = {}
+    for name in NEO4J_QUERIES:
+        samples = []
+        for _ in range(repeat):
+            a, b = rng.choice(pairs)
+            s_time = time.perf_counter()
+            run(name, a, b)
+            samples.append(time.perf_counter() - s_time)
+        latencies[name] = percentiles(samples)
+    return latencies
+
+
+class _TimedGraph:
+    """Proxy for a py2neo Graph recording the duration of every run call."""
+
+    def __init__(self, graph):
+        self._graph = graph
+        self.statements = []
+
+    def run(self, query, *args, **kwargs):
+        s_time = time.perf_counter()
+        cursor = self._graph.run(query, *args, **kwargs)
+        # make sure the statement has finished on the server
+        cursor.stats()
+        self.statements.append({
+            'statement': ' '.join(query.split())[:200],
+            'seconds': time.perf_counter() - s_time
+        })
+        return cursor
+
+    def __getattr__(self, name):
+        return getattr(self._graph, name)
+
+
+def benchmark_neo4j(files, url, username, password, repeat=20, seed=0, mode='csv'):
+    """Import files into a Neo4j server and time the query patterns.
+
+    In csv mode the files have to be present in the server's import
+    folder under their base names, like for create_workflow_graph.py.
+    The existing content of the database is deleted.
+    """
+
+    from create_workflow_graph import WorkflowGraphDatabase
+
+    graph_db = WorkflowGraphDatabase(url, username, password)
+    graph_db.delete_all()
+    timed = _TimedGraph(graph_db.graph)
+    graph_db.graph = timed
+    phases = {}
+    s_time = time.perf_counter()
+    if mode == 'streamed':
+        graph_db.ingest_streamed(files['tool_inputs'], files['tool_outputs'],
+                                 files['workflows'], files['tool_usage'])
+        phases['streamed'] = time.perf_counter() - s_time
+    else:
+        graph_db.load_io_data_from_csv(files['tool_outputs'], 'ToolOutput')
+        phases['tool_outputs'] = time.perf_counter() - s_time
+        graph_db.load_io_data_from_csv(files['tool_inputs'], 'ToolInput')
+        phases['tool_inputs'] = time.perf_counter() - s_time - phases['tool_outputs']
+        graph_db.create_graph_bulk_merge(files['workflows'], files['tool_usage'])
+        phases['workflows'] = time.perf_counter() - s_time - phases['tool_outputs'] - phases['tool_inputs']
+    graph_db.graph = timed._graph
+
+    def run(name, a, b):
+        graph_db.run_query(NEO4J_QUERIES[name], {'a': a, 'b': b}, use_cache=False)
+
+    latencies = _time_queries(run, tool_pairs(files['workflows']), repeat, random.Random(seed))
+    statements = timed.statements
+    if mode != 'streamed':
+        statements = graph_db.import_metrics.records
+    return {
+        'import': {'phases': phases, 'statements': statements},
+        'queries': latencies,
+        'graph': graph_db.graph_statistics()
+    }
+
+
+def benchmark_inprocess(files, repeat=20, seed=0):
+    """Build the in-process graph_engine graph and time the query patterns."""
+
+    from graph_engine import TOOL_CHAIN, CompactGraph
+    from graph_model import COMPONENTS, GraphBuilder
+
+    # the tool chain up to the downstream Version, then on to its usage
+    usage_chain = TOOL_CHAIN[:-1] + (
+        (COMPONENTS['Relationships']['Version_to_Usage'], 'out', 'ToolUsage'),
+    )
+
+    phases = {}
+    s_time = time.perf_counter()
+    builder = GraphBuilder()
+    builder.load_io_csv(files['tool_outputs'], 'ToolOutput')
+    phases['tool_outputs'] = time.perf_counter() - s_time
+    builder.load_io_csv(files['tool_inputs'], 'ToolInput')
+    phases['tool_inputs'] = time.perf_counter() - s_time - sum(phases.values())
+    builder.load_workflow_csv(files['workflows'])
+    builder.load_usage_csv(files['tool_usage'])
+    phases['workflows'] = time.perf_counter() - s_time - sum(phases.values())
+    graph = CompactGraph.from_builder(builder)
+    phases['compact'] = time.perf_counter() - s_time - sum(phases.values())
+
+    def run(name, a, b):
+        if name == 'shortest_path':
+            graph.shortest_tool_path(a, b)
+        elif name == 'tool_chain':
+            graph.tool_chains(a, b)
+        elif name == 'output_datatypes':
+            graph.tool_output_datatypes(a)
+        elif name == 'next_tools':
+            graph.tool_chains(a)
+        elif name == 'popular_next_versions':
+            paths = graph.follow(graph.find('Tool', a), usage_chain)
+            return {v for v, tu in paths[:, -2:] if float(graph.names[tu]) > 1000}
+        else:
+            graph.next_tools(a)
+
+    latencies = _time_queries(run, tool_pairs(files['workflows']), repeat, random.Random(seed))
+    return {
+        'import': {'phases': phases, 'statements': []},
+        'queries': latencies,
+        'graph': {'nodes': len(graph), 'relationships': graph.num_relationships}
+    }
+
+
+def run_benchmark(files, backend='inprocess', repeat=20, seed=0, **neo4j_args):
+    """Run a benchmark and return its machine-readable results."""
+
+    rows = {kind: sum(1 for _ in iter_rows(fn)) for kind, fn in files.items()}
+    if backend == 'neo4j':
+        results = benchmark_neo4j(files, repeat=repeat, seed=seed, **neo4j_args)
+    else:
+        results = benchmark_inprocess(files, repeat=repeat, seed=seed)
+    import_seconds = sum(results['import']['phases'].values())
+    results.update({
+        'backend': backend,
+        'version': _git_version(),
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'rows': rows,
+        'import_seconds': import_seconds,
+        'rows_per_sec': sum(rows.values()) / import_seconds if import_seconds else 0.0
+    })
+    return results
+
+
+def compare(baseline, candidate):
+    """Return the candidate/baseline ratio of the main timing metrics."""
+
+    ratios = {'import_seconds': candidate['import_seconds'] / baseline['import_seconds']}
+    for name, stats in candidate['queries'].items():
+        if name in baseline['queries']:
+            for key in ('p50', 'p90', 'p99'):
+                ratios['{0}.{1}'.format(name, key)] = stats[key] / baseline['queries'][name][key]
+    return ratios
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description='Benchmark the workflow graph import and queries')
+    subparsers = arg_parser.add_subparsers(dest="command", required=True)
+    run_parser = subparsers.add_parser("run", help="Run a benchmark")
+    run_parser.add_argument("-d", "--data_dir", required=True, help="Directory with the input files (see synthetic_data.py)")
+    run_parser.add_argument("-b", "--backend", default="inprocess", choices=["inprocess", "neo4j"], help="What to benchmark")
+    run_parser.add_argument("-o", "--out_file", required=True, help="JSON file to write the results to")
+    run_parser.add_argument("-r", "--repeat", type=int, default=20, help="Runs per query pattern")
+    run_parser.add_argument("-url", "--url", help="Neo4j server")
+    run_parser.add_argument("-un", "--user_name", help="User name")
+    run_parser.add_argument("-pass", "--password", help="Password")
+    run_parser.add_argument("-m", "--mode", default="csv", choices=["csv", "streamed"], help="Neo4j import mode")
+    compare_parser = subparsers.add_parser("compare", help="Compare two result files")
+    compare_parser.add_argument("baseline", help="Results of the baseline version")
+    compare_parser.add_argument("candidate", help="Results of the version to compare")
+    args = vars(arg_parser.parse_args())
+
+    if args["command"] == "compare":
+        with open(args["baseline"]) as i:
+            baseline = json.load(i)
+        with open(args["candidate"]) as i:
+            candidate = json.load(i)
+        for metric, ratio in sorted(compare(baseline, candidate).items()):
+            print("%-40s %6.2fx" % (metric, ratio))
+    else:
+        files = {
+            'tool_inputs': os.path.join(args["data_dir"], 'tool_iformats.csv'),
+            'tool_outputs': os.path.join(args["data_dir"], 'tool_oformats.csv'),
+            'workflows': os.path.join(args["data_dir"], 'workflow_connections.csv'),
+            'tool_usage': os.path.join(args["data_dir"], 'tools_usage_prediction.csv')
+        }
+        neo4j_args = {}
+        if args["backend"] == "neo4j":
+            neo4j_args = {'url': args["url"], 'username': args["user_name"],
+                          'password': args["password"], 'mode': args["mode"]}
+        results = run_benchmark(files, args["backend"], args["repeat"], **neo4j_args)
+        with open(args["out_file"], 'w') as o:
+            json.dump(results, o, indent=2)
+        print("Imported %d rows in %.1f seconds (%d rows/sec)" % (
+            sum(results['rows'].values()), results['import_seconds'], results['rows_per_sec']))
+        for name, stats in sorted(results['queries'].items()):
+            print("%-25s p50 %.4fs p90 %.4fs p99 %.4fs" % (name, stats['p50'], stats['p90'], stats['p99']))
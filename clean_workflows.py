@@ -0,0 +1,116 @@
+"""Clean a gxadmin workflow connections dump for the graph import.
+
+Replaces the row by row cleaning of format_workflows.ipynb: the raw TSV
+is read in chunks, tool ids and versions are split and filtered with
+vectorized string operations, and the corrected connections as well as
+the distinct workflow ids are written in a single pass.
+"""
+
+import argparse
+import time
+
+import pandas as pd
+
+
+# Columns of the gxadmin workflow connections query, see the query file
+RAW_COLUMNS = [
+    'wf_id', 'wf_updated', 'in_id', 'in_tool', 'in_tool_v', 'out_id',
+    'out_tool', 'out_tool_v', 'tool_inputs', 'tool_outputs', 'published'
+]
+
+# Columns of the corrected file, in the order create_graph_bulk_merge expects
+CLEAN_COLUMNS = [
+    'wf_id', 'in_tool', 'in_tool_version', 'in_tool_output',
+    'out_tool', 'out_tool_input', 'out_tool_version'
+]
+
+# toolshed guids end in .../<tool id>/<version>
+_GUID_TAIL = r'([^/]*)/([^/]*)$'
+
+
+def split_tool_ids(tool_ids, fallback_versions):
+    """Split tool ids into short ids and versions.
+
+    For toolshed guids, the id is the second last and the version the
+    last part of the guid. Other ids are kept as is and get their
+    version from fallback_versions.
+    """
+
+    parts = tool_ids.str.extract(_GUID_TAIL)
+    is_guid = parts[0].notna()
+    ids = parts[0].where(is_guid, tool_ids)
+    versions = parts[1].where(is_guid, '')
+    versions = versions.where(versions != '', fallback_versions)
+    return ids, versions
+
+
+def clean_chunk(df):
+    """Return the corrected connections of a chunk of the raw dump."""
+
+    df = df.fillna('')
+    for col in ('wf_id', 'in_tool', 'out_tool', 'tool_inputs',
+                'tool_outputs', 'in_tool_v', 'out_tool_v'):
+        df[col] = df[col].astype(str).str.strip()
+    keep = pd.Series(True, index=df.index)
+    for col in ('in_tool', 'out_tool', 'tool_inputs', 'tool_outputs'):
+        keep &= (df[col] != '') & (df[col] != 'nan')
+    df = df[keep]
+
+    in_tool, in_v = split_tool_ids(df['in_tool'], df['in_tool_v'])
+    out_tool, out_v = split_tool_ids(df['out_tool'], df['out_tool_v'])
+    clean = pd.DataFrame({
+        'wf_id': df['wf_id'],
+        'in_tool': in_tool,
+        'in_tool_version': in_v,
+        'in_tool_output': df['tool_outputs'],
+        'out_tool': out_tool,
+        'out_tool_input': df['tool_inputs'],
+        'out_tool_version': out_v
+    }, columns=CLEAN_COLUMNS)
+    return clean[(clean['in_tool_version'] != '') & (clean['out_tool_version'] != '')]
+
+
+def clean_workflow_connections(raw_file, out_file, wf_ids_file=None, chunk_size=100000):
+    """Write the corrected connections and distinct workflow ids of a dump.
+
+    raw_file is the headerless TSV produced by the gxadmin workflow
+    connections query. Returns the number of connections written and
+    the number of distinct workflow ids.
+    """
+
+    wf_ids = {}
+    n_rows = 0
+    reader = pd.read_csv(
+        raw_file, sep='\t', header=None, names=RAW_COLUMNS, dtype=str,
+        keep_default_na=False, chunksize=chunk_size
+    )
+    with open(out_file, 'w', newline='') as o:
+        o.write(','.join(CLEAN_COLUMNS) + '\n')
+        for chunk in reader:
+            clean = clean_chunk(chunk)
+            clean.to_csv(o, header=False, index=False)
+            n_rows += len(clean)
+            wf_ids.update(dict.fromkeys(clean['wf_id']))
+    if wf_ids_file:
+        with open(wf_ids_file, 'w') as o:
+            o.write('wf_id\n')
+            for wf_id in wf_ids:
+                o.write(wf_id + '\n')
+    return n_rows, len(wf_ids)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        description='Clean a gxadmin workflow connections dump'
+    )
+    arg_parser.add_argument("-i", "--raw_file", required=True, help="Raw workflow connections TSV")
+    arg_parser.add_argument("-o", "--out_file", required=True, help="Corrected workflow connections CSV")
+    arg_parser.add_argument("-ids", "--wf_ids_file", help="File to write the distinct workflow ids to")
+    arg_parser.add_argument("-cs", "--chunk_size", type=int, default=100000, help="Rows per chunk")
+    args = vars(arg_parser.parse_args())
+    s_time = time.time()
+    n_rows, n_wfs = clean_workflow_connections(
+        args["raw_file"], args["out_file"], args["wf_ids_file"], args["chunk_size"]
+    )
+    e_time = time.time()
+    print("Wrote %d connections of %d workflows in %d seconds" % (n_rows, n_wfs, int(e_time - s_time)))
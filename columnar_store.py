@@ -0,0 +1,231 @@
+"""Columnar storage of the workflow graph input tables.
+
+The tool inputs/outputs, workflow connections and tool usage tables
+repeat the same tool names, versions, extensions and EDAM ids on many
+rows. Stored as Arrow IPC (.arrow) or Parquet (.parquet) files with
+dictionary-encoded string columns, every distinct value is kept once
+and the rows only hold small integer indices.
+
+Both formats are compressed with zstd by default, which makes them
+6-9 times smaller than the CSVs. Compressed Arrow IPC buffers are
+decompressed when they are read, so a memory mapped file is no longer
+read without copying. compression=None (-c none) writes uncompressed
+Arrow files, which are read without copying but are only about half the
+size of the CSVs. Parquet files are the usual choice for archiving and
+for pandas/notebook use.
+
+Rows read from a columnar file are the same tuples of strings as those
+read from the CSV it was converted from, so GraphBuilder and the other
+consumers of graph_model.iter_rows accept either format.
+
+Requires pyarrow, which is only imported when a columnar file is used.
+"""
+
+import argparse
+import csv
+import os
+import time
+from array import array
+
+
+COLUMNAR_EXTENSIONS = ('.arrow', '.parquet')
+
+# Rows per record batch / row group
+BATCH_SIZE = 65536
+
+# Codec of the Arrow IPC buffers and Parquet pages
+COMPRESSION = 'zstd'
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError(
+            'Columnar files require pyarrow, install it with "pip install pyarrow"'
+        )
+    return pyarrow
+
+
+def is_columnar(file_name):
+    """Return whether file_name has the extension of a columnar file."""
+
+    return os.path.splitext(file_name)[1].lower() in COLUMNAR_EXTENSIONS
+
+
+class ColumnarWriter:
+    """Incremental writer of rows of strings to a columnar file.
+
+    The format is chosen by the extension of file_name. Values are
+    stored as strings the way they would be written to a CSV, i.e. None
+    becomes 'None'. Rows are written in record batches / row groups of
+    batch_size rows as they come in. Every column is encoded against a
+    single dictionary of its distinct values that only grows from batch
+    to batch, as Arrow IPC files allow one dictionary per field; later
+    batches append to it with dictionary deltas. Only the dictionaries
+    and the current batch are held in memory. compression is a codec
+    name like 'zstd' or 'lz4', or None for uncompressed files.
+    """
+
+    def __init__(self, column_names, file_name, batch_size=BATCH_SIZE, compression=COMPRESSION):
+        pa = self._pa = _pyarrow()
+        self.file_name = file_name
+        self.batch_size = batch_size
+        self.rows = 0
+        self._schema = pa.schema(
+            [(name, pa.dictionary(pa.int32(), pa.string())) for name in column_names]
+        )
+        self._codes = [{} for _ in column_names]
+        self._dictionaries = [[] for _ in column_names]
+        self._indices = [array('i') for _ in column_names]
+        self._tmp = file_name + '.tmp'
+        if file_name.lower().endswith('.parquet'):
+            import pyarrow.parquet as pq
+            self._writer = pq.ParquetWriter(self._tmp, self._schema,
+                                            compression=compression or 'none')
+        else:
+            self._writer = pa.ipc.new_file(
+                self._tmp, self._schema,
+                options=pa.ipc.IpcWriteOptions(compression=compression,
+                                               emit_dictionary_deltas=True)
+            )
+
+    def writerow(self, row):
+        for code, dictionary, index, value in zip(
+            self._codes, self._dictionaries, self._indices, row
+        ):
+            value = str(value)
+            i = code.get(value)
+            if i is None:
+                i = code[value] = len(dictionary)
+                dictionary.append(value)
+            index.append(i)
+        self.rows += 1
+        if len(self._indices[0]) == self.batch_size:
+            self._write_batch()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def _write_batch(self):
+        pa = self._pa
+        self._writer.write_batch(pa.record_batch([
+            pa.DictionaryArray.from_arrays(
+                pa.array(index, pa.int32()), pa.array(dictionary, pa.string())
+            )
+            for dictionary, index in zip(self._dictionaries, self._indices)
+        ], schema=self._schema))
+        self._indices = [array('i') for _ in self._indices]
+
+    def close(self):
+        """Write the last batch and move the complete file in place."""
+
+        if len(self._indices[0]) or not self.rows:
+            self._write_batch()
+        self._writer.close()
+        os.replace(self._tmp, self.file_name)
+
+    def abort(self):
+        """Discard the file written so far."""
+
+        self._writer.close()
+        os.remove(self._tmp)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def write_table(column_names, rows, file_name, batch_size=BATCH_SIZE, compression=COMPRESSION):
+    """Write rows of strings as a columnar file with a ColumnarWriter.
+
+    Returns the number of rows written.
+    """
+
+    with ColumnarWriter(column_names, file_name, batch_size, compression) as writer:
+        writer.writerows(rows)
+    return writer.rows
+
+
+def read_table(file_name, memory_map=True):
+    """Return a columnar file as a pyarrow Table.
+
+    Arrow IPC files are memory mapped unless memory_map is False.
+    """
+
+    pa = _pyarrow()
+    if file_name.lower().endswith('.parquet'):
+        import pyarrow.parquet as pq
+        return pq.read_table(file_name, memory_map=memory_map)
+    if memory_map:
+        source = pa.memory_map(file_name, 'r')
+    else:
+        source = pa.OSFile(file_name, 'rb')
+    return pa.ipc.open_file(source).read_all()
+
+
+def read_dataframe(file_name):
+    """Return a columnar file as a pandas DataFrame of categoricals."""
+
+    return read_table(file_name).to_pandas()
+
+
+def _decode(column):
+    if hasattr(column, 'dictionary'):
+        values = column.dictionary.to_pylist()
+        return [values[i] for i in column.indices.to_numpy(zero_copy_only=False)]
+    return column.to_pylist()
+
+
+def iter_table_rows(file_name):
+    """Iterate over the rows of a columnar file as tuples of strings."""
+
+    for batch in read_table(file_name).to_batches():
+        yield from zip(*(_decode(column) for column in batch.columns))
+
+
+def convert_csv(csv_file, out_file, batch_size=BATCH_SIZE, compression=COMPRESSION):
+    """Convert a CSV file with a header row to a columnar file."""
+
+    with open(csv_file, 'r', newline='') as i:
+        reader = csv.reader(i)
+        header = next(reader)
+        return write_table(header, (row for row in reader if row), out_file, batch_size,
+                           compression)
+
+
+def export_csv(columnar_file, csv_file):
+    """Write a columnar file back to CSV, e.g. for Neo4j's LOAD CSV."""
+
+    table = read_table(columnar_file)
+    with open(csv_file, 'w', newline='') as o:
+        w = csv.writer(o, lineterminator='\n')
+        w.writerow(table.column_names)
+        w.writerows(iter_table_rows(columnar_file))
+    return table.num_rows
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        description='Convert workflow graph input tables between CSV and columnar files'
+    )
+    arg_parser.add_argument("-i", "--in_file", required=True, help="CSV or columnar (.arrow/.parquet) file")
+    arg_parser.add_argument("-o", "--out_file", required=True, help="Columnar (.arrow/.parquet) or CSV file")
+    arg_parser.add_argument("-c", "--compression", default=COMPRESSION, choices=["zstd", "lz4", "none"],
+                            help="Compression of columnar files, none keeps Arrow files zero-copy")
+    args = vars(arg_parser.parse_args())
+    s_time = time.time()
+    if is_columnar(args["in_file"]):
+        n_rows = export_csv(args["in_file"], args["out_file"])
+    else:
+        compression = None if args["compression"] == "none" else args["compression"]
+        n_rows = convert_csv(args["in_file"], args["out_file"], compression=compression)
+    e_time = time.time()
+    print("Converted %d rows (%d -> %d bytes) in %.1f seconds" % (
+        n_rows, os.path.getsize(args["in_file"]), os.path.getsize(args["out_file"]), e_time - s_time))
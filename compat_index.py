@@ -0,0 +1,175 @@
+"""Index of which tool inputs can consume which tool outputs.
+
+The CompatibilityIndex is built from the tool_oformats/tool_iformats
+CSVs written by extract_tools.write_io_data_to_csv. It maps every
+(tool, version, output) to the set of (tool, version, input) whose
+accepted extensions or EDAM formats match those of the output, which
+otherwise takes a traversal of
+
+ToolOutput-[:HAS_DATATYPE]->Datatype-[:IS_OF_FORMAT]->EDAMFormat
+
+and back through ToolInput for every pair.
+
+Optionally, EDAM formats are expanded with their superclasses, so that
+an input accepting a general format matches outputs of any of its more
+specific formats.
+"""
+
+import csv
+import pickle
+
+from graph_model import iter_rows
+
+
+# Values written by write_io_data_to_csv for missing extensions/formats
+MISSING = ('', 'None')
+
+
+def load_edam_parents(file_name):
+    """Read EDAM format superclasses from a two column child,parent CSV."""
+
+    parents = {}
+    with open(file_name, newline='') as i:
+        for row in csv.reader(i):
+            if len(row) >= 2 and not row[0].startswith('#'):
+                parents.setdefault(row[0], set()).add(row[1])
+    return parents
+
+
+def edam_closure(formats, parents):
+    """Return formats together with all their EDAM superclasses."""
+
+    closure = set()
+    stack = list(formats)
+    while stack:
+        fmt = stack.pop()
+        if fmt not in closure:
+            closure.add(fmt)
+            stack.extend(parents.get(fmt, ()))
+    return closure
+
+
+class CompatibilityIndex:
+    """O(1) lookup of the tool inputs compatible with a tool output."""
+
+    def __init__(self, edam_parents=None):
+        self.edam_parents = edam_parents
+        # interned (tool, version, input) keys
+        self.inputs = []
+        self._input_ids = {}
+        # output key -> signature id, signature id -> frozenset of input ids
+        self._outputs = {}
+        self._compatible = []
+
+    @classmethod
+    def from_csv_files(cls, tool_outputs_file, tool_inputs_file,
+                       edam_parents=None):
+        """Build the index from tool_oformats and tool_iformats CSVs.
+
+        edam_parents is an optional mapping of EDAM format ids to the
+        ids of their superclasses, see load_edam_parents.
+        """
+
+        this = cls(edam_parents)
+        this._build(
+            iter_rows(tool_outputs_file), iter_rows(tool_inputs_file)
+        )
+        return this
+
+    def _build(self, output_rows, input_rows):
+        by_ext = {}
+        by_edam = {}
+        for tool, version, name, ext, edam in (r[:5] for r in input_rows):
+            key = (tool, version, name)
+            iid = self._input_ids.get(key)
+            if iid is None:
+                iid = self._input_ids[key] = len(self.inputs)
+                self.inputs.append(key)
+            if ext not in MISSING:
+                by_ext.setdefault(ext, set()).add(iid)
+            if edam not in MISSING:
+                by_edam.setdefault(edam, set()).add(iid)
+
+        formats = {}
+        for tool, version, name, ext, edam in (r[:5] for r in output_rows):
+            exts, edams = formats.setdefault((tool, version, name), (set(), set()))
+            if ext not in MISSING:
+                exts.add(ext)
+            if edam not in MISSING:
+                edams.add(edam)
+
+        # outputs with the same formats share one result set
+        signatures = {}
+        for key, (exts, edams) in formats.items():
+            if self.edam_parents:
+                edams = edam_closure(edams, self.edam_parents)
+            signature = (frozenset(exts), frozenset(edams))
+            sid = signatures.get(signature)
+            if sid is None:
+                compatible = set()
+                for ext in signature[0]:
+                    compatible.update(by_ext.get(ext, ()))
+                for edam in signature[1]:
+                    compatible.update(by_edam.get(edam, ()))
+                sid = signatures[signature] = len(self._compatible)
+                self._compatible.append(frozenset(compatible))
+            self._outputs[key] = sid
+
+    def __len__(self):
+        return len(self._outputs)
+
+    def __contains__(self, output_key):
+        return tuple(output_key) in self._outputs
+
+    def compatible_input_ids(self, tool, version, output):
+        """Return the ids (indices into self.inputs) of compatible inputs."""
+
+        sid = self._outputs.get((tool, version, output))
+        if sid is None:
+            return frozenset()
+        return self._compatible[sid]
+
+    def compatible_inputs(self, tool, version, output):
+        """Return the (tool, version, input) keys compatible with an output."""
+
+        return {
+            self.inputs[i]
+            for i in self.compatible_input_ids(tool, version, output)
+        }
+
+    def compatible_tools(self, tool, version, output):
+        """Return the (tool, version) pairs that can consume an output."""
+
+        return {
+            self.inputs[i][:2]
+            for i in self.compatible_input_ids(tool, version, output)
+        }
+
+    def is_compatible(self, output_key, input_key):
+        """Return whether the input can consume the output."""
+
+        iid = self._input_ids.get(tuple(input_key))
+        return iid is not None and iid in self.compatible_input_ids(*output_key)
+
+    def check_pairs(self, pairs):
+        """Return is_compatible for every (output key, input key) pair."""
+
+        return [self.is_compatible(o, i) for o, i in pairs]
+
+    def save(self, file_name):
+        """Persist the index to file_name."""
+
+        with open(file_name, 'wb') as o:
+            pickle.dump(self, o, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, file_name):
+        """Load an index persisted with save."""
+
+        with open(file_name, 'rb') as i:
+            this = pickle.load(i)
+        if not isinstance(this, cls):
+            raise TypeError(
+                '{0} does not contain a {1}'.format(file_name, cls.__name__)
+            )
+        return this
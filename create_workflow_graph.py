@@ -1,78 +1,316 @@
 import argparse
+import copy
+import functools
+import heapq
 import os
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 
 from py2neo import Graph
+from py2neo.errors import TransientError
+
+from delta_import import DeltaManifest
+from graph_model import (
+    COMPONENTS, SCHEMA, WORKFLOW_COLUMNS, GraphBuilder, count_transitions, iter_rows, schema_statement
+)
+from graph_snapshot import read_snapshot, write_snapshot
+from import_metrics import ImportMetrics, sum_db_hits
+from query_cache import QueryCache, is_read_only
+from usage_series import UsageSeries
+
+
+# Plan operators reading all nodes (of a label) instead of seeking an index
+SCAN_OPERATORS = ("NodeByLabelScan", "AllNodesScan")
+
+PLAN_CHECKS = ("warn", "refuse", "off")
+
+# Temporary label and property of restored nodes without a uid, see restore_snapshot
+SNAPSHOT_LABEL = "_SnapshotNode"
+SNAPSHOT_ID = "_snapshot_id"
+
+
+def label_scans(plan):
+    """Return the scan operators in a query plan as returned over Bolt."""
+    scans = []
+    if plan:
+        if plan.get("operatorType", "").startswith(SCAN_OPERATORS):
+            scans.append("%s(%s)" % (plan["operatorType"], ", ".join(plan.get("identifiers", ()))))
+        for child in plan.get("children", ()):
+            scans.extend(label_scans(child))
+    return scans
+
+
+def changes_graph(method):
+    """Bump the graph generation once method returns or fails.
+
+    Cached query results are thereby invalidated even if an import
+    fails part way, after some of its statements have been committed.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.bump_generation()
+    return wrapper
+
+
+def partition_rows(rows, keys, n):
+    """Split rows into at most n partitions that share no key value.
+
+    Rows are connected if they share a value in any of the keys fields
+    (e.g. the start or end node of a relationship), and connected rows
+    always end up in the same partition. The resulting groups are
+    assigned largest first to the partition with the fewest rows. Rows
+    keep their order within a partition.
+    """
+    parent = {}
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for row in rows:
+        values = [row[key] for key in keys]
+        for value in values:
+            parent.setdefault(value, value)
+        root = find(values[0])
+        for value in values[1:]:
+            other = find(value)
+            if other != root:
+                parent[other] = root
+    groups = {}
+    for i, row in enumerate(rows):
+        groups.setdefault(find(row[keys[0]]), []).append(i)
+    bins = [(0, p) for p in range(n)]
+    assignment = [[] for _ in range(n)]
+    for group in sorted(groups.values(), key=len, reverse=True):
+        size, p = heapq.heappop(bins)
+        assignment[p].extend(group)
+        heapq.heappush(bins, (size + len(group), p))
+    return [[rows[i] for i in sorted(part)] for part in assignment if part]
 
 
 class WorkflowGraphDatabase:
 
-    def __init__(self, url, username, password):
-        """ Init method. """
+    def __init__(self, url, username, password, cache_entries=256, cache_bytes=64 * 1024 * 1024,
+                 cache_ttl=3600, profile=False, progress_callback=None, progress_interval=10,
+                 plan_check="warn"):
+        """ Init method.
+
+        With profile=True, import statements are run with PROFILE and
+        their db hits are recorded in self.import_metrics. If given,
+        progress_callback(event, info) is called with event "start" and
+        "end" around every import statement and with event "progress"
+        every progress_interval seconds while a statement is running.
+
+        Before an import statement runs, its plan is checked for label
+        scans, see check_plan. Depending on plan_check, a warning is
+        printed ("warn"), the statement is refused with a RuntimeError
+        ("refuse") or the check is skipped ("off").
+        """
+        if plan_check not in PLAN_CHECKS:
+            raise ValueError("plan_check has to be one of %s" % ", ".join(PLAN_CHECKS))
         self.graph = Graph(url, user=username, password=password)
-        self.components = {
-            'Nodes': {
-                'Tool': 'Tool',
-                'Version': 'Version',
-                'ToolOutput': 'ToolOutput',
-                'ToolInput': 'ToolInput',
-                'WorkflowConnection': 'WorkflowConnection',
-                'Workflow': 'Workflow',
-                'Datatype': 'Datatype',
-                'EDAMFormat': 'EDAMFormat',
-                'InTool': 'Tool',
-                'OutTool': 'Tool',
-                'InToolV': 'Version',
-                'OutToolV': 'Version',
-                'ToolUsage': 'ToolUsage'
-            },
-            'Relationships': {
-                'Tool_to_Version': 'HAS_VERSION',
-                'Version_to_ToolOutput': 'GENERATES_OUTPUT',
-                'Version_to_ToolInput': 'FEEDS_INTO',
-                'WorkflowConnection_to_ToolOutput': 'IS_CONNECTED_BY',
-                'WorkflowConnection_to_ToolInput': 'TO_INPUT',
-                'Workflow': 'WORKFLOW',
-                'ToolOutput_to_Datatype': 'HAS_DATATYPE',
-                'ToolInput_to_Datatype': 'HAS_DATATYPE',
-                'Datatype_to_EDAMFormat': 'IS_OF_FORMAT',
-                'Version_to_Usage': 'USAGE'
-            }
-        }
+        self.components = copy.deepcopy(COMPONENTS)
+        # incremented by every method changing the graph, see run_query
+        self.generation = 0
+        self.query_cache = QueryCache(cache_entries, cache_bytes, cache_ttl)
+        self.import_metrics = ImportMetrics()
+        self.profile = profile
+        self.progress_callback = progress_callback
+        self.progress_interval = progress_interval
+        self.plan_check = plan_check
+        self._checked_plans = {}
+        self._schema_ready = False
+
+    def _run_statement(self, query, phase, parameters=None, schema=False, sweep=False):
+        """Run an import statement and record its metrics.
 
-    def create_graph_bulk_merge(self, wf_file_path, tool_usage_file_path):
+        Records the duration and the summary counters (nodes and
+        relationships created, properties set, indexes added, ...) of
+        the statement in self.import_metrics, plus its db hits if
+        profiling is enabled. Schema statements are neither profiled
+        nor checked for label scans, sweeps (statements meant to visit
+        all nodes of a label) are not checked for label scans.
+        """
+        if not query.strip():
+            return None
+        if not (schema or sweep):
+            self._enforce_plan(query, parameters)
+        info = {'phase': phase, 'statement': ' '.join(query.split())}
+        done = threading.Event()
+        if self.progress_callback is not None:
+            self.progress_callback('start', info)
+            threading.Thread(target=self._report_progress, args=(info, done), daemon=True).start()
+        s_time = time.time()
+        try:
+            profile = self.profile and not schema
+            cursor = self.graph.run("PROFILE " + query if profile else query, parameters)
+            counters = cursor.stats()
+        finally:
+            done.set()
+        e_time = time.time()
+        record = self.import_metrics.add(phase, query, e_time - s_time, counters,
+                                         sum_db_hits(cursor.plan()) if profile else None)
+        print("  %s statement %d: %.1f seconds, %d nodes and %d relationships created, %d properties set" % (
+            phase, record['index'], record['seconds'], record['nodes_created'],
+            record['relationships_created'], record['properties_set']))
+        if self.progress_callback is not None:
+            self.progress_callback('end', record)
+        return cursor
+
+    def _report_progress(self, info, done):
+        """Call the progress callback periodically until done is set."""
+        s_time = time.time()
+        while not done.wait(self.progress_interval):
+            try:
+                nodes = self.graph.run("MATCH (n) RETURN count(n)").evaluate()
+            except Exception:
+                nodes = None
+            if done.is_set():
+                break
+            self.progress_callback('progress', dict(info, elapsed=time.time() - s_time, nodes=nodes))
+
+    def _existing_indexes(self):
+        """Return the single property indexes as {(label, prop): unique}."""
+        existing = {}
+        for index in self.graph.run("CALL db.indexes()").data():
+            # column names differ between Neo4j 3.5 and 4.x
+            labels = index.get("tokenNames") or index.get("labelsOrTypes") or []
+            properties = index.get("properties") or []
+            if len(labels) == 1 and len(properties) == 1:
+                existing[(labels[0], properties[0])] = (
+                    index.get("type") == "node_unique_property" or index.get("uniqueness") == "UNIQUE"
+                )
+        return existing
+
+    def ensure_schema(self, timeout=300, schema=SCHEMA):
+        """Create the indexes and uniqueness constraints of graph_model.SCHEMA.
+
+        Only missing indexes and constraints are created, so this can be
+        run before every import. A plain index is replaced by a
+        constraint where SCHEMA asks for uniqueness. Waits up to timeout
+        seconds for all indexes to come online. Another list of (label,
+        property, unique) entries can be passed as schema.
+        """
+        existing = self._existing_indexes()
+        for label, prop, unique in schema:
+            if (label, prop) in existing:
+                if existing[(label, prop)] or not unique:
+                    continue
+                self._run_statement("DROP INDEX ON :`%s`(`%s`)" % (label, prop), "schema", schema=True)
+            self._run_statement(schema_statement(label, prop, unique), "schema", schema=True)
+        self.graph.run("CALL db.awaitIndexes(%d)" % timeout)
+        # new indexes change the plans of statements checked before
+        self._checked_plans.clear()
+        self._schema_ready = True
+
+    def _prepare_schema(self):
+        """Make sure the schema is in place before the first import."""
+        if not self._schema_ready:
+            self.ensure_schema()
+
+    def check_plan(self, query, parameters=None):
+        """Return the label and all nodes scans in the plan of a query.
+
+        The query is only explained, not run. Import statements are
+        expected to find every node they match or merge by an index seek
+        or by expanding from an already found node.
+        """
+        return label_scans(self.graph.run("EXPLAIN " + query, parameters).plan())
+
+    def _enforce_plan(self, query, parameters=None):
+        """Warn about or refuse an import statement planned with label scans.
+
+        Every distinct query text is only explained once, the batches of
+        a statement share its plan.
+        """
+        if self.plan_check == "off":
+            return
+        scans = self._checked_plans.get(query)
+        if scans is None:
+            scans = self._checked_plans[query] = self.check_plan(query, parameters)
+        elif not scans or self.plan_check == "warn":
+            # already warned about
+            return
+        if scans:
+            message = "Plan of import statement scans %s: %s" % (", ".join(scans), " ".join(query.split()))
+            if self.plan_check == "refuse":
+                raise RuntimeError(message)
+            print("WARNING: " + message)
+
+    def bump_generation(self):
+        """Mark the graph as changed, invalidating all cached query results."""
+        self.generation += 1
+
+    def run_query(self, query, parameters=None, use_cache=True):
+        """Run a Cypher query and return its records as a list of dicts.
+
+        Results of read-only queries are cached by normalized query text
+        and parameters until the graph generation changes, the entry
+        expires or gets evicted. Queries that may write bypass the cache
+        and bump the generation.
+        """
+        if not is_read_only(query):
+            try:
+                return self.graph.run(query, parameters).data()
+            finally:
+                self.bump_generation()
+        if not use_cache:
+            return self.graph.run(query, parameters).data()
+        key = self.query_cache.make_key(query, parameters)
+        generation = self.generation
+        found, result = self.query_cache.get(key, generation)
+        if not found:
+            result = self.graph.run(query, parameters).data()
+            self.query_cache.put(key, result, generation)
+        return result
+
+    def query_cache_stats(self):
+        """Return hit/miss statistics of the query result cache."""
+        return self.query_cache.stats()
+
+    @changes_graph
+    def delete_all(self):
+        """Delete all nodes and relationships of the graph."""
+        self.graph.delete_all()
+
+    @changes_graph
+    def create_graph_bulk_merge(self, wf_file_path, tool_usage_file_path, wf_ids_file_path=None):
         """
         Create graph database with bulk import
+
+        If wf_ids_file_path is given, e.g. as written by clean_workflows.py,
+        it is used as the file of deduplicated workflow ids instead of
+        deriving one from the workflow file.
         """
         # To make this query work, copy the csv file to /var/lib/neo4j/import/ and just pass the file name for the argument 'wf'
         with open(wf_file_path, 'r') as i:
             # associate db Nodes with csv column names
             wf_column_map = dict(
                 zip(
-                    (
-                        'WfId',
-                        'InTool',
-                        'InToolV',
-                        'ToolOutput',
-                        'OutTool',
-                        'ToolInput',
-                        'OutToolV'
-                    ),
+                    WORKFLOW_COLUMNS,
                     i.readline().strip().split(',')
                 )
             )
-            dirname, basename = os.path.split(wf_file_path)
-            # write deduplicated workflow ids to separate file
-            # for efficient merging
-            wf_ids_seen = set()
-            with open(os.path.join(dirname, 'wf_ids.csv'), 'w') as o:
-                o.write(wf_column_map['WfId'] + '\n')
-                for line in i:
-                    wf_id = line.split(',', maxsplit=1)[0]
-                    if wf_id not in wf_ids_seen:
-                        o.write(wf_id + '\n')
-                        wf_ids_seen.add(wf_id)
+            if wf_ids_file_path is None:
+                dirname, basename = os.path.split(wf_file_path)
+                wf_ids_file_path = os.path.join(dirname, 'wf_ids.csv')
+                # write deduplicated workflow ids to separate file
+                # for efficient merging
+                wf_ids_seen = set()
+                with open(wf_ids_file_path, 'w') as o:
+                    o.write(wf_column_map['WfId'] + '\n')
+                    for line in i:
+                        wf_id = line.split(',', maxsplit=1)[0]
+                        if wf_id not in wf_ids_seen:
+                            o.write(wf_id + '\n')
+                            wf_ids_seen.add(wf_id)
 
         in_tool = '{0}{{name:tc.{1}}}'.format(
             self.components['Nodes']['Tool'],
@@ -119,15 +357,13 @@ class WorkflowGraphDatabase:
             'tool_v'
         )
         
-        tool_usage_node = '{0}{{usage:tup.{1}, name:tup.{1}}}'.format(
+        tool_usage_node = '{0}{{usage:toFloat(tup.{1}), name:tup.{1}}}'.format(
             self.components['Nodes']['ToolUsage'],
             'usage'
         )
 
         wf_query = (
-            "CREATE INDEX ON :Workflow(id);"
-
-            "LOAD CSV WITH HEADERS FROM 'file:///wf_ids.csv' AS tc "
+            "LOAD CSV WITH HEADERS FROM 'file:///{wf_ids_file_name}' AS tc "
             "MERGE (:{workflow});"
 
             "LOAD CSV WITH HEADERS FROM 'file:///{wf_file_name}' AS tc "
@@ -158,6 +394,7 @@ class WorkflowGraphDatabase:
             
         ).format(
             wf_file_name=os.path.basename(wf_file_path),
+            wf_ids_file_name=os.path.basename(wf_ids_file_path),
             tool_usage_file_name=os.path.basename(tool_usage_file_path),
             in_tool=in_tool,
             tv_rel=self.components['Relationships']['Tool_to_Version'],
@@ -181,15 +418,85 @@ class WorkflowGraphDatabase:
 
         print("Creating database in bulk...")
         print(wf_query)
+        self._prepare_schema()
         s_time = time.time()
         for q in wf_query:
-            self.graph.run(q)
-
-        # drop index on Workflow nodes as it was added to speed up the database creation
-        self.graph.schema.drop_index(self.components["Nodes"]["Workflow"], "id")
+            self._run_statement(q, "workflows")
+        self.materialize_transitions(wf_file_path)
         e_time = time.time()
         print("Time elapsed in creating database: %d seconds" % int(e_time - s_time))
 
+    @changes_graph
+    def materialize_transitions(self, wf_file_path, batch_size=1000):
+        """Replace the FOLLOWED_BY relationships by those of a workflow file.
+
+        For every pair of tools, and of tool versions, connected in a
+        workflow, a (:Tool)-[:FOLLOWED_BY]->(:Tool) and a
+        (:Version)-[:FOLLOWED_BY]->(:Version) relationship is created,
+        with the number of distinct workflows and of connections between
+        them as workflows and connections properties. They are counted
+        on the client with graph_model.count_transitions, so the file
+        has to be readable locally. Existing FOLLOWED_BY relationships
+        are deleted first, so that reloading the data updates them.
+        """
+        tools, versions = count_transitions(iter_rows(wf_file_path))
+        tool_label = self.components["Nodes"]["Tool"]
+        version_label = self.components["Nodes"]["Version"]
+        rels = self.components["Relationships"]
+        for label, rel_type in ((tool_label, rels["Tool_to_Tool"]), (version_label, rels["Version_to_Version"])):
+            self._run_statement(
+                "MATCH (:{label})-[r:{rel_type}]->(:{label}) DELETE r".format(label=label, rel_type=rel_type),
+                "transitions", sweep=True
+            )
+        tool_query = (
+            "UNWIND $rows AS row "
+            "MATCH (a:{tool} {{name: row.start}}) "
+            "MATCH (b:{tool} {{name: row.end}}) "
+            "CREATE (a)-[r:{rel_type}]->(b) "
+            "SET r = row.props"
+        ).format(tool=tool_label, rel_type=rels["Tool_to_Tool"])
+        version_query = (
+            "UNWIND $rows AS row "
+            "MATCH (:{tool} {{name: row.start_tool}})-[:{tv_rel}]->(a:{version} {{name: row.start}}) "
+            "MATCH (:{tool} {{name: row.end_tool}})-[:{tv_rel}]->(b:{version} {{name: row.end}}) "
+            "CREATE (a)-[r:{rel_type}]->(b) "
+            "SET r = row.props"
+        ).format(tool=tool_label, version=version_label, tv_rel=rels["Tool_to_Version"], rel_type=rels["Version_to_Version"])
+        tool_rows = [
+            {"start": start, "end": end, "props": props}
+            for (start, end), props in tools.items()
+        ]
+        version_rows = [
+            {"start_tool": start_tool, "start": start, "end_tool": end_tool, "end": end, "props": props}
+            for (start_tool, start, end_tool, end), props in versions.items()
+        ]
+        for query, rows in ((tool_query, tool_rows), (version_query, version_rows)):
+            for i in range(0, len(rows), batch_size):
+                self._run_statement(query, "transitions", {"rows": rows[i:i + batch_size]})
+        print("Materialized %d tool and %d version transitions" % (len(tool_rows), len(version_rows)))
+
+    @changes_graph
+    def write_usage_series(self, usage_series, batch_size=1000):
+        """Store the monthly usage series of tool versions on their Version nodes.
+
+        Sets the properties of usage_series.UsageSeries.properties, the
+        monthly counts and their rolling totals and trend, as numbers on
+        the Version nodes of all tool versions in usage_series. Versions
+        missing from the graph are skipped. Rewriting them after a month
+        has been appended to the series updates them in place.
+        """
+        self._prepare_schema()
+        query = (
+            "UNWIND $rows AS row "
+            "MATCH (:{tool} {{name: row.tool}})-[:{tv_rel}]->(v:{version} {{name: row.version}}) "
+            "SET v += row.props"
+        ).format(tool=self.components["Nodes"]["Tool"], version=self.components["Nodes"]["Version"],
+                 tv_rel=self.components["Relationships"]["Tool_to_Version"])
+        rows = list(usage_series.iter_graph_rows())
+        for i in range(0, len(rows), batch_size):
+            self._run_statement(query, "usage_series", {"rows": rows[i:i + batch_size]})
+        print("Wrote usage series of %d tool versions" % len(rows))
+
     def _build_load_io_data_from_csv(self, column_map, file_name):
         """
         Build query string for bulk import of Tools IO data.
@@ -223,10 +530,6 @@ class WorkflowGraphDatabase:
         )
 
         query = (
-            "CREATE INDEX ON :Tool(name);"
-            "CREATE INDEX ON :Datatype(name);"
-            "CREATE INDEX ON :EDAMFormat(id);"
-
             "LOAD CSV "
             "WITH HEADERS FROM 'file:///{fn}' AS source "
             "WITH source "
@@ -255,6 +558,7 @@ class WorkflowGraphDatabase:
 
         return query
 
+    @changes_graph
     def load_io_data_from_csv(self, file_name, io_node_type):
         """Bulk import Tools IO data into db.
 
@@ -286,19 +590,432 @@ class WorkflowGraphDatabase:
         print(query)
 
         print("Creating database in bulk...")
+        self._prepare_schema()
         s_time = time.time()
         for q in query:
-            self.graph.run(q)
+            self._run_statement(q, io_node_type)
         e_time = time.time()
         print("Time elapsed in creating database: %d seconds" % int(e_time - s_time))
 
+    @changes_graph
+    def ingest_streamed(self, tool_inputs_file, tool_outputs_file, workflow_file, tool_usage_file,
+                        batch_size=1000, workers=4, max_retries=5):
+        """Import all data files over Bolt in parameterized batches.
+
+        In contrast to load_io_data_from_csv and create_graph_bulk_merge,
+        the CSV files are read on the client, so they do not have to be
+        copied to the server's /import folder first.
+
+        The files are resolved with graph_model.GraphBuilder and nodes
+        are merged on the deterministic ids stored as their uid property,
+        so this mode should be used on an empty database or one built
+        with it before.
+        """
+        builder = GraphBuilder.from_csv_files(
+            tool_inputs_file=tool_inputs_file,
+            tool_outputs_file=tool_outputs_file,
+            workflow_file=workflow_file,
+            tool_usage_file=tool_usage_file
+        )
+        return self.write_graph_streamed(builder.nodes, builder.relationships,
+                                         batch_size=batch_size, workers=workers,
+                                         max_retries=max_retries)
+
+    @changes_graph
+    def write_graph_streamed(self, nodes, relationships, batch_size=1000, workers=4, max_retries=5,
+                             labels=None):
+        """Merge nodes and relationships into the db with UNWIND $rows batches.
+
+        nodes and relationships are expected in the format of the
+        corresponding graph_model.GraphBuilder attributes. If
+        relationships connect nodes not in nodes, labels has to map the
+        ids of all nodes to their labels. Rows are split
+        into one partition per writer thread, see partition_rows, so
+        that concurrent batches never touch the same node: nodes are
+        partitioned by uid and relationships by both of their end nodes,
+        so that all relationships of a hub node (e.g. a Datatype) are
+        written by one thread. Groups dominated by hub nodes are thereby
+        written largely serially. Batches failing with a transient error
+        are still retried up to max_retries times, for lock conflicts
+        with other clients of the database and for locks the server
+        takes beyond the end nodes (e.g. on dense node relationship
+        groups or index entries).
+
+        Returns a dict of ingestion statistics including rows/sec.
+        """
+        stats = {'rows': 0, 'batches': 0, 'retries': 0}
+        s_time = time.time()
+        if labels is None:
+            labels = {uid: label for uid, (label, _) in nodes.items()}
+
+        node_groups = {}
+        for uid, (label, props) in nodes.items():
+            node_groups.setdefault(label, []).append({'uid': uid, 'props': props})
+        rel_groups = {}
+        for (start, rel_type, end), props in relationships.items():
+            key = (labels[start], rel_type, labels[end])
+            rel_groups.setdefault(key, []).append({'start': start, 'end': end, 'props': props})
+
+        self._prepare_schema()
+        print("Streaming %d nodes and %d relationships..." % (len(nodes), len(relationships)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for label, rows in sorted(node_groups.items()):
+                query = (
+                    "UNWIND $rows AS row "
+                    "MERGE (n:{label} {{uid: row.uid}}) "
+                    "SET n += row.props"
+                ).format(label=label)
+                self._write_partitioned(pool, query, rows, ('uid',), batch_size, workers, max_retries, stats)
+            for (start_label, rel_type, end_label), rows in sorted(rel_groups.items()):
+                query = (
+                    "UNWIND $rows AS row "
+                    "MATCH (a:{start_label} {{uid: row.start}}) "
+                    "MATCH (b:{end_label} {{uid: row.end}}) "
+                    "MERGE (a)-[r:{rel_type}]->(b) "
+                    "SET r += row.props"
+                ).format(start_label=start_label, end_label=end_label, rel_type=rel_type)
+                self._write_partitioned(pool, query, rows, ('start', 'end'), batch_size, workers, max_retries,
+                                        stats)
+
+        e_time = time.time()
+        stats['seconds'] = e_time - s_time
+        stats['rows_per_sec'] = stats['rows'] / stats['seconds'] if stats['seconds'] else 0.0
+        print("Time elapsed in streaming database: %d seconds (%d rows/sec, %d retries)" % (
+            int(stats['seconds']), stats['rows_per_sec'], stats['retries']))
+        return stats
+
+    @changes_graph
+    def ingest_delta(self, tool_inputs_file, tool_outputs_file, workflow_file, tool_usage_file,
+                     manifest_file, batch_size=1000, workers=4, max_retries=5):
+        """Apply only the changes of the data files since the last import.
+
+        The rows of every file imported are recorded in manifest_file,
+        see delta_import. On the next call, only the rows added to and
+        removed from the files are turned into the nodes and
+        relationships that need to be created or deleted, and only those
+        are written to the db.
+        Without a manifest, all data is imported, so the first run
+        should target an empty database. Like ingest_streamed, this
+        relies on the uid property of nodes.
+        """
+        manifest = DeltaManifest(manifest_file)
+        try:
+            changes, states = manifest.diff({
+                'tool_outputs': tool_outputs_file,
+                'tool_inputs': tool_inputs_file,
+                'workflows': workflow_file,
+                'tool_usage': tool_usage_file
+            })
+            for kind, (added, removed) in sorted(changes.items()):
+                print("%s: %d rows added, %d rows removed" % (kind, len(added), len(removed)))
+            delta = manifest.graph_delta(changes)
+            print("Graph delta: %s" % delta.summary())
+            if delta:
+                s_time = time.time()
+                self._delete_streamed(delta, batch_size, workers, max_retries)
+                self.write_graph_streamed(delta.added_nodes, delta.added_relationships,
+                                          batch_size=batch_size, workers=workers,
+                                          max_retries=max_retries, labels=delta.labels)
+                e_time = time.time()
+                print("Time elapsed in applying delta: %d seconds" % int(e_time - s_time))
+            manifest.update(states)
+        finally:
+            manifest.close()
+        return delta.summary()
+
+    @changes_graph
+    def _delete_streamed(self, delta, batch_size, workers, max_retries):
+        """Delete the relationships and nodes removed in a GraphDelta."""
+        self._prepare_schema()
+        stats = {'rows': 0, 'batches': 0, 'retries': 0}
+        rel_groups = {}
+        for (start, rel_type, end), (start_label, end_label) in delta.removed_relationships.items():
+            rel_groups.setdefault((start_label, rel_type, end_label), []).append({'start': start, 'end': end})
+        node_groups = {}
+        for uid, label in delta.removed_nodes.items():
+            node_groups.setdefault(label, []).append({'uid': uid})
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for (start_label, rel_type, end_label), rows in sorted(rel_groups.items()):
+                query = (
+                    "UNWIND $rows AS row "
+                    "MATCH (:{start_label} {{uid: row.start}})-[r:{rel_type}]->(:{end_label} {{uid: row.end}}) "
+                    "DELETE r"
+                ).format(start_label=start_label, end_label=end_label, rel_type=rel_type)
+                self._write_partitioned(pool, query, rows, ('start', 'end'), batch_size, workers, max_retries,
+                                        stats)
+            for label, rows in sorted(node_groups.items()):
+                query = (
+                    "UNWIND $rows AS row "
+                    "MATCH (n:{label} {{uid: row.uid}}) "
+                    "DETACH DELETE n"
+                ).format(label=label)
+                self._write_partitioned(pool, query, rows, ('uid',), batch_size, workers, max_retries, stats)
+        return stats
+
+    def _write_partitioned(self, pool, query, rows, keys, batch_size, workers, max_retries, stats):
+        """Write rows in parallel, one partition of rows per writer thread.
+
+        Rows sharing a value of any of the keys fields are written by
+        the same thread, see partition_rows.
+        """
+        self._enforce_plan(query, {'rows': rows[:1]})
+        futures = [
+            pool.submit(self._write_batches, query, part, batch_size, max_retries)
+            for part in partition_rows(rows, keys, workers)
+        ]
+        for future in futures:
+            batches, retries = future.result()
+            stats['batches'] += batches
+            stats['retries'] += retries
+        stats['rows'] += len(rows)
+
+    def _write_batches(self, query, rows, batch_size, max_retries):
+        """Run query for consecutive batches of rows, retrying transient errors."""
+        batches = retries = 0
+        for i in range(0, len(rows), batch_size):
+            batch = rows[i:i + batch_size]
+            for attempt in range(max_retries + 1):
+                try:
+                    self.graph.run(query, rows=batch).stats()
+                    break
+                except TransientError:
+                    if attempt == max_retries:
+                        raise
+                    retries += 1
+                    time.sleep(0.1 * 2 ** attempt)
+            batches += 1
+        return batches, retries
+
+    def iter_nodes(self, labels=None):
+        """Iterate over the nodes of the graph.
+
+        Yields dicts with the id, labels and properties of every node,
+        restricted to nodes carrying any of labels if given. Every label
+        is read by a label scan of its own that skips the nodes of the
+        labels read before it. Each query runs once and its records are
+        read from the cursor, which Bolt fills in batches, so the client
+        never holds more than a batch of them.
+        """
+        returns = "RETURN id(n) AS id, labels(n) AS labels, properties(n) AS properties"
+        if not labels:
+            yield from self._stream("MATCH (n) " + returns)
+            return
+        labels = list(labels)
+        for i, label in enumerate(labels):
+            query = "MATCH (n:`{label}`) WHERE none(l IN labels(n) WHERE l IN $seen) ".format(label=label)
+            yield from self._stream(query + returns, seen=labels[:i])
+
+    def iter_relationships(self, types=None):
+        """Iterate over the relationships of the graph.
+
+        Yields dicts with the id, type, start and end node id and the
+        properties of every relationship, restricted to the given types,
+        and the first label and uid property (or None) of its start and
+        end node as start_label, start_uid, end_label and end_uid.
+        Every type is read by a query of its own, streamed like in
+        iter_nodes.
+        """
+        returns = (
+            "RETURN id(r) AS id, type(r) AS type, id(a) AS start, id(b) AS end, "
+            "properties(r) AS properties, head(labels(a)) AS start_label, a.uid AS start_uid, "
+            "head(labels(b)) AS end_label, b.uid AS end_uid"
+        )
+        if not types:
+            yield from self._stream("MATCH (a)-[r]->(b) " + returns)
+            return
+        for rel_type in dict.fromkeys(types):
+            yield from self._stream("MATCH (a)-[r:`{rel_type}`]->(b) ".format(rel_type=rel_type) + returns)
+
+    def _stream(self, query, **parameters):
+        for record in self.graph.run(query, parameters):
+            yield record.data()
+
+    def export_snapshot(self, file_name):
+        """Write the graph and its schema to a snapshot file.
+
+        Nodes and relationships are streamed with iter_nodes and
+        iter_relationships and written one by one, so they are never
+        all held in memory. See graph_snapshot for the file format.
+        Returns the number of nodes and relationships written.
+        """
+        s_time = time.time()
+        schema = sorted((label, prop, unique) for (label, prop), unique in self._existing_indexes().items())
+        n_nodes, n_rels = write_snapshot(file_name, schema, self.iter_nodes(),
+                                         self.iter_relationships())
+        e_time = time.time()
+        print("Exported %d nodes and %d relationships to %s" % (n_nodes, n_rels, file_name))
+        print("Time elapsed in exporting snapshot: %d seconds" % int(e_time - s_time))
+        return n_nodes, n_rels
+
+    @changes_graph
+    def restore_snapshot(self, file_name, batch_size=1000, max_retries=5):
+        """Load a snapshot written by export_snapshot into an empty graph.
+
+        Raises a RuntimeError if the graph is not empty. Nodes are
+        created with plain CREATE in batches of batch_size nodes with
+        the same labels. The indexes and constraints of
+        graph_model.SCHEMA and of the snapshot are created once all
+        nodes exist, then the relationships are created in batches per
+        type and end node labels, finding their end nodes through the
+        uid constraints. Nodes without a uid property (e.g. of a graph
+        imported with LOAD CSV, or of any version 1 snapshot) are
+        found by their snapshot id, which they carry as the indexed
+        SNAPSHOT_ID property of the SNAPSHOT_LABEL label until all
+        relationships are restored. Only one batch per label
+        combination and relationship group is buffered while reading,
+        so memory use does not depend on the size of the graph.
+        Transient errors are retried like in write_graph_streamed.
+        """
+        n_nodes = self.graph_statistics()['nodes']
+        if n_nodes:
+            raise RuntimeError("Cannot restore %s into a graph of %d nodes, delete it first" % (
+                file_name, n_nodes))
+        print("Restoring snapshot %s..." % file_name)
+        s_time = time.time()
+        header, records = read_snapshot(file_name)
+        # relationships of version 1 snapshots do not name the uids of their nodes
+        uids_known = header['version'] >= 2
+        node_rows = {}
+        rel_rows = {}
+        stats = {'nodes': 0, 'relationships': 0, 'batches': 0, 'retries': 0, 'snapshot_ids': 0}
+
+        def flush_nodes(key):
+            labels, tagged = key
+            query = (
+                "UNWIND $rows AS row "
+                "CREATE (n{labels}) "
+                "SET n = row.properties{tag}"
+            ).format(labels="".join(":`%s`" % label for label in labels + ((SNAPSHOT_LABEL,) if tagged else ())),
+                     tag=", n.`%s` = row.id" % SNAPSHOT_ID if tagged else "")
+            rows = node_rows.pop(key)
+            self._restore_batch(query, rows, max_retries, stats)
+            stats['nodes'] += len(rows)
+            if tagged:
+                stats['snapshot_ids'] += len(rows)
+
+        def node_pattern(var, label, by_uid):
+            if by_uid:
+                return "(%s:`%s` {uid: row.%s})" % (var, label, "start" if var == "a" else "end")
+            return "(%s:`%s` {`%s`: row.%s})" % (var, SNAPSHOT_LABEL, SNAPSHOT_ID, "start" if var == "a" else "end")
+
+        def flush_relationships(key):
+            rel_type, start_label, start_by_uid, end_label, end_by_uid = key
+            query = (
+                "UNWIND $rows AS row "
+                "MATCH {start} "
+                "MATCH {end} "
+                "CREATE (a)-[r:`{rel_type}`]->(b) "
+                "SET r = row.properties"
+            ).format(start=node_pattern("a", start_label, start_by_uid),
+                     end=node_pattern("b", end_label, end_by_uid), rel_type=rel_type)
+            rows = rel_rows.pop(key)
+            self._restore_batch(query, rows, max_retries, stats)
+            stats['relationships'] += len(rows)
+
+        def finish_nodes():
+            for key in list(node_rows):
+                flush_nodes(key)
+            # indexes are built once over all nodes instead of updated per batch
+            schema = {}
+            for label, prop, unique in tuple(SCHEMA) + tuple(tuple(entry) for entry in header['schema']):
+                schema[(label, prop)] = schema.get((label, prop), False) or unique
+            if stats['snapshot_ids']:
+                schema[(SNAPSHOT_LABEL, SNAPSHOT_ID)] = True
+            self.ensure_schema(schema=[key + (unique,) for key, unique in schema.items()])
+
+        nodes_done = False
+        for record in records:
+            if 'type' not in record:
+                props = record['properties']
+                key = (tuple(record['labels']),
+                       not (uids_known and 'uid' in props and record['labels']))
+                rows = node_rows.setdefault(key, [])
+                rows.append({'id': record['id'], 'properties': props})
+                if len(rows) >= batch_size:
+                    flush_nodes(key)
+                continue
+            if not nodes_done:
+                finish_nodes()
+                nodes_done = True
+            start_uid = record.get('start_uid') if uids_known and record.get('start_label') else None
+            end_uid = record.get('end_uid') if uids_known and record.get('end_label') else None
+            key = (record['type'], record.get('start_label'), start_uid is not None,
+                   record.get('end_label'), end_uid is not None)
+            rows = rel_rows.setdefault(key, [])
+            rows.append({'start': record['start'] if start_uid is None else start_uid,
+                         'end': record['end'] if end_uid is None else end_uid,
+                         'properties': record['properties']})
+            if len(rows) >= batch_size:
+                flush_relationships(key)
+        if not nodes_done:
+            finish_nodes()
+        for key in list(rel_rows):
+            flush_relationships(key)
+        if stats['snapshot_ids']:
+            self._remove_snapshot_ids(batch_size, max_retries, stats)
+        e_time = time.time()
+        print("Restored %d nodes and %d relationships in %d batches (%d retries)" % (
+            stats['nodes'], stats['relationships'], stats['batches'], stats['retries']))
+        print("Time elapsed in restoring snapshot: %d seconds" % int(e_time - s_time))
+        return stats
+
+    def _remove_snapshot_ids(self, batch_size, max_retries, stats):
+        """Remove the snapshot ids of restored nodes and their index."""
+        query = (
+            "MATCH (n:`{label}`) WITH n LIMIT {batch_size} "
+            "REMOVE n:`{label}`, n.`{prop}` "
+            "RETURN count(n) AS removed"
+        ).format(label=SNAPSHOT_LABEL, prop=SNAPSHOT_ID, batch_size=int(batch_size))
+        while self._restore_batch(query, [], max_retries, stats)[0]['removed']:
+            pass
+        self.graph.run("DROP CONSTRAINT ON (n:`%s`) ASSERT n.`%s` IS UNIQUE" % (SNAPSHOT_LABEL, SNAPSHOT_ID))
+
+    def _restore_batch(self, query, rows, max_retries, stats):
+        """Run query for one batch of rows, retrying transient errors."""
+        for attempt in range(max_retries + 1):
+            try:
+                records = self.graph.run(query, rows=rows).data()
+                break
+            except TransientError:
+                if attempt == max_retries:
+                    raise
+                stats['retries'] += 1
+                time.sleep(0.1 * 2 ** attempt)
+        stats['batches'] += 1
+        return records
+
+    def graph_statistics(self):
+        """Return node and relationship counts per label and type.
+
+        All counts are answered from the count store, so nothing gets
+        materialized, regardless of the size of the graph.
+        """
+        stats = {
+            'nodes': self.graph.run("MATCH (n) RETURN count(n)").evaluate(),
+            'relationships': self.graph.run("MATCH ()-[r]->() RETURN count(r)").evaluate(),
+            'labels': {},
+            'relationship_types': {}
+        }
+        for label in self.graph.run("CALL db.labels() YIELD label RETURN label").data():
+            stats['labels'][label['label']] = self.graph.run(
+                "MATCH (n:`{0}`) RETURN count(n)".format(label['label'])).evaluate()
+        for rel_type in self.graph.run(
+                "CALL db.relationshipTypes() YIELD relationshipType RETURN relationshipType").data():
+            stats['relationship_types'][rel_type['relationshipType']] = self.graph.run(
+                "MATCH ()-[r:`{0}`]->() RETURN count(r)".format(rel_type['relationshipType'])).evaluate()
+        return stats
+
     def fetch_records(self):
         print("Fetching records...")
         print()
         s_time = time.time()
-        get_all_nodes_query = "MATCH (n) RETURN n"
-        all_nodes = self.graph.run(get_all_nodes_query).data()
-        print("Number of all nodes: %d" % len(all_nodes))
+        stats = self.graph_statistics()
+        print("Number of all nodes: %d" % stats['nodes'])
+        for label, count in sorted(stats['labels'].items()):
+            print("  %s: %d" % (label, count))
+        print("Number of all relationships: %d" % stats['relationships'])
+        for rel_type, count in sorted(stats['relationship_types'].items()):
+            print("  %s: %d" % (rel_type, count))
         print()
         e_time = time.time()
         print("Time elapsed in fetching records: %d seconds" % int(e_time - s_time))
@@ -314,6 +1031,20 @@ if __name__ == "__main__":
     arg_parser.add_argument("-to", "--tool_outputs_file", required=True, help="Tool outputs file")
     arg_parser.add_argument("-wf", "--workflow_file", required=True, help="Workflow file")
     arg_parser.add_argument("-tuf", "--tool_usage_file", required=True, help="Tool usage file")
+    arg_parser.add_argument("-wfi", "--workflow_ids_file", help="Deduplicated workflow ids file (written by clean_workflows.py)")
+    arg_parser.add_argument("-m", "--mode", default="csv", choices=["csv", "streamed", "delta"],
+                            help="Import with LOAD CSV from the server's import folder, stream the files over Bolt "
+                                 "or stream only the changes since the last delta import")
+    arg_parser.add_argument("-dm", "--delta_manifest", default="graph_manifest.db",
+                            help="Manifest of the rows imported by the last delta import")
+    arg_parser.add_argument("-bs", "--batch_size", type=int, default=1000, help="Rows per batch in streamed mode")
+    arg_parser.add_argument("-w", "--workers", type=int, default=4, help="Writer threads in streamed mode")
+    arg_parser.add_argument("-mr", "--metrics_report", help="Write per-statement import metrics to this JSON or CSV file")
+    arg_parser.add_argument("--profile", action="store_true", help="Profile import statements to record their db hits")
+    arg_parser.add_argument("-pc", "--plan_check", default="warn", choices=["warn", "refuse", "off"],
+                            help="Warn about or refuse import statements whose plan scans all nodes of a label")
+    arg_parser.add_argument("-es", "--export_snapshot", help="Write a snapshot of the imported graph to this file")
+    arg_parser.add_argument("-us", "--usage_series", help="Usage series file (written by usage_series.py) to store on the Version nodes")
     args = vars(arg_parser.parse_args())
     url = args["url"]
     username = args["user_name"]
@@ -324,13 +1055,29 @@ if __name__ == "__main__":
     workflow_file = args["workflow_file"]
     tool_usage_file = args["tool_usage_file"]
     # connect to neo4j database
-    graph_db = WorkflowGraphDatabase(url, username, password)
+    graph_db = WorkflowGraphDatabase(url, username, password, profile=args["profile"], plan_check=args["plan_check"])
     # create a database after deleting the existing records
     if create_db == "true":
-        n = graph_db.graph.delete_all()
-        assert n == None
-    graph_db.load_io_data_from_csv(t_output_file, "ToolOutput")
-    graph_db.load_io_data_from_csv(t_inputs_file, "ToolInput")
-    graph_db.create_graph_bulk_merge(workflow_file, tool_usage_file)
+        graph_db.delete_all()
+        if args["mode"] == "delta":
+            manifest = DeltaManifest(args["delta_manifest"])
+            manifest.reset()
+            manifest.close()
+    if args["mode"] == "delta":
+        graph_db.ingest_delta(t_inputs_file, t_output_file, workflow_file, tool_usage_file,
+                              args["delta_manifest"], batch_size=args["batch_size"], workers=args["workers"])
+    elif args["mode"] == "streamed":
+        graph_db.ingest_streamed(t_inputs_file, t_output_file, workflow_file, tool_usage_file,
+                                 batch_size=args["batch_size"], workers=args["workers"])
+    else:
+        graph_db.load_io_data_from_csv(t_output_file, "ToolOutput")
+        graph_db.load_io_data_from_csv(t_inputs_file, "ToolInput")
+        graph_db.create_graph_bulk_merge(workflow_file, tool_usage_file, args["workflow_ids_file"])
+    if args["usage_series"]:
+        graph_db.write_usage_series(UsageSeries.load(args["usage_series"]))
+    if args["metrics_report"]:
+        graph_db.import_metrics.write_report(args["metrics_report"])
+    if args["export_snapshot"]:
+        graph_db.export_snapshot(args["export_snapshot"])
     # run queries against database
     graph_db.fetch_records()
@@ -0,0 +1,417 @@
+"""Compute incremental changes between two imports of the workflow graph.
+
+A DeltaManifest remembers the rows of every input file that went into
+the last import as row hashes with the few fields the graph is built
+from (see ROW_FIELDS) and the number of identical rows, and how many of
+those rows contribute every node and relationship of the graph. Comparing it with the current files
+yields the rows that were added and removed. Only those rows are
+resolved into nodes and relationships, and the reference counts tell
+which of them actually have to be created or deleted in the database:
+a Tool shared by many rows is only deleted with the last row using it.
+
+FOLLOWED_BY relationships count the workflows and connections they
+stand for, so the manifest counts the connections of every transition
+per workflow and the changed counts are written again. Like in a full
+import, identical workflow rows are counted as separate connections.
+
+The manifest is an SQLite database, so a delta only reads the rows and
+counts it touches. The hashes of a changed input file are streamed into
+a temporary table and compared there, which keeps the memory use
+proportional to the number of changed rows rather than to the size of
+the graph.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+from collections import Counter
+
+from graph_model import COMPONENTS, GraphBuilder, iter_rows
+
+
+# Input files of the graph in the order they are imported
+FILE_KINDS = ('tool_outputs', 'tool_inputs', 'workflows', 'tool_usage')
+
+# Fields of the rows of every file kind the graph elements depend on
+ROW_FIELDS = {
+    'tool_outputs': (0, 1, 2, 3, 4),
+    'tool_inputs': (0, 1, 2, 3, 4),
+    'workflows': (0, 1, 2, 3, 4, 5, 6),
+    'tool_usage': (0, 1, 3)
+}
+
+# Relationship types whose properties count workflows and connections
+TRANSITION_TYPES = frozenset(
+    COMPONENTS['Relationships'][rel] for rel in ('Tool_to_Tool', 'Version_to_Version')
+)
+
+MANIFEST_VERSION = 3
+
+_TABLES = (
+    'CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)',
+    'CREATE TABLE IF NOT EXISTS files (kind TEXT PRIMARY KEY, digest TEXT)',
+    'CREATE TABLE IF NOT EXISTS rows ('
+    'kind TEXT, hash TEXT, key TEXT, count INTEGER, PRIMARY KEY (kind, hash)) WITHOUT ROWID',
+    'CREATE TABLE IF NOT EXISTS nodes ('
+    'uid TEXT PRIMARY KEY, label TEXT, refs INTEGER) WITHOUT ROWID',
+    'CREATE TABLE IF NOT EXISTS relationships ('
+    'start_id TEXT, type TEXT, end_id TEXT, refs INTEGER, '
+    'PRIMARY KEY (start_id, type, end_id)) WITHOUT ROWID',
+    'CREATE TABLE IF NOT EXISTS transitions ('
+    'start_id TEXT, type TEXT, end_id TEXT, wf_id TEXT, connections INTEGER, '
+    'PRIMARY KEY (start_id, type, end_id, wf_id)) WITHOUT ROWID'
+)
+
+
+def row_hash(row):
+    """Return the hash identifying a CSV row."""
+
+    return hashlib.sha1(
+        '\x1f'.join(row).encode('utf-8')
+    ).hexdigest()[:16]
+
+
+def row_key(kind, row):
+    """Return the fields of a row of kind listed in ROW_FIELDS."""
+
+    return tuple(row[i] if i < len(row) else '' for i in ROW_FIELDS[kind])
+
+
+def file_digest(file_name):
+    """Return the sha1 hex digest of the content of a file."""
+
+    h = hashlib.sha1()
+    with open(file_name, 'rb') as i:
+        for chunk in iter(lambda: i.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def add_row_key(builder, kind, key):
+    """Add the row_key of a row of kind to a GraphBuilder."""
+
+    if kind == 'workflows':
+        builder.add_workflow_row(key)
+    elif kind == 'tool_usage':
+        builder.add_usage_row((key[0], key[1], '', key[2]))
+    else:
+        builder.add_io_row(key, 'ToolOutput' if kind == 'tool_outputs' else 'ToolInput')
+
+
+def build_graph(rows_by_kind):
+    """Build a GraphBuilder from rows grouped by FILE_KINDS."""
+
+    builder = GraphBuilder()
+    for kind in FILE_KINDS:
+        for row in rows_by_kind.get(kind, ()):
+            add_row_key(builder, kind, row_key(kind, row))
+    return builder
+
+
+def _row_keys(counted_rows):
+    """Return the row_key tuples of (hash, key, count) rows, repeated count times."""
+
+    return [tuple(json.loads(key)) for _, key, count in counted_rows for _ in range(count)]
+
+
+class ElementCounts:
+    """Changes of the reference counts of graph elements by row changes.
+
+    nodes maps node ids to their label, properties and the change of
+    the number of rows using them, relationships maps relationship keys
+    to the change of their count and transitions maps (relationship key,
+    workflow id) to the change of its number of connections.
+    """
+
+    def __init__(self, changes):
+        """changes maps FILE_KINDS to (added, removed) row_key tuples.
+
+        Identical rows are listed as often as they were added or removed.
+        """
+
+        self.nodes = {}
+        self.relationships = {}
+        self.transitions = {}
+        for kind, (added, removed) in changes.items():
+            for rows, sign in ((added, 1), (removed, -1)):
+                for key, count in Counter(rows).items():
+                    self._add(kind, key, sign * count)
+
+    def _add(self, kind, row, sign):
+        builder = GraphBuilder()
+        add_row_key(builder, kind, row)
+        for nid, (label, props) in builder.nodes.items():
+            entry = self.nodes.setdefault(nid, [label, props, 0])
+            entry[2] += sign
+        for key in builder.relationships:
+            if key[1] in TRANSITION_TYPES:
+                # the workflow id is the first field of workflow rows
+                t_key = (key, row[0])
+                self.transitions[t_key] = self.transitions.get(t_key, 0) + sign
+            else:
+                self.relationships[key] = self.relationships.get(key, 0) + sign
+
+    def label(self, nid):
+        return self.nodes[nid][0]
+
+
+class GraphDelta:
+    """Nodes and relationships to add to and remove from the graph.
+
+    added_nodes and added_relationships use the format of the
+    GraphBuilder attributes, removed_nodes and removed_relationships
+    map node ids and relationship keys to the labels of their nodes.
+    labels maps the id of every node of the changed rows, which
+    includes the end nodes of all added relationships, to its label.
+    """
+
+    def __init__(self, added_nodes=None, removed_nodes=None, added_relationships=None,
+                 removed_relationships=None, labels=None):
+        self.added_nodes = added_nodes or {}
+        self.removed_nodes = removed_nodes or {}
+        # a relationship with changed properties is re-added
+        self.added_relationships = added_relationships or {}
+        self.removed_relationships = removed_relationships or {}
+        self.labels = labels or {}
+
+    def __bool__(self):
+        return bool(
+            self.added_nodes or self.removed_nodes
+            or self.added_relationships or self.removed_relationships
+        )
+
+    def summary(self):
+        return {
+            'added_nodes': len(self.added_nodes),
+            'removed_nodes': len(self.removed_nodes),
+            'added_relationships': len(self.added_relationships),
+            'removed_relationships': len(self.removed_relationships)
+        }
+
+
+def _transition_props(connections):
+    """Return the FOLLOWED_BY properties of {wf_id: connections}."""
+
+    return {
+        'workflows': sum(1 for n in connections.values() if n > 0),
+        'connections': sum(connections.values())
+    }
+
+
+class DeltaManifest:
+    """Row hashes and graph element reference counts of the last import.
+
+    Manifests of another version are discarded, so that the next delta
+    imports all data again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._db = self._open()
+
+    def _open(self):
+        db = None
+        if os.path.exists(self.path):
+            try:
+                db = sqlite3.connect(self.path)
+                version = db.execute(
+                    "SELECT value FROM meta WHERE name = 'version'"
+                ).fetchone()
+            except sqlite3.DatabaseError:
+                version = None
+            if version is None or int(version[0]) != MANIFEST_VERSION:
+                print("Discarding manifest %s of another version, all data is imported" % self.path)
+                if db is not None:
+                    db.close()
+                os.remove(self.path)
+                db = None
+        if db is None:
+            db = sqlite3.connect(self.path)
+        for statement in _TABLES:
+            db.execute(statement)
+        db.execute(
+            "INSERT OR IGNORE INTO meta VALUES ('version', ?)", (str(MANIFEST_VERSION),)
+        )
+        db.execute(
+            'CREATE TEMP TABLE IF NOT EXISTS current ('
+            'hash TEXT PRIMARY KEY, key TEXT, count INTEGER) WITHOUT ROWID'
+        )
+        db.commit()
+        return db
+
+    def close(self):
+        self._db.close()
+
+    def rows(self, kind):
+        """Return the row keys of kind recorded in the manifest."""
+
+        return _row_keys(
+            self._db.execute('SELECT hash, key, count FROM rows WHERE kind = ?', (kind,))
+        )
+
+    def diff(self, file_names):
+        """Compare the manifest with the current input files.
+
+        file_names maps FILE_KINDS to paths. Returns a dict mapping each
+        kind to its (added rows, removed rows), as row_key tuples listed
+        once per added or removed copy of identical rows, and the file
+        states to pass to update once the changes have been
+        applied. Files whose content did not change are not parsed at
+        all.
+        """
+
+        changes = {}
+        states = {}
+        for kind in FILE_KINDS:
+            file_name = file_names.get(kind)
+            if not file_name:
+                continue
+            digest = file_digest(file_name)
+            old = self._db.execute('SELECT digest FROM files WHERE kind = ?', (kind,)).fetchone()
+            if old is not None and old[0] == digest:
+                continue
+            self._db.execute('DELETE FROM current')
+            self._db.executemany(
+                'INSERT INTO current VALUES (?, ?, 1) '
+                'ON CONFLICT (hash) DO UPDATE SET count = count + 1',
+                self._keyed_rows(kind, file_name)
+            )
+            added = self._db.execute(
+                'SELECT c.hash, c.key, c.count - COALESCE(r.count, 0) FROM current AS c '
+                'LEFT JOIN rows AS r ON r.kind = ? AND r.hash = c.hash '
+                'WHERE c.count > COALESCE(r.count, 0)', (kind,)
+            ).fetchall()
+            removed = self._db.execute(
+                'SELECT r.hash, r.key, r.count - COALESCE(c.count, 0) FROM rows AS r '
+                'LEFT JOIN current AS c ON c.hash = r.hash '
+                'WHERE r.kind = ? AND r.count > COALESCE(c.count, 0)', (kind,)
+            ).fetchall()
+            self._db.execute('DELETE FROM current')
+            self._db.commit()
+            changes[kind] = (_row_keys(added), _row_keys(removed))
+            states[kind] = {'digest': digest, 'added': added, 'removed': removed}
+        return changes, states
+
+    @staticmethod
+    def _keyed_rows(kind, file_name):
+        for row in iter_rows(file_name):
+            key = row_key(kind, row)
+            yield row_hash(key), json.dumps(key)
+
+    def graph_delta(self, changes):
+        """Return the GraphDelta resulting from the row changes.
+
+        Only the nodes and relationships of the added and removed rows
+        are looked at: they are added when their reference count rises
+        from zero and removed when it drops to zero.
+        """
+
+        counts = ElementCounts(changes)
+        delta = GraphDelta(labels={nid: label for nid, (label, _, _) in counts.nodes.items()})
+        for nid, (label, props, change) in counts.nodes.items():
+            old = self._node_refs(nid)
+            if old == 0 and old + change > 0:
+                delta.added_nodes[nid] = (label, props)
+            elif old > 0 and old + change <= 0:
+                delta.removed_nodes[nid] = label
+        for key, change in counts.relationships.items():
+            old = self._relationship_refs(key)
+            if old == 0 and old + change > 0:
+                delta.added_relationships[key] = {}
+            elif old > 0 and old + change <= 0:
+                delta.removed_relationships[key] = (counts.label(key[0]), counts.label(key[2]))
+        transitions = {}
+        for (key, wf_id), change in counts.transitions.items():
+            transitions.setdefault(key, {})[wf_id] = change
+        for key, changes in transitions.items():
+            old = self._transition_connections(key)
+            new = dict(old)
+            for wf_id, change in changes.items():
+                new[wf_id] = new.get(wf_id, 0) + change
+            old_props = _transition_props(old)
+            new_props = _transition_props(new)
+            if new_props['connections'] > 0:
+                if new_props != old_props:
+                    delta.added_relationships[key] = new_props
+            elif old_props['connections'] > 0:
+                delta.removed_relationships[key] = (counts.label(key[0]), counts.label(key[2]))
+        return delta
+
+    def _node_refs(self, nid):
+        row = self._db.execute('SELECT refs FROM nodes WHERE uid = ?', (nid,)).fetchone()
+        return row[0] if row else 0
+
+    def _relationship_refs(self, key):
+        row = self._db.execute(
+            'SELECT refs FROM relationships WHERE start_id = ? AND type = ? AND end_id = ?', key
+        ).fetchone()
+        return row[0] if row else 0
+
+    def _transition_connections(self, key):
+        return dict(self._db.execute(
+            'SELECT wf_id, connections FROM transitions '
+            'WHERE start_id = ? AND type = ? AND end_id = ?', key
+        ))
+
+    def update(self, states):
+        """Record new file states and their reference counts."""
+
+        counts = ElementCounts({
+            kind: (_row_keys(state['added']), _row_keys(state['removed']))
+            for kind, state in states.items()
+        })
+        with self._db:
+            for kind, state in states.items():
+                self._db.executemany(
+                    'INSERT INTO rows VALUES (?, ?, ?, ?) '
+                    'ON CONFLICT (kind, hash) DO UPDATE SET count = count + excluded.count',
+                    ((kind, h, key, count) for h, key, count in state['added'])
+                )
+                self._db.executemany(
+                    'UPDATE rows SET count = count - ? WHERE kind = ? AND hash = ?',
+                    ((count, kind, h) for h, _, count in state['removed'])
+                )
+                self._db.executemany(
+                    'DELETE FROM rows WHERE kind = ? AND hash = ? AND count <= 0',
+                    ((kind, h) for h, _, _ in state['removed'])
+                )
+                self._db.execute(
+                    'INSERT OR REPLACE INTO files VALUES (?, ?)', (kind, state['digest'])
+                )
+            self._db.executemany(
+                'INSERT INTO nodes VALUES (?, ?, ?) '
+                'ON CONFLICT (uid) DO UPDATE SET refs = refs + excluded.refs',
+                ((nid, label, change) for nid, (label, _, change) in counts.nodes.items())
+            )
+            self._db.executemany(
+                'DELETE FROM nodes WHERE uid = ? AND refs <= 0',
+                ((nid,) for nid in counts.nodes)
+            )
+            self._db.executemany(
+                'INSERT INTO relationships VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (start_id, type, end_id) DO UPDATE SET refs = refs + excluded.refs',
+                (key + (change,) for key, change in counts.relationships.items())
+            )
+            self._db.executemany(
+                'DELETE FROM relationships WHERE start_id = ? AND type = ? AND end_id = ? AND refs <= 0',
+                counts.relationships
+            )
+            self._db.executemany(
+                'INSERT INTO transitions VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (start_id, type, end_id, wf_id) '
+                'DO UPDATE SET connections = connections + excluded.connections',
+                (key + (wf_id, change) for (key, wf_id), change in counts.transitions.items())
+            )
+            self._db.executemany(
+                'DELETE FROM transitions '
+                'WHERE start_id = ? AND type = ? AND end_id = ? AND wf_id = ? AND connections <= 0',
+                (key + (wf_id,) for key, wf_id in counts.transitions)
+            )
+
+    def reset(self):
+        """Forget all recorded rows, e.g. after the graph got deleted."""
+
+        with self._db:
+            for table in ('files', 'rows', 'nodes', 'relationships', 'transitions'):
+                self._db.execute('DELETE FROM {0}'.format(table))
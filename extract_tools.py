@@ -1,98 +1,489 @@
 """Classes and functions for interacting with a Galaxy's /api/tools endpoint."""
 
+import hashlib
 import json
-from urllib.parse import urljoin
+import os
+import re
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from urllib.parse import urlencode, urljoin
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 
 # The module-wide default for the Galaxy instance to query
 GALAXY_BASE_URL = 'https://usegalaxy.eu'
 
+# Timeout (in seconds) applied to every request sent to a Galaxy server
+REQUEST_TIMEOUT = 60
 
-def store_tool_io_data(toolbox, ofn):
+_session = None
+
+# Whitespace and JSON array delimiters between the records of a tools JSON
+_RECORD_SEP = re.compile(r'[\s\[\],]*')
+
+
+def get_session():
+    """Return the module-wide pooled HTTP session.
+
+    The session keeps connections to the Galaxy server alive between
+    tool queries and retries requests failing with transient server
+    errors.
+    """
+
+    global _session
+    if _session is None:
+        retry = Retry(
+            total=3,
+            backoff_factor=0.5,
+            status_forcelist=(429, 500, 502, 503, 504),
+        )
+        adapter = HTTPAdapter(
+            pool_connections=4, pool_maxsize=16, max_retries=retry
+        )
+        _session = requests.Session()
+        _session.mount('http://', adapter)
+        _session.mount('https://', adapter)
+    return _session
+
+
+def store_tool_io_data(
+    toolbox, ofn, galaxy_base=None, cache=None, resume=True,
+    json_lines=False
+):
     """Write out the IO details of all tools in an APIToolbox.
 
     For the tools in an APIToolbox get their IO details and write
     them out in JSON format.
+
+    If a ToolResponseCache is passed as cache, responses are stored in
+    and revalidated against it so that only tools that changed on the
+    server get downloaded again. In addition, every tool written is
+    recorded in a checkpoint manifest next to ofn. If a run gets
+    interrupted, the next call with resume=True serves the tools
+    recorded there straight from the cache and continues with the
+    remaining ones. The manifest is removed once all tools have been
+    written.
+
+    With json_lines=True the records are written as JSON lines instead
+    of as a JSON array. iter_tool_io_data can read both formats.
     """
 
-    with open(ofn, 'w') as out:
-        out.write('[')
-        sep = '\n'
-        for tool_handle in toolbox.get_tools():
-            out.write(sep)
-            tool = APIToolIO.from_query(tool_handle['id'])
-            json.dump(tool.data, out)
-            sep = ',\n'
-        out.write('\n]')
+    manifest = None
+    done = set()
+    if cache is not None:
+        manifest_fn = ofn + '.checkpoint'
+        if resume:
+            done = _read_checkpoint(manifest_fn)
+        manifest = open(manifest_fn, 'a' if done else 'w')
+    try:
+        with open(ofn, 'w') as out:
+            if json_lines:
+                sep, next_sep = '', '\n'
+            else:
+                out.write('[')
+                sep, next_sep = '\n', ',\n'
+            for tool_handle in toolbox.get_tools():
+                out.write(sep)
+                key = (tool_handle['id'], tool_handle.get('version'))
+                tool = APIToolIO.from_query(
+                    tool_handle['id'],
+                    galaxy_base=galaxy_base,
+                    tool_version=tool_handle.get('version'),
+                    cache=cache,
+                    revalidate=key not in done
+                )
+                json.dump(tool.data, out)
+                if manifest is not None and key not in done:
+                    manifest.write(json.dumps(key) + '\n')
+                    manifest.flush()
+                sep = next_sep
+            out.write('\n' if json_lines else '\n]')
+    finally:
+        if manifest is not None:
+            manifest.close()
+    if manifest is not None:
+        os.remove(manifest.name)
+
+
+def _read_checkpoint(manifest_fn):
+    """Return the (tool id, version) keys recorded in a checkpoint."""
+
+    done = set()
+    try:
+        with open(manifest_fn) as i:
+            for line in i:
+                try:
+                    done.add(tuple(json.loads(line)))
+                except ValueError:
+                    # last line may be truncated if the run got killed
+                    break
+    except FileNotFoundError:
+        pass
+    return done
+
+
+def iter_tool_io_data(ifn, chunk_size=65536):
+    """Iterate over the tool records of a tools JSON file.
+
+    Reads a file written by store_tool_io_data, either in JSON array
+    or in JSON lines format, one record at a time so that memory use
+    does not depend on the size of the toolbox.
+    """
 
+    decoder = json.JSONDecoder()
+    with open(ifn, 'r') as i:
+        buf = ''
+        pos = 0
+        eof = False
+        while True:
+            # skip whitespace and the array delimiters between records
+            pos = _RECORD_SEP.match(buf, pos).end()
+            if pos < len(buf):
+                try:
+                    record, pos = decoder.raw_decode(buf, pos)
+                except ValueError:
+                    if eof:
+                        raise
+                else:
+                    yield record
+                    continue
+            elif eof:
+                return
+            # need more data to complete the next record
+            chunk = i.read(chunk_size)
+            if chunk:
+                buf = buf[pos:] + chunk
+                pos = 0
+            else:
+                eof = True
 
-def write_io_data_to_csv(ifn, ofn, mode, auto_fix=True):
-    """Write out input/output params of tools in CSV format.
 
-    Given a tools JSON like the one generated by store_tool_io_data,
-    write a 5 columns CSV of
-    
-    tool name, version, input/output param, datatype, edam_format.
+def iter_tool_io(ifn):
+    """Iterate over the tools of a tools JSON file as APIToolIO objects."""
 
-    The mode argument determines whether input or output parameters
-    will be reported.
+    return (APIToolIO(t) for t in iter_tool_io_data(ifn))
+
+
+def iter_io_rows(tools, mode, auto_fix=True):
+    """Generate the CSV rows for the input/output params of tools.
+
+    tools can be any iterable of APIToolIO objects. Yields tuples of
+    tool name, version, input/output param, datatype, edam_format.
     """
 
     if mode == 'inputs':
         fun = APIToolIO.get_tool_inputs
-        prefix = 'input'
     elif mode == 'outputs':
         fun = APIToolIO.get_tool_outputs
-        prefix = 'output'
     else:
         raise ValueError(
             'Specify "inputs" or "outputs" as mode '
             'to write the corresponding tools data.'
         )
-    with open(ifn, 'r') as i:
-        tools = json.load(i)
+    return _generate_io_rows(tools, fun, auto_fix)
+
+
+def _generate_io_rows(tools, fun, auto_fix):
+    for tool in tools:
+        yield from _io_rows(tool, fun(tool), auto_fix)
+
+
+def _tool_name(tool):
+    """Return the short name of a tool, i.e. its id without toolshed guid."""
+
+    if '/repos/' in tool['id']:
+        guid_parts = tool['id'].split('/')
+        assert guid_parts[-1] == tool['version']
+        return guid_parts[-2]
+    return tool['id']
+
+
+def _fix_format(fmt, edam_fmt):
+    """Fix known broken datatype declarations of some tools."""
+
+    if fmt == '' and edam_fmt is None:
+        fmt = None
+    # fix broken spades and kraken2 toolwrapper versions
+    elif fmt == '\n        fasta' and edam_fmt is None:
+        fmt = 'fasta'
+        edam_fmt = 'format_1929'
+    elif fmt == 'fastqsanger\n    ' and edam_fmt is None:
+        fmt = 'fastqsanger'
+        edam_fmt = 'format_1932'
+    elif fmt == 'fastqsanger.gz\n    ' and edam_fmt is None:
+        fmt = 'fastqsanger'
+        edam_fmt = 'format_1932'
+    return fmt, edam_fmt
+
+
+def _io_rows(tool, params, auto_fix):
+    name = _tool_name(tool)
+    for ioname, fmts, edam_data in params:
+        edam_fmts = edam_data.get('edam_formats', [])
+        for fmt, edam_fmt in zip(fmts, edam_fmts):
+            if auto_fix:
+                fmt, edam_fmt = _fix_format(fmt, edam_fmt)
+            yield name, tool['version'], ioname, fmt, edam_fmt
+
+
+def tool_io_rows(tool_json, auto_fix=True, collections=False):
+    """Return the input rows and output rows of a single tool record.
+
+    Rows are the tuples yielded by iter_io_rows. With collections=True
+    the outputs include the tool's collection outputs.
+    """
+
+    tool = APIToolIO(tool_json)
+    return (
+        list(_io_rows(tool, tool.get_tool_inputs(), auto_fix)),
+        list(_io_rows(tool, tool.get_tool_outputs(collections), auto_fix))
+    )
+
+
+def _tool_io_rows_chunk(tools, auto_fix, collections):
+    inputs, outputs = [], []
+    for tool_json in tools:
+        tool_inputs, tool_outputs = tool_io_rows(tool_json, auto_fix, collections)
+        inputs.extend(tool_inputs)
+        outputs.extend(tool_outputs)
+    return len(tools), inputs, outputs
+
+
+def _iter_chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _map_bounded(pool, fun, items, window):
+    """Like pool.map, but with at most window items submitted at a time."""
+
+    pending = deque()
+    for item in items:
+        pending.append(pool.submit(fun, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def extract_io_tables(
+    ifn, inputs_ofn, outputs_ofn, auto_fix=True, collections=False,
+    processes=None, chunk_size=100
+):
+    """Write the tool inputs and outputs tables in a single pass.
+
+    Given a tools JSON like the one generated by store_tool_io_data,
+    every tool record is parsed once and its input, output and (with
+    collections=True) collection output rows are written to inputs_ofn
+    and outputs_ofn. Files with a columnar_store extension are written
+    as columnar files, all others as CSV like write_io_data_to_csv. By
+    default, the tables hold the same rows as the ones written by
+    write_io_data_to_csv.
+
+    Chunks of chunk_size tools are parsed across a pool of processes
+    (in this process if only one is used) while the rows are written
+    in toolbox order. Returns the number of tools, input rows and
+    output rows.
+    """
+
+    work = partial(
+        _tool_io_rows_chunk, auto_fix=auto_fix, collections=collections
+    )
+    chunks = _iter_chunks(iter_tool_io_data(ifn), chunk_size)
+    processes = processes or os.cpu_count() or 1
+    n_tools = 0
+    with _IOTableWriter(inputs_ofn, 'inputs') as inputs_out, \
+            _IOTableWriter(outputs_ofn, 'outputs') as outputs_out:
+        if processes == 1:
+            results = map(work, chunks)
+            pool = None
+        else:
+            pool = ProcessPoolExecutor(processes)
+            results = _map_bounded(pool, work, chunks, 4 * processes)
+        try:
+            for n, inputs, outputs in results:
+                n_tools += n
+                inputs_out.write(inputs)
+                outputs_out.write(outputs)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+    return n_tools, inputs_out.rows, outputs_out.rows
+
+
+_CSV_ROW = '{0},{1},{2},{3},{4}\n'
+
+
+def io_columns(mode):
+    """Return the column names of the input/output params table."""
+
+    prefix = 'input' if mode == 'inputs' else 'output'
+    return [
+        'tool_name',
+        'tool_version',
+        '{0}_name'.format(prefix),
+        '{0}_extension'.format(prefix),
+        '{0}_edam_format'.format(prefix)
+    ]
+
+
+def write_io_rows_to_csv(rows, ofn, mode):
+    """Write rows generated by iter_io_rows to a 5 columns CSV."""
+
     with open(ofn, 'w') as o:
-        o.write(','.join([
-            'tool_name',
-            'tool_version',
-            '{0}_name',
-            '{0}_extension',
-            '{0}_edam_format'
-            ]).format(prefix)
-        )
+        o.write(','.join(io_columns(mode)))
         o.write('\n')
-        for tool in (APIToolIO(t) for t in tools):
-            if '/repos/' in tool['id']:
-                guid_parts = tool['id'].split('/')
-                assert guid_parts[-1] == tool['version']
-                name = guid_parts[-2]
-            else:
-                name = tool['id']
-            for ioname, fmts, edam_data in fun(tool):
-                edam_fmts = edam_data.get('edam_formats', [])
-                for fmt, edam_fmt in zip(fmts, edam_fmts):
-                    if auto_fix:
-                        if fmt == '' and edam_fmt is None:
-                            fmt = None
-                        # fix broken spades and kraken2 toolwrapper versions
-                        elif fmt == '\n        fasta' and edam_fmt is None:
-                            fmt = 'fasta'
-                            edam_fmt = 'format_1929'
-                        elif fmt == 'fastqsanger\n    ' and edam_fmt is None:
-                            fmt = 'fastqsanger'
-                            edam_fmt = 'format_1932'
-                        elif fmt == 'fastqsanger.gz\n    ' and edam_fmt is None:
-                            fmt = 'fastqsanger'
-                            edam_fmt = 'format_1932'
-                    o.write(
-                        '{0},{1},{2},{3},{4}\n'
-                        .format(
-                            name, tool['version'], ioname, fmt, edam_fmt
-                        )
-                    )
-                
+        for row in rows:
+            o.write(_CSV_ROW.format(*row))
+
+
+class _IOTableWriter():
+    """Incremental writer of an input/output params table.
+
+    Rows are appended to a CSV or, through a columnar_store
+    ColumnarWriter, to a columnar file as they come in. If the rows
+    cannot all be written, the partial file is removed.
+    """
+
+    def __init__(self, ofn, mode):
+        import columnar_store
+
+        self.ofn = ofn
+        self.mode = mode
+        self.rows = 0
+        self._columnar = columnar_store.is_columnar(ofn)
+        if self._columnar:
+            self._out = columnar_store.ColumnarWriter(io_columns(mode), ofn)
+        else:
+            self._out = open(ofn, 'w')
+            self._out.write(','.join(io_columns(mode)) + '\n')
+
+    def write(self, rows):
+        self.rows += len(rows)
+        if self._columnar:
+            self._out.writerows(rows)
+        else:
+            self._out.writelines(_CSV_ROW.format(*row) for row in rows)
+
+    def close(self):
+        self._out.close()
+
+    def abort(self):
+        if self._columnar:
+            self._out.abort()
+        else:
+            self._out.close()
+            os.remove(self.ofn)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def write_io_data_to_csv(ifn, ofn, mode, auto_fix=True):
+    """Write out input/output params of tools in CSV format.
+
+    Given a tools JSON like the one generated by store_tool_io_data,
+    write a 5 columns CSV of
+    
+    tool name, version, input/output param, datatype, edam_format.
+
+    The mode argument determines whether input or output parameters
+    will be reported.
+
+    The tools JSON is streamed through iter_tool_io_data, so it is
+    never loaded into memory as a whole.
+    """
+
+    rows = iter_io_rows(iter_tool_io(ifn), mode, auto_fix)
+    write_io_rows_to_csv(rows, ofn, mode)
+
+
+def write_io_data_to_columnar(ifn, ofn, mode, auto_fix=True):
+    """Write out input/output params of tools as a columnar file.
+
+    Like write_io_data_to_csv, but writes an Arrow IPC (.arrow) or
+    Parquet (.parquet) file with dictionary-encoded columns through
+    columnar_store, which requires pyarrow.
+    """
+
+    import columnar_store
+
+    rows = iter_io_rows(iter_tool_io(ifn), mode, auto_fix)
+    return columnar_store.write_table(io_columns(mode), rows, ofn)
+
+
+class ToolResponseCache():
+    """Persistent on-disk cache of Galaxy /api/tools responses.
+
+    Entries are keyed by (tool id, tool version) and keep the ETag and
+    Last-Modified headers of the response they were created from, so
+    they can be revalidated with a conditional request.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self.stats = {'downloaded': 0, 'revalidated': 0, 'unchecked': 0}
+
+    def _path(self, key):
+        digest = hashlib.sha1(
+            json.dumps(list(key)).encode('utf-8')
+        ).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], digest + '.json')
+
+    def get(self, key, url=None):
+        """Return the cache entry for key or None.
+
+        If url is given, entries created from a different url are
+        treated as missing.
+        """
+
+        try:
+            with open(self._path(key)) as i:
+                entry = json.load(i)
+        except (FileNotFoundError, ValueError):
+            return None
+        if url is not None and entry['url'] != url:
+            return None
+        return entry
+
+    def put(self, key, url, data, etag=None, last_modified=None):
+        """Store a server response under key."""
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        entry = {
+            'key': list(key),
+            'url': url,
+            'etag': etag,
+            'last_modified': last_modified,
+            'fetched': time.time(),
+            'data': data
+        }
+        # write to a temporary file first so that an interrupted run
+        # never leaves a truncated entry behind
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as o:
+            json.dump(entry, o)
+        os.replace(tmp, path)
+
 
 class APITools():
     """Base class for interacting with /api/tools of a Galaxy instance."""
@@ -105,8 +496,45 @@ class APITools():
         )
 
     @classmethod
-    def _from_query(cls, url):
-        this = cls(requests.get(url).json())
+    def _from_query(cls, url, cache=None, cache_key=None, revalidate=True):
+        """Initialize an instance from the JSON response to url.
+
+        With a ToolResponseCache and a cache_key, a cached response is
+        revalidated with a conditional request and reused if the server
+        reports it as unchanged. With revalidate=False, a cached
+        response is used without contacting the server at all.
+        """
+
+        entry = None
+        if cache is not None and cache_key is not None:
+            entry = cache.get(cache_key, url)
+        if entry is not None and not revalidate:
+            cache.stats['unchecked'] += 1
+            data = entry['data']
+        else:
+            headers = {}
+            if entry is not None:
+                if entry['etag']:
+                    headers['If-None-Match'] = entry['etag']
+                if entry['last_modified']:
+                    headers['If-Modified-Since'] = entry['last_modified']
+            response = get_session().get(
+                url, headers=headers, timeout=REQUEST_TIMEOUT
+            )
+            if entry is not None and response.status_code == 304:
+                cache.stats['revalidated'] += 1
+                data = entry['data']
+            else:
+                data = response.json()
+                if cache_key is not None and cache is not None \
+                   and response.ok:
+                    cache.stats['downloaded'] += 1
+                    cache.put(
+                        cache_key, url, data,
+                        etag=response.headers.get('ETag'),
+                        last_modified=response.headers.get('Last-Modified')
+                    )
+        this = cls(data)
         this.from_url = url
         return this
 
@@ -132,14 +560,18 @@ class APIToolbox(APITools):
     @classmethod
     def from_query(cls, in_panel=True, galaxy_base=None):
         """Initialize the toolbox by performing a server toolbox query."""
-        
-        url = urljoin(
+
+        return cls._from_query(cls.query_url(in_panel, galaxy_base))
+
+    @classmethod
+    def query_url(cls, in_panel=True, galaxy_base=None):
+        """Return the URL of the toolbox query."""
+
+        return urljoin(
             cls._get_base_url(galaxy_base),
             '?in_panel={0}'.format(in_panel)
         )
 
-        return cls._from_query(url)
-
     def get_tools(self):
         """Iterator over the JSON-formatted tools defined in the toolbox."""
         for item in self.data:
@@ -177,51 +609,90 @@ class APIToolIO(APITools):
         self.from_url = None
 
     @classmethod
-    def from_query(cls, tool_id, galaxy_base=None):
-        """Initialize the IO details by performing a fresh server query."""
+    def from_query(
+        cls, tool_id, galaxy_base=None, tool_version=None,
+        cache=None, revalidate=True
+    ):
+        """Initialize the IO details by performing a server query.
+
+        If a ToolResponseCache is passed as cache, the response is
+        looked up in and stored in it under (tool_id, tool_version).
+        """
+        return cls._from_query(
+            cls.query_url(tool_id, galaxy_base, tool_version),
+            cache, (tool_id, tool_version), revalidate
+        )
+
+    @classmethod
+    def query_url(cls, tool_id, galaxy_base=None, tool_version=None):
+        """Return the URL of the IO details query for a tool."""
+
         url = urljoin(
             cls._get_base_url(galaxy_base),
             tool_id + cls.io_details_path
         )
-        return cls._from_query(url)
+        if tool_version is not None:
+            url += '&' + urlencode({'tool_version': tool_version})
+        return url
 
     def get_tool_inputs(self):
         """Get the input data information for the represented tool."""
 
         ret = []
+        # params seen so far by name, only params with the
+        # same name need to be compared
+        seen = {}
         for i in self._parse_input_section(self.data['inputs']):
-            if i not in ret:
+            same_name = seen.setdefault(i[0], [])
+            if i not in same_name:
+                same_name.append(i)
                 ret.append(i)
         return ret
 
     def _parse_input_section(self, input_section, prefix=None):
-        if prefix:
-            prefix = prefix + '|'
-        else:
-            prefix = ''
-        for item in input_section:
-            item_type = item.get('model_class')
-            if item_type == 'DataToolParameter':
-                yield prefix + item['name'], item['extensions'], item['edam']                
-            elif item_type == 'Conditional':
-                for case in item['cases']:
-                    assert case['model_class'] == 'ConditionalWhen'
-                    yield from self._parse_input_section(
-                        case['inputs'], prefix=prefix+item['name']
+        # depth-first walk with an explicit stack of
+        # (remaining items, names of the enclosing sections)
+        stack = [(iter(input_section), (prefix,) if prefix else ())]
+        while stack:
+            items, path = stack[-1]
+            for item in items:
+                item_type = item.get('model_class')
+                if item_type == 'DataToolParameter':
+                    yield (
+                        '|'.join(path + (item['name'],)),
+                        item['extensions'],
+                        item['edam']
                     )
-            elif item_type == 'Repeat':
-                yield from self._parse_input_section(
-                    item['inputs'], prefix=prefix+item['name']
-                )
+                elif item_type == 'Conditional':
+                    stack.append((
+                        self._iter_cases(item['cases']), path + (item['name'],)
+                    ))
+                    break
+                elif item_type == 'Repeat':
+                    stack.append((
+                        iter(item['inputs']), path + (item['name'],)
+                    ))
+                    break
+            else:
+                stack.pop()
+
+    @staticmethod
+    def _iter_cases(cases):
+        for case in cases:
+            assert case['model_class'] == 'ConditionalWhen'
+            yield from case['inputs']
 
-    def get_tool_outputs(self):
-        """Get the output data information for the represented tool."""
+    def get_tool_outputs(self, collections=False):
+        """Get the output data information for the represented tool.
+
+        With collections=True, collection outputs are reported too, with
+        their default format as datatype.
+        """
 
         ret = []
         for item in self.data['outputs']:
             item_type = item.get('model_class')
             assert item_type in ['ToolOutput', 'ToolOutputCollection']
-            # to do: handle collections
             if item_type == 'ToolOutput':
                 ret.append((
                     item['name'],
@@ -231,4 +702,13 @@ class APIToolIO(APITools):
                         'edam_formats': [item['edam_format']] if 'edam_format' in item else []
                     }
                 ))
+            elif collections:
+                ret.append((
+                    item['name'],
+                    [item.get('format') or item.get('default_format', 'data')],
+                    {
+                        'edam_data': [item.get('edam_data')],
+                        'edam_formats': [item.get('edam_format')]
+                    }
+                ))
         return ret
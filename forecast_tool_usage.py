@@ -0,0 +1,211 @@
+"""Forecast tool usage from the monthly tool popularity statistics.
+
+Replaces the per-tool loops of create_tool_usage_stats.ipynb and writes
+the tools_usage_prediction.csv consumed as ToolUsage by
+WorkflowGraphDatabase.create_graph_bulk_merge.
+
+The popularity TSV (tool guid, month, count) is grouped into one NumPy
+series per tool in a single vectorized step. Per-tool models are fitted
+across a process pool and, if a cache directory is given, stored under
+the hash of their series so that tools whose history did not change are
+not fitted again next month.
+"""
+
+import argparse
+import hashlib
+import os
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+
+# Usage data before this date is ignored
+CUTOFF_DATE = '2017-12-01'
+
+MODELS = ('median', 'svr')
+
+
+def load_usage_series(usage_file, cutoff_date=CUTOFF_DATE):
+    """Group a tool popularity TSV into per-tool usage series.
+
+    Returns an array of tool guids, a list with the usage counts of
+    each tool ordered by month and an array of the latest month of each
+    tool.
+    """
+
+    df = pd.read_csv(
+        usage_file, sep='\t', header=None, names=['tool', 'date', 'usage'],
+        dtype={'tool': str, 'date': str}
+    )
+    df = df[df['date'] > cutoff_date].sort_values(['tool', 'date'], kind='stable')
+    tools, starts = np.unique(df['tool'].to_numpy(), return_index=True)
+    ends = np.append(starts[1:], len(df))
+    series = np.split(df['usage'].to_numpy(dtype=float), starts[1:])
+    last_dates = df['date'].to_numpy()[ends - 1] if len(df) else np.array([])
+    return tools, series, last_dates
+
+
+def series_hash(model, values):
+    """Return the cache key of a model fitted to a usage series."""
+
+    h = hashlib.sha1(model.encode('utf-8'))
+    h.update(np.ascontiguousarray(values, dtype=np.float64).tobytes())
+    return h.hexdigest()
+
+
+def learn_tool_popularity(values):
+    """Fit a curve to the usage of a tool over time.
+
+    Returns the fitted model and its prediction for the next month.
+    """
+
+    from sklearn.model_selection import GridSearchCV
+    from sklearn.pipeline import Pipeline
+    from sklearn.svm import SVR
+
+    if len(values) < 2:
+        # not enough months to cross-validate a model
+        return fit_median(values)
+    epsilon = 0.0
+    x = np.arange(len(values)).reshape(-1, 1)
+    try:
+        pipe = Pipeline(steps=[('regressor', SVR(gamma='scale'))])
+        param_grid = {
+            'regressor__kernel': ['rbf', 'poly', 'linear'],
+            'regressor__degree': [2, 3]
+        }
+        search = GridSearchCV(
+            pipe, param_grid, cv=min(5, len(values)),
+            scoring='neg_mean_absolute_error', error_score=1,
+            return_train_score=False
+        )
+        search.fit(x, values)
+        model = search.best_estimator_
+        # set the next time point to get prediction for
+        prediction = model.predict([[len(values)]])[0]
+        return model, max(prediction, epsilon)
+    except Exception:
+        return None, epsilon
+
+
+def fit_median(values):
+    """Predict next month's usage as the median of all months."""
+
+    return None, float(np.median(values))
+
+
+_FIT_FUNCTIONS = {'median': fit_median, 'svr': learn_tool_popularity}
+
+
+class ModelCache:
+    """Directory of fitted models keyed by series_hash."""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.pkl')
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as i:
+                return pickle.load(i)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def put(self, key, model, prediction):
+        tmp = self._path(key) + '.tmp'
+        with open(tmp, 'wb') as o:
+            pickle.dump((model, prediction), o, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self._path(key))
+
+
+def predict_usage(series, model='median', processes=None, cache_dir=None):
+    """Predict the next month's usage for every series.
+
+    Series whose fitted model is found in cache_dir are not fitted
+    again, the others are fitted across a pool of processes.
+    Returns the array of predictions and the number of fitted series.
+    """
+
+    if model not in MODELS:
+        raise ValueError(
+            'model has to be one of {0}'.format(', '.join(MODELS))
+        )
+    cache = ModelCache(cache_dir) if cache_dir else None
+    predictions = np.zeros(len(series))
+    keys = [series_hash(model, values) for values in series]
+    todo = []
+    for i, key in enumerate(keys):
+        cached = cache.get(key) if cache else None
+        if cached is None:
+            todo.append(i)
+        else:
+            predictions[i] = cached[1]
+
+    fit = _FIT_FUNCTIONS[model]
+    pending = (series[i] for i in todo)
+    if model == 'median' or processes == 1:
+        # too cheap to be worth sending to other processes
+        results = list(map(fit, pending))
+    else:
+        with ProcessPoolExecutor(processes) as pool:
+            results = list(pool.map(fit, pending, chunksize=16))
+    for i, (fitted, prediction) in zip(todo, results):
+        predictions[i] = prediction
+        if cache:
+            cache.put(keys[i], fitted, prediction)
+    return predictions, len(todo)
+
+
+def forecast_tool_usage(usage_file, out_file, model='median', processes=None,
+                        cache_dir=None, cutoff_date=CUTOFF_DATE):
+    """Write the tools_usage_prediction CSV for a tool popularity TSV.
+
+    Only tools installed from a toolshed are reported, with the short
+    tool id and version taken from their guid. Returns the number of
+    tools written and the number of models fitted.
+    """
+
+    tools, series, last_dates = load_usage_series(usage_file, cutoff_date)
+    predictions, n_fitted = predict_usage(series, model, processes, cache_dir)
+    predictions = np.round(predictions, 0)
+
+    guid_parts = pd.Series(tools, dtype=str).str.extract(r'([^/]*)/([^/]*)$')
+    future_dates = (
+        pd.to_datetime(pd.Series(last_dates, dtype=str)) + pd.DateOffset(months=1)
+    ).dt.strftime('%Y-%m-%d')
+    result = pd.DataFrame({
+        'tool_id': guid_parts[0],
+        'tool_v': guid_parts[1],
+        'future_date': future_dates,
+        'usage': predictions
+    })
+    result = result[result['tool_id'].notna()]
+    result.to_csv(out_file, sep=',', index=False)
+    return len(result), n_fitted
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        description='Forecast tool usage from monthly tool popularity data'
+    )
+    arg_parser.add_argument("-i", "--usage_file", required=True, help="Tool popularity TSV")
+    arg_parser.add_argument("-o", "--out_file", required=True, help="Tool usage prediction CSV")
+    arg_parser.add_argument("-m", "--model", default="median", choices=MODELS, help="Model to fit per tool")
+    arg_parser.add_argument("-p", "--processes", type=int, help="Number of worker processes")
+    arg_parser.add_argument("-c", "--cache_dir", help="Directory to cache fitted models in")
+    arg_parser.add_argument("-cut", "--cutoff_date", default=CUTOFF_DATE, help="Ignore usage before this date")
+    args = vars(arg_parser.parse_args())
+    s_time = time.time()
+    n_tools, n_fitted = forecast_tool_usage(
+        args["usage_file"], args["out_file"], args["model"], args["processes"],
+        args["cache_dir"], args["cutoff_date"]
+    )
+    e_time = time.time()
+    print("Predicted usage of %d tools (%d models fitted) in %d seconds" % (
+        n_tools, n_fitted, int(e_time - s_time)))
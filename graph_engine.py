@@ -0,0 +1,350 @@
+"""In-process engine for path queries over the workflow graph.
+
+CompactGraph holds the graph built by graph_model.GraphBuilder in
+compressed sparse row (CSR) form: nodes are interned into integer
+indices and adjacency is stored as NumPy arrays. It answers the path
+questions we usually send to Neo4j (see the query file) without a
+database round trip:
+
+- shortest paths between tools, e.g.
+  shortestPath((:Tool {name: "trimmomatic"})-[*]-(:Tool {name: "bowtie2"}))
+- tool to tool chains through
+  ToolOutput -> WorkflowConnection -> ToolInput
+- nodes of a label reachable within k hops, e.g. Datatypes of a Tool
+"""
+
+import numpy as np
+
+from graph_model import COMPONENTS, GraphBuilder
+from graph_snapshot import load_snapshot_elements
+
+
+_rel = COMPONENTS['Relationships']
+
+# Tool -> Version -> ToolOutput -> WorkflowConnection -> ToolInput
+# -> Version <- Tool as (relationship type, direction, label) steps
+TOOL_CHAIN = (
+    (_rel['Tool_to_Version'], 'out', 'Version'),
+    (_rel['Version_to_ToolOutput'], 'out', 'ToolOutput'),
+    (_rel['WorkflowConnection_to_ToolOutput'], 'out', 'WorkflowConnection'),
+    (_rel['WorkflowConnection_to_ToolInput'], 'out', 'ToolInput'),
+    (_rel['Version_to_ToolInput'], 'out', 'Version'),
+    (_rel['Tool_to_Version'], 'in', 'Tool'),
+)
+
+# Tool -> Tool along the materialized FOLLOWED_BY transitions
+TOOL_TRANSITION = (
+    (_rel['Tool_to_Tool'], 'out', 'Tool'),
+)
+
+# Tool -> Version -> ToolOutput -> Datatype
+TOOL_OUTPUT_DATATYPES = (
+    (_rel['Tool_to_Version'], 'out', 'Version'),
+    (_rel['Version_to_ToolOutput'], 'out', 'ToolOutput'),
+    (_rel['ToolOutput_to_Datatype'], 'out', 'Datatype'),
+)
+
+
+def _csr(n, src, dst, types):
+    """Return indptr, indices and edge types of src -> dst sorted by src."""
+
+    order = np.argsort(src, kind='stable')
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=n), out=indptr[1:])
+    return indptr, dst[order], types[order]
+
+
+class CompactGraph:
+    """Compact, read-only representation of the workflow graph."""
+
+    def __init__(self, uids, labels, names, src, dst, rel_types,
+                 label_names, rel_type_names):
+        """Initialize from interned arrays.
+
+        uids and names are lists indexed by node index, labels holds
+        the label code of every node, src, dst and rel_types one entry
+        per relationship, all as indices into the given name lists.
+        Use from_builder, from_csv_files or from_snapshot to create an
+        instance.
+        """
+
+        self.uids = uids
+        self.names = names
+        self.labels = np.asarray(labels, dtype=np.int16)
+        self.label_names = list(label_names)
+        self.rel_type_names = list(rel_type_names)
+        self._label_codes = {l: i for i, l in enumerate(self.label_names)}
+        self._rel_codes = {t: i for i, t in enumerate(self.rel_type_names)}
+        n = len(uids)
+        src = np.asarray(src, dtype=np.int32)
+        dst = np.asarray(dst, dtype=np.int32)
+        rel_types = np.asarray(rel_types, dtype=np.int16)
+        self._out = _csr(n, src, dst, rel_types)
+        self._in = _csr(n, dst, src, rel_types)
+        self._by_name = {}
+        for idx, (code, name) in enumerate(zip(self.labels.tolist(), names)):
+            self._by_name.setdefault((code, name), []).append(idx)
+
+    @classmethod
+    def from_builder(cls, builder):
+        """Create a CompactGraph from a graph_model.GraphBuilder."""
+
+        return cls.from_elements(builder.nodes, builder.relationships)
+
+    @classmethod
+    def from_elements(cls, nodes, relationships):
+        """Create a CompactGraph from nodes and relationships.
+
+        Both are expected in the format of the GraphBuilder attributes.
+        """
+
+        label_names = sorted({label for label, _ in nodes.values()})
+        label_codes = {l: i for i, l in enumerate(label_names)}
+        rel_type_names = sorted({t for _, t, _ in relationships})
+        rel_codes = {t: i for i, t in enumerate(rel_type_names)}
+        uids = list(nodes)
+        index = {uid: i for i, uid in enumerate(uids)}
+        labels = [label_codes[nodes[uid][0]] for uid in uids]
+        names = [
+            props.get('name', props.get('id', ''))
+            for _, props in (nodes[uid] for uid in uids)
+        ]
+        m = len(relationships)
+        src = np.fromiter(
+            (index[s] for s, _, _ in relationships), np.int32, m
+        )
+        dst = np.fromiter(
+            (index[e] for _, _, e in relationships), np.int32, m
+        )
+        types = np.fromiter(
+            (rel_codes[t] for _, t, _ in relationships), np.int16, m
+        )
+        return cls(
+            uids, labels, names, src, dst, types, label_names, rel_type_names
+        )
+
+    @classmethod
+    def from_snapshot(cls, file_name):
+        """Create a CompactGraph from a graph_snapshot file."""
+
+        return cls.from_elements(*load_snapshot_elements(file_name))
+
+    @classmethod
+    def from_csv_files(cls, tool_inputs_file=None, tool_outputs_file=None,
+                       workflow_file=None, tool_usage_file=None):
+        """Build the graph from the files WorkflowGraphDatabase loads."""
+
+        return cls.from_builder(GraphBuilder.from_csv_files(
+            tool_inputs_file=tool_inputs_file,
+            tool_outputs_file=tool_outputs_file,
+            workflow_file=workflow_file,
+            tool_usage_file=tool_usage_file
+        ))
+
+    def __len__(self):
+        return len(self.uids)
+
+    @property
+    def num_relationships(self):
+        return len(self._out[1])
+
+    def find(self, label, name):
+        """Return the indices of the nodes with label and name."""
+
+        code = self._label_codes.get(label)
+        return np.asarray(self._by_name.get((code, name), []), dtype=np.int64)
+
+    def describe(self, nodes):
+        """Return (label, name) for every node index in nodes."""
+
+        return [
+            (self.label_names[self.labels[i]], self.names[i]) for i in nodes
+        ]
+
+    def _type_mask(self, rel_types):
+        if rel_types is None:
+            return None
+        mask = np.zeros(len(self.rel_type_names), dtype=bool)
+        for t in rel_types:
+            if t in self._rel_codes:
+                mask[self._rel_codes[t]] = True
+        return mask
+
+    def _expand(self, frontier, direction='both', type_mask=None):
+        """Return the neighbors of all nodes in frontier.
+
+        Returns an array of neighbor indices and, for each of them,
+        the position in frontier of the node it was reached from.
+        """
+
+        if direction == 'both':
+            csrs = (self._out, self._in)
+        elif direction == 'out':
+            csrs = (self._out,)
+        elif direction == 'in':
+            csrs = (self._in,)
+        else:
+            raise ValueError(
+                'direction has to be one of "out", "in" or "both".'
+            )
+        nbrs, origins = [], []
+        for indptr, indices, types in csrs:
+            starts = indptr[frontier]
+            counts = indptr[frontier + 1] - starts
+            total = int(counts.sum())
+            if not total:
+                continue
+            # positions in indices of all edges leaving the frontier
+            offsets = np.repeat(starts - (np.cumsum(counts) - counts), counts)
+            positions = offsets + np.arange(total)
+            origin = np.repeat(np.arange(len(frontier)), counts)
+            if type_mask is not None:
+                keep = type_mask[types[positions]]
+                positions, origin = positions[keep], origin[keep]
+            nbrs.append(indices[positions])
+            origins.append(origin)
+        if not nbrs:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty
+        return np.concatenate(nbrs), np.concatenate(origins)
+
+    def bfs(self, sources, max_depth=None, direction='both', rel_types=None,
+            targets=None):
+        """Breadth-first search from sources.
+
+        Returns arrays of the hop distance of every node (-1 if not
+        reached) and of the node it was first reached from. If targets
+        are given, the search stops at the first level reaching one.
+        """
+
+        n = len(self.uids)
+        dist = np.full(n, -1, dtype=np.int32)
+        parent = np.full(n, -1, dtype=np.int64)
+        frontier = np.unique(np.asarray(sources, dtype=np.int64))
+        dist[frontier] = 0
+        type_mask = self._type_mask(rel_types)
+        if targets is not None:
+            target_mask = np.zeros(n, dtype=bool)
+            target_mask[np.asarray(targets, dtype=np.int64)] = True
+            if target_mask[frontier].any():
+                return dist, parent
+        depth = 0
+        while frontier.size and (max_depth is None or depth < max_depth):
+            depth += 1
+            nbrs, origin = self._expand(frontier, direction, type_mask)
+            new = dist[nbrs] < 0
+            nbrs, origin = nbrs[new], origin[new]
+            nbrs, first = np.unique(nbrs, return_index=True)
+            dist[nbrs] = depth
+            parent[nbrs] = frontier[origin[first]]
+            frontier = nbrs
+            if targets is not None and target_mask[frontier].any():
+                break
+        return dist, parent
+
+    def shortest_path(self, sources, targets, max_depth=None,
+                      direction='both', rel_types=None):
+        """Return a shortest path from any of sources to any of targets.
+
+        The path is returned as a list of node indices, or None if no
+        target is reachable.
+        """
+
+        targets = np.asarray(targets, dtype=np.int64)
+        if not targets.size:
+            return None
+        dist, parent = self.bfs(
+            sources, max_depth, direction, rel_types, targets=targets
+        )
+        reached = targets[dist[targets] >= 0]
+        if not reached.size:
+            return None
+        node = int(reached[np.argmin(dist[reached])])
+        path = [node]
+        while parent[node] >= 0:
+            node = int(parent[node])
+            path.append(node)
+        return path[::-1]
+
+    def shortest_tool_path(self, tool_a, tool_b, max_depth=None):
+        """Return a shortest path between two tools given by name."""
+
+        return self.shortest_path(
+            self.find('Tool', tool_a), self.find('Tool', tool_b), max_depth
+        )
+
+    def k_hop(self, sources, k, direction='both', rel_types=None, label=None):
+        """Return the nodes within k hops of sources, optionally by label."""
+
+        dist, _ = self.bfs(sources, k, direction, rel_types)
+        reached = dist >= 0
+        if label is not None:
+            reached &= self.labels == self._label_codes.get(label, -1)
+        return np.flatnonzero(reached)
+
+    def follow(self, sources, steps, limit=None):
+        """Return all paths from sources along a typed pattern of steps.
+
+        steps is a sequence of (relationship type, direction, label)
+        tuples, where label may be None to accept any node. Returns a
+        2D array with one path of node indices per row.
+        """
+
+        paths = np.asarray(sources, dtype=np.int64).reshape(-1, 1)
+        for rel_type, direction, label in steps:
+            nbrs, origin = self._expand(
+                paths[:, -1], direction, self._type_mask([rel_type])
+            )
+            if label is not None:
+                keep = self.labels[nbrs] == self._label_codes.get(label, -1)
+                nbrs, origin = nbrs[keep], origin[keep]
+            paths = np.column_stack([paths[origin], nbrs])
+        if limit is not None:
+            paths = paths[:limit]
+        return paths
+
+    def tool_chains(self, from_tool, to_tool=None, limit=None):
+        """Return the workflow connections from one tool to another.
+
+        Mirrors the query pattern
+        (a:Tool)-[:HAS_VERSION]->(:Version)-[:GENERATES_OUTPUT]->
+        (:ToolOutput)-[:IS_CONNECTED_BY]->(:WorkflowConnection)
+        -[:TO_INPUT]->(:ToolInput)-[:FEEDS_INTO]->(:Version)
+        <-[:HAS_VERSION]-(b:Tool)
+        where b can be restricted to the tool named to_tool.
+        """
+
+        paths = self.follow(self.find('Tool', from_tool), TOOL_CHAIN)
+        if to_tool is not None:
+            paths = paths[np.isin(paths[:, -1], self.find('Tool', to_tool))]
+        if limit is not None:
+            paths = paths[:limit]
+        return paths
+
+    def next_tools(self, from_tool):
+        """Return the names of all tools connected downstream of a tool.
+
+        Follows the single FOLLOWED_BY hop if the graph has these
+        transitions, the full tool chain otherwise.
+        """
+
+        if _rel['Tool_to_Tool'] in self._rel_codes:
+            paths = self.follow(self.find('Tool', from_tool), TOOL_TRANSITION)
+        else:
+            paths = self.tool_chains(from_tool)
+        return sorted({self.names[i] for i in np.unique(paths[:, -1])})
+
+    def tool_output_datatypes(self, tool, versions=None):
+        """Return the names of the Datatypes of a tool's outputs."""
+
+        paths = self.follow(self.find('Tool', tool), TOOL_OUTPUT_DATATYPES)
+        if versions is not None:
+            keep = [self.names[v] in versions for v in paths[:, 1]]
+            paths = paths[np.asarray(keep, dtype=bool)]
+        return sorted({self.names[i] for i in np.unique(paths[:, -1])})
+
+    def reachable(self, sources, label, max_depth=10):
+        """Return the names of the label nodes within max_depth hops."""
+
+        nodes = self.k_hop(sources, max_depth, label=label)
+        return sorted({self.names[i] for i in nodes})
@@ -0,0 +1,314 @@
+"""Resolve the workflow graph input CSVs into nodes and relationships.
+
+The GraphBuilder in this module mirrors the MERGE semantics of the Cypher
+import in create_workflow_graph, but runs entirely in Python and gives
+every node a deterministic id derived from its identifying key.
+"""
+
+import csv
+import hashlib
+
+import columnar_store
+
+
+# Node labels and relationship types of the workflow graph
+COMPONENTS = {
+    'Nodes': {
+        'Tool': 'Tool',
+        'Version': 'Version',
+        'ToolOutput': 'ToolOutput',
+        'ToolInput': 'ToolInput',
+        'WorkflowConnection': 'WorkflowConnection',
+        'Workflow': 'Workflow',
+        'Datatype': 'Datatype',
+        'EDAMFormat': 'EDAMFormat',
+        'InTool': 'Tool',
+        'OutTool': 'Tool',
+        'InToolV': 'Version',
+        'OutToolV': 'Version',
+        'ToolUsage': 'ToolUsage'
+    },
+    'Relationships': {
+        'Tool_to_Version': 'HAS_VERSION',
+        'Version_to_ToolOutput': 'GENERATES_OUTPUT',
+        'Version_to_ToolInput': 'FEEDS_INTO',
+        'WorkflowConnection_to_ToolOutput': 'IS_CONNECTED_BY',
+        'WorkflowConnection_to_ToolInput': 'TO_INPUT',
+        'Workflow': 'WORKFLOW',
+        'ToolOutput_to_Datatype': 'HAS_DATATYPE',
+        'ToolInput_to_Datatype': 'HAS_DATATYPE',
+        'Datatype_to_EDAMFormat': 'IS_OF_FORMAT',
+        'Version_to_Usage': 'USAGE',
+        'Tool_to_Tool': 'FOLLOWED_BY',
+        'Version_to_Version': 'FOLLOWED_BY'
+    }
+}
+
+# Indexed node properties as (label, property, unique). Tools, datatypes,
+# EDAM formats and workflows are identified by a single property, the
+# other nodes are merged by name relative to an already matched node.
+# The uid of every node is unique, see node_id.
+SCHEMA = (
+    ('Tool', 'name', True),
+    ('Datatype', 'name', True),
+    ('EDAMFormat', 'id', True),
+    ('Workflow', 'id', True),
+    ('Version', 'name', False),
+    ('ToolInput', 'name', False),
+    ('ToolOutput', 'name', False),
+    ('ToolUsage', 'name', False),
+    # numeric usage filters, see usage_series
+    ('ToolUsage', 'usage', False),
+    ('Version', 'usage_12m', False)
+) + tuple(
+    (label, 'uid', True) for label in sorted(set(COMPONENTS['Nodes'].values()))
+)
+
+
+def schema_statement(label, prop, unique):
+    """Return the Cypher statement creating an index or uniqueness constraint."""
+
+    if unique:
+        return 'CREATE CONSTRAINT ON (n:`{0}`) ASSERT n.`{1}` IS UNIQUE'.format(label, prop)
+    return 'CREATE INDEX ON :`{0}`(`{1}`)'.format(label, prop)
+
+# Column order of the workflow connections CSV
+WORKFLOW_COLUMNS = (
+    'WfId',
+    'InTool',
+    'InToolV',
+    'ToolOutput',
+    'OutTool',
+    'ToolInput',
+    'OutToolV'
+)
+
+
+def node_id(label, *key):
+    """Return the deterministic id of the node with label and key."""
+
+    return hashlib.sha1(
+        '\x1f'.join((label,) + key).encode('utf-8')
+    ).hexdigest()[:16]
+
+
+def iter_csv_rows(file_name):
+    """Iterate over the data rows of a CSV file as tuples of strings."""
+
+    with open(file_name, 'r', newline='') as i:
+        reader = csv.reader(i)
+        next(reader, None)
+        for row in reader:
+            if row:
+                yield tuple(row)
+
+
+def iter_rows(file_name):
+    """Iterate over the data rows of a CSV or columnar file as tuples.
+
+    Files with a columnar_store extension (.arrow, .parquet) are read
+    with columnar_store, all others as CSV.
+    """
+
+    if columnar_store.is_columnar(file_name):
+        return columnar_store.iter_table_rows(file_name)
+    return iter_csv_rows(file_name)
+
+
+class TransitionCounter:
+    """Count the workflows and connections of transitions between nodes.
+
+    self.counts maps every transition key to a dict with the number of
+    distinct workflows and of workflow connections it was added for.
+    """
+
+    def __init__(self):
+        self.counts = {}
+        self._workflows = {}
+
+    def add(self, key, wf_id):
+        workflows = self._workflows.setdefault(key, set())
+        workflows.add(wf_id)
+        props = self.counts.setdefault(
+            key, {'workflows': 0, 'connections': 0}
+        )
+        props['workflows'] = len(workflows)
+        props['connections'] += 1
+        return props
+
+
+def count_transitions(rows):
+    """Count the tool to tool transitions of workflow connections rows.
+
+    Returns the counts of TransitionCounter keyed by (tool, next tool)
+    and by (tool, version, next tool, next version), skipping the same
+    rows as GraphBuilder.
+    """
+
+    tools = TransitionCounter()
+    versions = TransitionCounter()
+    for row in rows:
+        wf_id, in_tool, in_v, _, out_tool, _, out_v = row[:7]
+        if all(row[:7]):
+            tools.add((in_tool, out_tool), wf_id)
+            versions.add((in_tool, in_v, out_tool, out_v), wf_id)
+    return tools.counts, versions.counts
+
+
+class GraphBuilder:
+    """Build the workflow graph in memory from its input CSV rows.
+
+    Nodes are stored in self.nodes as id -> (label, properties),
+    relationships in self.relationships as
+    (start id, type, end id) -> properties.
+
+    LOAD CSV turns empty fields into nulls and MERGE refuses to create
+    nodes from null properties, so rows with an empty identifying field
+    are skipped and counted in self.skipped.
+
+    Every workflow connection also adds to the FOLLOWED_BY relationships
+    between the connected tools and between their versions, which count
+    the workflows and connections they stand for.
+    """
+
+    def __init__(self, components=None):
+        self.components = components or COMPONENTS
+        self.nodes = {}
+        self.relationships = {}
+        self.skipped = 0
+        self._transitions = TransitionCounter()
+
+    def _label(self, node):
+        return self.components['Nodes'][node]
+
+    def _rel_type(self, rel):
+        return self.components['Relationships'][rel]
+
+    def _node(self, node, key, properties):
+        label = self._label(node)
+        nid = node_id(label, *key)
+        if nid not in self.nodes:
+            self.nodes[nid] = (label, properties)
+        return nid
+
+    def _relate(self, start, rel, end):
+        self.relationships.setdefault((start, self._rel_type(rel), end), {})
+
+    def _transition(self, start, rel, end, wf_id):
+        key = (start, self._rel_type(rel), end)
+        self.relationships[key] = self._transitions.add(key, wf_id)
+
+    def tool(self, name):
+        return self._node('Tool', (name,), {'name': name})
+
+    def version(self, tool_name, version):
+        tool = self.tool(tool_name)
+        v = self._node(
+            'Version', (tool_name, version), {'name': version}
+        )
+        self._relate(tool, 'Tool_to_Version', v)
+        return v
+
+    def io_dataset(self, io_node_type, tool_name, version, name):
+        v = self.version(tool_name, version)
+        d = self._node(
+            io_node_type, (tool_name, version, name), {'name': name}
+        )
+        if io_node_type == 'ToolInput':
+            self._relate(d, 'Version_to_ToolInput', v)
+        else:
+            self._relate(v, 'Version_to_ToolOutput', d)
+        return d
+
+    def datatype(self, name, edam_format):
+        dt = self._node('Datatype', (name,), {'name': name})
+        fmt = self._node('EDAMFormat', (edam_format,), {'id': edam_format})
+        self._relate(dt, 'Datatype_to_EDAMFormat', fmt)
+        return dt
+
+    def workflow(self, wf_id):
+        return self._node('Workflow', (wf_id,), {'id': wf_id})
+
+    def add_io_row(self, row, io_node_type):
+        """Add a row of a tool_iformats/tool_oformats CSV.
+
+        io_node_type is either "ToolInput" or "ToolOutput".
+        """
+
+        tool_name, version, name, extension, edam_format = row[:5]
+        if not all(row[:5]):
+            self.skipped += 1
+            return
+        d = self.io_dataset(io_node_type, tool_name, version, name)
+        dt = self.datatype(extension, edam_format)
+        self._relate(d, '{0}_to_Datatype'.format(io_node_type), dt)
+
+    def add_workflow_row(self, row):
+        """Add a row of a workflow connections CSV."""
+
+        wf_id, in_tool, in_v, output, out_tool, input_, out_v = row[:7]
+        if not all(row[:7]):
+            self.skipped += 1
+            return
+        wf = self.workflow(wf_id)
+        d_out = self.io_dataset('ToolOutput', in_tool, in_v, output)
+        d_in = self.io_dataset('ToolInput', out_tool, out_v, input_)
+        conn = self._node('WorkflowConnection', (d_out, d_in), {})
+        self._relate(d_out, 'WorkflowConnection_to_ToolOutput', conn)
+        self._relate(conn, 'WorkflowConnection_to_ToolInput', d_in)
+        self._relate(conn, 'Workflow', wf)
+        self._transition(
+            self.tool(in_tool), 'Tool_to_Tool', self.tool(out_tool), wf_id
+        )
+        self._transition(
+            self.version(in_tool, in_v), 'Version_to_Version',
+            self.version(out_tool, out_v), wf_id
+        )
+
+    def add_usage_row(self, row):
+        """Add a row of a tools_usage_prediction CSV."""
+
+        tool_name, version, usage = row[0], row[1], row[3]
+        try:
+            value = float(usage)
+        except ValueError:
+            value = None
+        if not (tool_name and version and usage) or value is None:
+            self.skipped += 1
+            return
+        v = self.version(tool_name, version)
+        tu = self._node(
+            'ToolUsage', (tool_name, version, usage),
+            {'usage': value, 'name': usage}
+        )
+        self._relate(v, 'Version_to_Usage', tu)
+
+    def load_io_csv(self, file_name, io_node_type):
+        for row in iter_rows(file_name):
+            self.add_io_row(row, io_node_type)
+
+    def load_workflow_csv(self, file_name):
+        for row in iter_rows(file_name):
+            self.add_workflow_row(row)
+
+    def load_usage_csv(self, file_name):
+        for row in iter_rows(file_name):
+            self.add_usage_row(row)
+
+    @classmethod
+    def from_csv_files(
+        cls, tool_inputs_file=None, tool_outputs_file=None,
+        workflow_file=None, tool_usage_file=None
+    ):
+        """Build the graph from the same files the Neo4j import uses."""
+
+        this = cls()
+        if tool_outputs_file:
+            this.load_io_csv(tool_outputs_file, 'ToolOutput')
+        if tool_inputs_file:
+            this.load_io_csv(tool_inputs_file, 'ToolInput')
+        if workflow_file:
+            this.load_workflow_csv(workflow_file)
+        if tool_usage_file:
+            this.load_usage_csv(tool_usage_file)
+        return this
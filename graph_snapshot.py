@@ -0,0 +1,170 @@
+"""Versioned snapshot files of the workflow graph.
+
+A snapshot is a gzip compressed JSON lines file: a header line with the
+format, version and schema (indexed properties as label, property,
+unique), one line per node, then one line per relationship, and a
+trailer line with the number of nodes and relationships written, so
+that a truncated snapshot is detected when it is read.
+
+Nodes are written as {"id", "labels", "properties"} and relationships as
+{"type", "start", "end", "properties"} where start and end refer to the
+ids of the nodes in the same snapshot. Since version 2, relationships
+also name the first label and the uid property (or null) of their
+start_label/start_uid and end_label/end_uid nodes, so that a restore
+can find them through the uid constraints. Snapshots are written and
+read one record at a time, so memory use does not depend on the size of
+the graph.
+
+WorkflowGraphDatabase.export_snapshot and restore_snapshot move a graph
+between Neo4j instances through a snapshot, and
+graph_engine.CompactGraph.from_snapshot loads one without a database.
+"""
+
+import argparse
+import gzip
+import json
+import os
+import time
+
+
+SNAPSHOT_FORMAT = 'workflow-graph-snapshot'
+SNAPSHOT_VERSION = 2
+
+
+def write_snapshot(file_name, schema, nodes, relationships):
+    """Write a snapshot from iterables of node and relationship dicts.
+
+    nodes are dicts with id, labels and properties, relationships dicts
+    with type, start, end, properties and the start_label, start_uid,
+    end_label and end_uid of their nodes, like those yielded by
+    WorkflowGraphDatabase.iter_nodes and iter_relationships. All nodes
+    are written before the first relationship. Returns the number of
+    nodes and relationships written.
+    """
+
+    header = {
+        'format': SNAPSHOT_FORMAT,
+        'version': SNAPSHOT_VERSION,
+        'created': time.time(),
+        'schema': [list(entry) for entry in schema]
+    }
+    n_nodes = n_rels = 0
+    tmp = file_name + '.tmp'
+    with gzip.open(tmp, 'wt', encoding='utf-8') as o:
+        o.write(json.dumps(header) + '\n')
+        for node in nodes:
+            o.write(json.dumps({
+                'id': node['id'],
+                'labels': node['labels'],
+                'properties': node['properties']
+            }) + '\n')
+            n_nodes += 1
+        for rel in relationships:
+            o.write(json.dumps({
+                'type': rel['type'],
+                'start': rel['start'],
+                'end': rel['end'],
+                'properties': rel['properties'],
+                'start_label': rel.get('start_label'),
+                'start_uid': rel.get('start_uid'),
+                'end_label': rel.get('end_label'),
+                'end_uid': rel.get('end_uid')
+            }) + '\n')
+            n_rels += 1
+        o.write(json.dumps({'complete': True, 'nodes': n_nodes, 'relationships': n_rels}) + '\n')
+    # only complete snapshots ever appear under file_name
+    os.replace(tmp, file_name)
+    return n_nodes, n_rels
+
+
+def read_snapshot(file_name):
+    """Open a snapshot and return its header and an iterator of records.
+
+    Records are node or relationship dicts, which can be told apart by
+    the type key that only relationships have. The iterator raises a
+    ValueError if the snapshot turns out to be truncated.
+    """
+
+    i = gzip.open(file_name, 'rt', encoding='utf-8')
+    try:
+        header = json.loads(i.readline() or '{}')
+    except ValueError:
+        header = {}
+    if header.get('format') != SNAPSHOT_FORMAT:
+        i.close()
+        raise ValueError('{0} is not a workflow graph snapshot'.format(file_name))
+    if header.get('version', 0) > SNAPSHOT_VERSION:
+        i.close()
+        raise ValueError(
+            '{0} has snapshot version {1}, only versions up to {2} are supported'.format(
+                file_name, header['version'], SNAPSHOT_VERSION
+            )
+        )
+    return header, _iter_records(i, file_name)
+
+
+def _iter_records(i, file_name):
+    counts = {'nodes': 0, 'relationships': 0}
+    with i:
+        try:
+            for line in i:
+                record = json.loads(line)
+                if record.get('complete'):
+                    if record['nodes'] != counts['nodes'] \
+                       or record['relationships'] != counts['relationships']:
+                        raise ValueError(
+                            '{0}: snapshot counts do not match its trailer'.format(file_name)
+                        )
+                    return
+                counts['relationships' if 'type' in record else 'nodes'] += 1
+                yield record
+        except EOFError:
+            pass
+    raise ValueError('{0}: snapshot is truncated'.format(file_name))
+
+
+def load_snapshot_elements(file_name):
+    """Return the nodes and relationships of a snapshot.
+
+    Both are returned in the format of the graph_model.GraphBuilder
+    attributes, with the first label of every node as its label. Nodes
+    are keyed by their uid property, or their snapshot id if they have
+    none.
+    """
+
+    _, records = read_snapshot(file_name)
+    keys = {}
+    nodes = {}
+    relationships = {}
+    for record in records:
+        if 'type' in record:
+            key = (keys[record['start']], record['type'], keys[record['end']])
+            relationships[key] = record['properties']
+        else:
+            props = record['properties']
+            uid = keys[record['id']] = props.get('uid', record['id'])
+            nodes[uid] = (record['labels'][0] if record['labels'] else '', props)
+    return nodes, relationships
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description='Export or restore a workflow graph snapshot')
+    arg_parser.add_argument("command", choices=["export", "restore"], help="Export the graph or restore a snapshot")
+    arg_parser.add_argument("-url", "--url", required=True, help="Neo4j server")
+    arg_parser.add_argument("-un", "--user_name", required=True, help="User name")
+    arg_parser.add_argument("-pass", "--password", required=True, help="Password")
+    arg_parser.add_argument("-f", "--snapshot_file", required=True, help="Snapshot file")
+    arg_parser.add_argument("-bs", "--batch_size", type=int, default=1000, help="Nodes/relationships per restore batch")
+    arg_parser.add_argument("-r", "--replace", action="store_true", help="Delete the existing graph before restoring")
+    args = vars(arg_parser.parse_args())
+
+    from create_workflow_graph import WorkflowGraphDatabase
+
+    graph_db = WorkflowGraphDatabase(args["url"], args["user_name"], args["password"])
+    if args["command"] == "export":
+        graph_db.export_snapshot(args["snapshot_file"])
+    else:
+        if args["replace"]:
+            graph_db.delete_all()
+        graph_db.restore_snapshot(args["snapshot_file"], batch_size=args["batch_size"])
+        graph_db.fetch_records()
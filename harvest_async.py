@@ -0,0 +1,262 @@
+"""Harvest the tool IO details of several Galaxy instances concurrently.
+
+The toolboxes of all instances are listed concurrently. Every distinct
+(tool id, version) is then fetched once, from the first instance (in the
+order given) that lists it, falling back to the next one if the request
+fails. Requests are spread over an asyncio event loop with a bounded
+number of concurrent requests and an optional rate limit per host.
+
+The merged tools are written as JSON lines in the format of
+extract_tools.store_tool_io_data, so they can be processed with
+extract_tools.extract_io_tables. Every record gets an additional
+'instances' key listing the base URLs of all instances providing the
+tool, the first of which the IO details were fetched from.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from extract_tools import (
+    REQUEST_TIMEOUT, APIToolbox, APIToolIO, ToolResponseCache
+)
+
+
+# Response status codes worth retrying after a delay
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+class RateLimiter():
+    """Space the requests to a host at least 1 / rate seconds apart."""
+
+    def __init__(self, rate=None):
+        self.interval = 1 / rate if rate else 0
+        self._next = 0.0
+
+    async def wait(self):
+        if not self.interval:
+            return
+        now = asyncio.get_running_loop().time()
+        delay = self._next - now
+        self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class Harvester():
+    """Fetch toolboxes and tool IO details from Galaxy instances.
+
+    At most concurrency requests are sent to a host at a time, and
+    at most rate requests per second if rate is given. Requests failing
+    with a connection error or one of RETRY_STATUS are retried up to
+    max_retries times with exponential backoff, honouring Retry-After.
+    If a ToolResponseCache is passed as cache, IO details are
+    revalidated against it like in extract_tools.
+    """
+
+    def __init__(self, session, concurrency=8, rate=None, max_retries=3,
+                 cache=None):
+        self.session = session
+        self.concurrency = concurrency
+        self.rate = rate
+        self.max_retries = max_retries
+        self.cache = cache
+        self._limits = {}
+        self.stats = {'requests': 0, 'retries': 0, 'failed': 0, 'failed_toolboxes': 0}
+
+    def _host_limits(self, url):
+        host = urlsplit(url).netloc
+        if host not in self._limits:
+            self._limits[host] = (
+                asyncio.Semaphore(self.concurrency), RateLimiter(self.rate)
+            )
+        return self._limits[host]
+
+    async def get_json(self, url, headers=None):
+        """Return the status, JSON body and headers of a GET request.
+
+        The body is None for a 304 Not Modified response.
+        """
+
+        semaphore, limiter = self._host_limits(url)
+        for attempt in range(self.max_retries + 1):
+            delay = 2 ** attempt * 0.5 * (1 + random.random())
+            async with semaphore:
+                await limiter.wait()
+                self.stats['requests'] += 1
+                try:
+                    async with self.session.get(url, headers=headers) as response:
+                        if response.status == 304:
+                            return response.status, None, response.headers
+                        if response.status not in RETRY_STATUS \
+                           or attempt == self.max_retries:
+                            response.raise_for_status()
+                            return (
+                                response.status,
+                                await response.json(content_type=None),
+                                response.headers
+                            )
+                        retry_after = response.headers.get('Retry-After', '')
+                        if retry_after.isdigit():
+                            delay = int(retry_after)
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                    if attempt == self.max_retries:
+                        raise
+            self.stats['retries'] += 1
+            await asyncio.sleep(delay)
+
+    async def fetch_toolbox(self, galaxy_base, in_panel=True):
+        """Return the tools listed in the toolbox of an instance."""
+
+        _, data, _ = await self.get_json(
+            APIToolbox.query_url(in_panel, galaxy_base)
+        )
+        return list(APIToolbox(data).get_tools())
+
+    async def _fetch_toolbox(self, galaxy_base, in_panel):
+        """Return the tools of an instance and the error listing them."""
+
+        try:
+            return await self.fetch_toolbox(galaxy_base, in_panel), None
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            self.stats['failed_toolboxes'] += 1
+            return [], e
+
+    async def fetch_tool_io(self, galaxy_base, tool_id, tool_version):
+        """Return the IO details of a tool version on an instance."""
+
+        url = APIToolIO.query_url(tool_id, galaxy_base, tool_version)
+        key = (galaxy_base, tool_id, tool_version)
+        entry = self.cache.get(key, url) if self.cache is not None else None
+        headers = {}
+        if entry is not None:
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+        status, data, response_headers = await self.get_json(url, headers)
+        if status == 304 and entry is not None:
+            self.cache.stats['revalidated'] += 1
+            return entry['data']
+        if self.cache is not None:
+            self.cache.stats['downloaded'] += 1
+            self.cache.put(
+                key, url, data,
+                etag=response_headers.get('ETag'),
+                last_modified=response_headers.get('Last-Modified')
+            )
+        return data
+
+    async def _fetch_first(self, key, instances):
+        """Fetch a tool from the first of instances that succeeds."""
+
+        error = None
+        for galaxy_base in instances:
+            try:
+                return galaxy_base, await self.fetch_tool_io(galaxy_base, *key)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                error = e
+        self.stats['failed'] += 1
+        return None, error
+
+    async def harvest(self, instances, in_panel=True):
+        """Harvest the tools of all instances.
+
+        Returns a dict mapping (tool id, version) to the tool's IO
+        details with the 'instances' key added, in the order the tools
+        were first listed, and a dict of failures. It maps the key of
+        every tool that could not be fetched from any instance and the
+        base URL of every instance whose toolbox could not be listed to
+        the error, see failure_name. The tools of the other instances
+        are harvested regardless.
+        """
+
+        toolboxes = await asyncio.gather(*(
+            self._fetch_toolbox(galaxy_base, in_panel) for galaxy_base in instances
+        ))
+        providers = {}
+        failures = {}
+        for galaxy_base, (tools, error) in zip(instances, toolboxes):
+            if error is not None:
+                failures[galaxy_base] = error
+            for tool in tools:
+                sources = providers.setdefault((tool['id'], tool.get('version')), [])
+                if galaxy_base not in sources:
+                    sources.append(galaxy_base)
+
+        results = await asyncio.gather(*(
+            self._fetch_first(key, sources) for key, sources in providers.items()
+        ))
+        merged = {}
+        for (key, sources), (source, data) in zip(providers.items(), results):
+            if source is None:
+                failures[key] = data
+                continue
+            # list the instance the details came from first
+            data['instances'] = [source] + [s for s in sources if s != source]
+            merged[key] = data
+        return merged, failures
+
+
+def failure_name(key):
+    """Describe a key of the failures returned by Harvester.harvest."""
+
+    if isinstance(key, tuple):
+        return '%s %s' % key
+    return 'toolbox of %s' % key
+
+
+async def harvest_instances(instances, concurrency=8, rate=None, max_retries=3,
+                            cache=None, in_panel=True, timeout=REQUEST_TIMEOUT):
+    """Harvest and merge the tools of several Galaxy instances.
+
+    See Harvester for the arguments and Harvester.harvest for the
+    return value.
+    """
+
+    async with aiohttp.ClientSession(
+        timeout=aiohttp.ClientTimeout(total=timeout),
+        connector=aiohttp.TCPConnector(limit=0)
+    ) as session:
+        harvester = Harvester(session, concurrency, rate, max_retries, cache)
+        merged, failures = await harvester.harvest(instances, in_panel)
+    return merged, failures, harvester.stats
+
+
+def write_harvest(merged, ofn):
+    """Write harvested tools as JSON lines readable by iter_tool_io_data."""
+
+    with open(ofn, 'w') as o:
+        for data in merged.values():
+            o.write(json.dumps(data))
+            o.write('\n')
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        description='Harvest the tool IO details of several Galaxy instances'
+    )
+    arg_parser.add_argument("-g", "--galaxy", action="append", required=True, help="Galaxy base URL, repeat for several instances")
+    arg_parser.add_argument("-o", "--out_file", required=True, help="JSON lines file to write the merged tools to")
+    arg_parser.add_argument("-c", "--concurrency", type=int, default=8, help="Concurrent requests per host")
+    arg_parser.add_argument("-r", "--rate", type=float, help="Maximum requests per second per host")
+    arg_parser.add_argument("-cd", "--cache_dir", help="Directory to cache tool responses in")
+    arg_parser.add_argument("-a", "--all_tools", action="store_true", help="Harvest all tools, not only those in the tool panel")
+    args = vars(arg_parser.parse_args())
+    s_time = time.time()
+    cache = ToolResponseCache(args["cache_dir"]) if args["cache_dir"] else None
+    merged, failures, stats = asyncio.run(harvest_instances(
+        args["galaxy"], args["concurrency"], args["rate"], cache=cache,
+        in_panel=not args["all_tools"]
+    ))
+    write_harvest(merged, args["out_file"])
+    e_time = time.time()
+    for key, error in failures.items():
+        print("Failed to fetch %s: %s" % (failure_name(key), error))
+    print("Harvested %d tools from %d instances (%d requests, %d retries) in %d seconds" % (
+        len(merged), len(args["galaxy"]), stats['requests'], stats['retries'], int(e_time - s_time)))
@@ -0,0 +1,88 @@
+"""Per-statement metrics of the Cypher statements run during an import.
+
+WorkflowGraphDatabase records one entry per executed import statement:
+its phase, duration, the summary counters reported by the server and,
+if the statement was profiled, the total number of db hits. The entries
+can be written as a JSON or CSV report.
+"""
+
+import csv
+import json
+import os
+
+
+# Summary counters reported in the CSV report, in this order
+COUNTERS = (
+    'nodes_created',
+    'nodes_deleted',
+    'relationships_created',
+    'relationships_deleted',
+    'properties_set',
+    'labels_added',
+    'indexes_added',
+    'indexes_removed',
+    'constraints_added',
+    'constraints_removed'
+)
+
+CSV_COLUMNS = ('phase', 'index', 'seconds') + COUNTERS + ('db_hits', 'statement')
+
+
+def sum_db_hits(plan):
+    """Return the total db hits of a profiled plan as returned over Bolt."""
+
+    if not plan:
+        return None
+    return plan.get('dbHits', 0) + sum(
+        sum_db_hits(child) or 0 for child in plan.get('children', ())
+    )
+
+
+class ImportMetrics:
+    """Collection of per-statement import metrics."""
+
+    def __init__(self):
+        self.records = []
+
+    def add(self, phase, statement, seconds, counters, db_hits=None):
+        record = {
+            'phase': phase,
+            'index': sum(1 for r in self.records if r['phase'] == phase),
+            'seconds': seconds,
+            'statement': ' '.join(statement.split())
+        }
+        for counter in COUNTERS:
+            record[counter] = counters.get(counter, 0)
+        record['db_hits'] = db_hits
+        self.records.append(record)
+        return record
+
+    def phase_totals(self):
+        """Return the summed seconds and counters per phase."""
+
+        totals = {}
+        for record in self.records:
+            total = totals.setdefault(
+                record['phase'],
+                dict.fromkeys(('seconds', 'statements') + COUNTERS, 0)
+            )
+            total['seconds'] += record['seconds']
+            total['statements'] += 1
+            for counter in COUNTERS:
+                total[counter] += record[counter]
+        return totals
+
+    def write_report(self, file_name):
+        """Write the metrics as JSON, or as CSV for a .csv file_name."""
+
+        if os.path.splitext(file_name)[1].lower() == '.csv':
+            with open(file_name, 'w', newline='') as o:
+                w = csv.DictWriter(o, fieldnames=CSV_COLUMNS)
+                w.writeheader()
+                w.writerows(self.records)
+        else:
+            with open(file_name, 'w') as o:
+                json.dump(
+                    {'statements': self.records, 'phases': self.phase_totals()},
+                    o, indent=2
+                )
@@ -0,0 +1,459 @@
+"""Refresh the workflow graph end to end as a DAG of cached stages.
+
+The stages replace the manual chain of harvesting the tools, extracting
+their inputs and outputs, cleaning the workflow connections, forecasting
+the tool usage, copying the files to the neo4j import directory and
+running the import:
+
+    harvest -> tool_inputs, tool_outputs --+
+    clean_workflows -----------------------+-> copy_import -> load -> usage_graph
+    forecast ------------------------------+                        ^
+    usage_series ---------------------------------------------------+
+
+Every stage declares the files it reads and writes and the parameters
+it depends on. A stage is skipped if the sha1 digests of its input files
+and its parameters are the same as when it last succeeded and its output
+files are unchanged, as recorded in a state file. Since upstream
+outputs are compared by content, a stage rerun with identical results
+does not invalidate the stages after it. Stages whose dependencies are
+done run concurrently in a pool of processes, e.g. tool_inputs and
+tool_outputs, or clean_workflows and forecast.
+
+The harvest stage reads no files, its source is the Galaxy servers, so
+it always runs. Its tool responses are kept in a ToolResponseCache and
+only revalidated, and if the harvested tools are unchanged the stages
+after it are up to date.
+
+Stages that cannot run because they are not configured (no Galaxy
+server, raw workflow dump or Neo4j server given) or whose source files
+do not exist are left out, and their outputs are used as they are.
+
+Heavy dependencies (py2neo, pandas, sklearn, aiohttp, pyarrow) are only
+imported by the stages using them, so status answers immediately.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from delta_import import file_digest
+
+
+class Stage():
+    """A step of the pipeline.
+
+    inputs and outputs name the config entries holding the files the
+    stage reads and writes, params the config entries its results
+    depend on. A stage also depends on the stages producing its inputs
+    and on the stages listed in after, e.g. for effects on the database.
+    The stage only runs if all config entries in requires are set. A
+    stage with always set has sources other than files and runs every
+    time.
+    """
+
+    def __init__(self, name, run, inputs=(), outputs=(), params=(), after=(),
+                 requires=(), always=False):
+        self.name = name
+        self.run = run
+        self.inputs = inputs
+        self.outputs = outputs
+        self.params = params
+        self.after = after
+        self.requires = requires
+        self.always = always
+
+
+def harvest(config):
+    import asyncio
+
+    from extract_tools import ToolResponseCache
+    from harvest_async import failure_name, harvest_instances, write_harvest
+
+    cache = ToolResponseCache(config['tool_cache']) if config.get('tool_cache') else None
+    merged, failures, _ = asyncio.run(harvest_instances(config['galaxy'], cache=cache))
+    for key, error in failures.items():
+        print("Failed to fetch %s: %s" % (failure_name(key), error))
+    if not merged:
+        raise RuntimeError("No tools could be harvested from %s" % ", ".join(config['galaxy']))
+    write_harvest(merged, config['tools_json'])
+
+
+def _extract_io(config, mode, out_key):
+    import columnar_store
+    from extract_tools import write_io_data_to_columnar, write_io_data_to_csv
+
+    if columnar_store.is_columnar(config[out_key]):
+        write_io_data_to_columnar(config['tools_json'], config[out_key], mode)
+    else:
+        write_io_data_to_csv(config['tools_json'], config[out_key], mode)
+
+
+def tool_inputs(config):
+    _extract_io(config, 'inputs', 'tool_inputs')
+
+
+def tool_outputs(config):
+    _extract_io(config, 'outputs', 'tool_outputs')
+
+
+def clean_workflows(config):
+    from clean_workflows import clean_workflow_connections
+
+    clean_workflow_connections(
+        config['raw_workflows'], config['workflows'], config['workflow_ids']
+    )
+
+
+def forecast(config):
+    from forecast_tool_usage import forecast_tool_usage
+
+    forecast_tool_usage(
+        config['popularity'], config['tool_usage'], config['forecast_model'],
+        cache_dir=config.get('forecast_cache')
+    )
+
+
+def usage_series(config):
+    from usage_series import UsageSeries
+
+    store_file = config['usage_series']
+    store = UsageSeries.load(store_file) if os.path.exists(store_file) else UsageSeries()
+    store.append_file(config['popularity'])
+    store.save(store_file)
+
+
+def copy_import(config):
+    for key in LOAD_FILES:
+        shutil.copyfile(config[key], config['import_' + key])
+
+
+def _graph_db(config):
+    from create_workflow_graph import WorkflowGraphDatabase
+
+    return WorkflowGraphDatabase(config['url'], config['user_name'], config['password'])
+
+
+def load(config):
+    graph_db = _graph_db(config)
+    graph_db.delete_all()
+    if config['mode'] == 'streamed':
+        graph_db.ingest_streamed(
+            config['tool_inputs'], config['tool_outputs'], config['workflows'],
+            config['tool_usage']
+        )
+    else:
+        graph_db.load_io_data_from_csv(config['tool_outputs'], 'ToolOutput')
+        graph_db.load_io_data_from_csv(config['tool_inputs'], 'ToolInput')
+        graph_db.create_graph_bulk_merge(
+            config['workflows'], config['tool_usage'], config['workflow_ids']
+        )
+
+
+def usage_graph(config):
+    from usage_series import UsageSeries
+
+    _graph_db(config).write_usage_series(UsageSeries.load(config['usage_series']))
+
+
+# Files the import reads
+LOAD_FILES = ('tool_inputs', 'tool_outputs', 'workflows', 'workflow_ids', 'tool_usage')
+
+STAGES = (
+    Stage('harvest', harvest, outputs=('tools_json',), params=('galaxy',),
+          requires=('galaxy',), always=True),
+    Stage('tool_inputs', tool_inputs, inputs=('tools_json',), outputs=('tool_inputs',)),
+    Stage('tool_outputs', tool_outputs, inputs=('tools_json',), outputs=('tool_outputs',)),
+    Stage('clean_workflows', clean_workflows, inputs=('raw_workflows',),
+          outputs=('workflows', 'workflow_ids'), requires=('raw_workflows',)),
+    Stage('forecast', forecast, inputs=('popularity',), outputs=('tool_usage',),
+          params=('forecast_model',)),
+    Stage('usage_series', usage_series, inputs=('popularity',), outputs=('usage_series',)),
+    Stage('copy_import', copy_import, inputs=LOAD_FILES,
+          outputs=tuple('import_' + key for key in LOAD_FILES), requires=('csv_mode',)),
+    Stage('load', load, inputs=LOAD_FILES, params=('url', 'mode'), after=('copy_import',),
+          requires=('url',)),
+    Stage('usage_graph', usage_graph, inputs=('usage_series',), params=('url',),
+          after=('load',), requires=('url',)),
+)
+
+_STAGES_BY_NAME = {stage.name: stage for stage in STAGES}
+
+
+def dependencies(stage):
+    """Return the names of the stages a stage depends on."""
+
+    deps = [s.name for s in STAGES if set(s.outputs) & set(stage.inputs)]
+    return deps + [name for name in stage.after if name not in deps]
+
+
+def available_stages(config):
+    """Return the names of the stages that can run with config.
+
+    A stage can run if the config entries it requires are set and all
+    its input files exist or are produced by a stage that can run.
+    """
+
+    available = []
+    produced = set()
+    for stage in STAGES:
+        if all(config.get(key) for key in stage.requires) and all(
+            key in produced or (config.get(key) and os.path.exists(config[key]))
+            for key in stage.inputs
+        ):
+            available.append(stage.name)
+            produced.update(stage.outputs)
+    return available
+
+
+def select_stages(config, targets=None):
+    """Return the available stages needed for targets, in DAG order."""
+
+    available = available_stages(config)
+    if not targets:
+        return available
+    for name in targets:
+        if name not in _STAGES_BY_NAME:
+            raise ValueError('Unknown stage {0}'.format(name))
+        if name not in available:
+            raise ValueError('Stage {0} is not configured or misses input files'.format(name))
+    needed = set()
+    todo = list(targets)
+    while todo:
+        name = todo.pop()
+        if name not in needed:
+            needed.add(name)
+            todo.extend(d for d in dependencies(_STAGES_BY_NAME[name]) if d in available)
+    return [name for name in available if name in needed]
+
+
+def stage_key(stage, config, state):
+    """Return the cache key of a stage for the current inputs and params.
+
+    Returns None if an input file does not exist (yet).
+    """
+
+    inputs = {}
+    for key in stage.inputs:
+        if not os.path.exists(config[key]):
+            return None
+        inputs[key] = file_digest(config[key])
+    content = {
+        'stage': stage.name,
+        'params': {key: config.get(key) for key in stage.params},
+        'inputs': inputs,
+        # stages acting on the database change it whenever they run
+        'after': {name: state.get(name, {}).get('finished') for name in stage.after}
+    }
+    return hashlib.sha1(json.dumps(content, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def is_up_to_date(stage, config, state, key):
+    """Return whether a stage last succeeded with key and its outputs are unchanged."""
+
+    entry = state.get(stage.name)
+    if stage.always or key is None or entry is None or entry['key'] != key:
+        return False
+    return all(
+        os.path.exists(config[out]) and file_digest(config[out]) == entry['outputs'].get(out)
+        for out in stage.outputs
+    )
+
+
+def load_state(state_file):
+    try:
+        with open(state_file) as i:
+            return json.load(i)
+    except FileNotFoundError:
+        return {}
+
+
+def save_state(state, state_file):
+    tmp = state_file + '.tmp'
+    with open(tmp, 'w') as o:
+        json.dump(state, o, indent=1, sort_keys=True)
+    os.replace(tmp, state_file)
+
+
+def _run_stage(name, config):
+    s_time = time.time()
+    _STAGES_BY_NAME[name].run(config)
+    return time.time() - s_time
+
+
+def run_pipeline(config, state_file, targets=None, force=(), jobs=None):
+    """Run the stages needed for targets (all stages by default).
+
+    Stages that are up to date are skipped unless named in force (or
+    force contains 'all'). Independent stages run concurrently in up to
+    jobs processes. If a stage fails, the stages depending on it are not
+    run, the others are completed. Returns a dict mapping every selected
+    stage to 'cached', 'done', 'failed' or 'skipped'.
+    """
+
+    names = select_stages(config, targets)
+    state = load_state(state_file)
+    deps = {
+        name: [d for d in dependencies(_STAGES_BY_NAME[name]) if d in names]
+        for name in names
+    }
+    results = {}
+    running = {}
+    keys = {}
+    with ProcessPoolExecutor(jobs) as pool:
+        while len(results) < len(names):
+            for name in names:
+                if name in results or name in running.values():
+                    continue
+                if any(results.get(d) in ('failed', 'skipped') for d in deps[name]):
+                    results[name] = 'skipped'
+                    print("[%s] skipped, an upstream stage failed" % name)
+                    continue
+                if not all(results.get(d) in ('cached', 'done') for d in deps[name]):
+                    continue
+                stage = _STAGES_BY_NAME[name]
+                key = stage_key(stage, config, state)
+                if key is None:
+                    results[name] = 'failed'
+                    print("[%s] failed, missing input files" % name)
+                elif name not in force and 'all' not in force \
+                        and is_up_to_date(stage, config, state, key):
+                    results[name] = 'cached'
+                    print("[%s] up to date" % name)
+                else:
+                    print("[%s] started" % name)
+                    running[pool.submit(_run_stage, name, config)] = name
+                    keys[name] = key
+                    # its outputs are rewritten, so it is stale until it succeeds
+                    state.pop(name, None)
+            if not running:
+                # stages resolved without running may have unblocked others
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                stage = _STAGES_BY_NAME[name]
+                try:
+                    seconds = future.result()
+                except Exception as e:
+                    results[name] = 'failed'
+                    print("[%s] failed: %r" % (name, e))
+                else:
+                    results[name] = 'done'
+                    state[name] = {
+                        'key': keys[name],
+                        'outputs': {out: file_digest(config[out]) for out in stage.outputs},
+                        'finished': time.time()
+                    }
+                    print("[%s] done in %.1f seconds" % (name, seconds))
+                save_state(state, state_file)
+    return results
+
+
+def pipeline_status(config, state_file):
+    """Return (stage, status, dependencies) of every stage.
+
+    The status is 'up to date', 'stale', 'always run' or 'not
+    configured' (its outputs are used as they are).
+    """
+
+    available = available_stages(config)
+    state = load_state(state_file)
+    ret = []
+    for stage in STAGES:
+        if stage.name not in available:
+            status = 'not configured'
+        elif stage.always:
+            status = 'always run'
+        elif is_up_to_date(stage, config, state, stage_key(stage, config, state)):
+            status = 'up to date'
+        else:
+            status = 'stale'
+        ret.append((stage.name, status, dependencies(stage)))
+    return ret
+
+
+def make_config(args):
+    """Return the pipeline config for parsed command line arguments."""
+
+    data_dir = args["data_dir"]
+
+    def data_file(key, default):
+        return args[key] or os.path.join(data_dir, default)
+
+    config = {
+        'galaxy': args["galaxy"],
+        'tool_cache': data_file("tool_cache", "tool_cache"),
+        'tools_json': data_file("tools_json", "tools.json"),
+        'tool_inputs': data_file("tool_inputs_file", "tool_iformats.csv"),
+        'tool_outputs': data_file("tool_outputs_file", "tool_oformats.csv"),
+        'raw_workflows': args["raw_workflows"],
+        'workflows': data_file("workflow_file", "workflow_connections.csv"),
+        'workflow_ids': data_file("workflow_ids_file", "wf_ids.csv"),
+        'popularity': data_file("popularity_file", "tool-popularity-19-09.tsv"),
+        'tool_usage': data_file("tool_usage_file", "tools_usage_prediction.csv"),
+        'forecast_model': args["forecast_model"],
+        'forecast_cache': data_file("forecast_cache", "forecast_cache"),
+        'usage_series': data_file("usage_series", "usage_series.pkl"),
+        'url': args["url"],
+        'user_name': args["user_name"],
+        'password': args["password"] or os.environ.get("NEO4J_PASSWORD", ""),
+        'mode': args["mode"],
+        'csv_mode': args["mode"] == "csv"
+    }
+    for key in LOAD_FILES:
+        config['import_' + key] = os.path.join(args["import_dir"], os.path.basename(config[key]))
+    return config
+
+
+if __name__ == "__main__":
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("-d", "--data_dir", default="data", help="Directory of the pipeline files")
+    common.add_argument("-sf", "--state_file", default="pipeline_state.json", help="File recording the stages run")
+    common.add_argument("-g", "--galaxy", action="append", help="Galaxy base URL to harvest, repeat for several instances")
+    common.add_argument("-tc", "--tool_cache", help="Directory to cache the harvested tool responses in")
+    common.add_argument("-tj", "--tools_json", help="Harvested tools JSON")
+    common.add_argument("-ti", "--tool_inputs_file", help="Tool inputs file")
+    common.add_argument("-to", "--tool_outputs_file", help="Tool outputs file")
+    common.add_argument("-rw", "--raw_workflows", help="Raw gxadmin workflow connections TSV")
+    common.add_argument("-wf", "--workflow_file", help="Workflow file")
+    common.add_argument("-wfi", "--workflow_ids_file", help="Deduplicated workflow ids file")
+    common.add_argument("-pop", "--popularity_file", help="Tool popularity TSV")
+    common.add_argument("-tuf", "--tool_usage_file", help="Tool usage file")
+    common.add_argument("-fm", "--forecast_model", default="median", choices=["median", "svr"], help="Usage forecast model")
+    common.add_argument("-fc", "--forecast_cache", help="Directory to cache the fitted forecast models in")
+    common.add_argument("-us", "--usage_series", help="Usage series file")
+    common.add_argument("-url", "--url", help="Neo4j server to load the graph into")
+    common.add_argument("-un", "--user_name", default="neo4j", help="User name")
+    common.add_argument("-pass", "--password", help="Password (default: $NEO4J_PASSWORD)")
+    common.add_argument("-m", "--mode", default="csv", choices=["csv", "streamed"],
+                        help="Import with LOAD CSV from the import directory or stream the files over Bolt")
+    common.add_argument("-imp", "--import_dir", default="/var/lib/neo4j/import", help="Neo4j import directory")
+    arg_parser = argparse.ArgumentParser(description='Refresh the workflow graph from its sources')
+    subparsers = arg_parser.add_subparsers(dest="command", required=True)
+    run_parser = subparsers.add_parser("run", parents=[common], help="Run the stages that are not up to date")
+    run_parser.add_argument("stages", nargs="*", help="Stages to run with their dependencies (default: all)")
+    run_parser.add_argument("-f", "--force", action="append", default=[], help="Run a stage even if up to date, or 'all'")
+    run_parser.add_argument("-j", "--jobs", type=int, help="Stages run concurrently (default: number of CPUs)")
+    subparsers.add_parser("status", parents=[common], help="Show the stages and whether they are up to date")
+    args = vars(arg_parser.parse_args())
+    config = make_config(args)
+
+    if args["command"] == "status":
+        for name, status, deps in pipeline_status(config, args["state_file"]):
+            print("%-16s %-15s %s" % (name, status, ", ".join(deps)))
+    else:
+        s_time = time.time()
+        try:
+            results = run_pipeline(config, args["state_file"], args["stages"], args["force"], args["jobs"])
+        except ValueError as e:
+            arg_parser.error(str(e))
+        e_time = time.time()
+        counts = {status: list(results.values()).count(status) for status in ('done', 'cached', 'failed', 'skipped')}
+        print("%d stages run, %d up to date, %d failed, %d skipped in %d seconds" % (
+            counts['done'], counts['cached'], counts['failed'], counts['skipped'], int(e_time - s_time)))
+        if counts['failed'] or counts['skipped']:
+            raise SystemExit(1)
@@ -0,0 +1,143 @@
+"""Bounded cache for the results of read-only Cypher queries.
+
+Entries are keyed by the whitespace-normalized query text and its
+parameters, evicted in LRU order when the number of entries or their
+accumulated size exceeds the configured limits and expire after a time
+to live. Every entry is tagged with the graph generation it was
+computed for, so bumping the generation after an import invalidates all
+results computed before.
+
+Results are copied on the way in and out of the cache, so callers may
+modify the records they get without affecting later hits.
+"""
+
+import copy
+import json
+import pickle
+import re
+import threading
+import time
+from collections import OrderedDict
+
+
+_WHITESPACE = re.compile(r'\s+')
+_WRITE_CLAUSES = re.compile(
+    r'\b(CREATE|MERGE|DELETE|DETACH|SET|REMOVE|DROP|LOAD\s+CSV|CALL)\b',
+    re.IGNORECASE
+)
+
+
+def normalize_query(query):
+    """Collapse whitespace and strip a trailing semicolon from a query."""
+
+    return _WHITESPACE.sub(' ', query).strip().rstrip(';').strip()
+
+
+def is_read_only(query):
+    """Return whether a query contains no clause that may write.
+
+    This is a conservative, purely textual check, so queries that merely
+    mention one of the keywords in a string literal are treated as
+    writing queries.
+    """
+
+    return _WRITE_CLAUSES.search(query) is None
+
+
+def result_size(value):
+    """Estimate the memory held by a cached result in bytes."""
+
+    try:
+        return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return len(repr(value))
+
+
+class QueryCache:
+    """LRU/TTL cache of query results with generation-based invalidation."""
+
+    def __init__(self, max_entries=256, max_bytes=64 * 1024 * 1024, ttl=3600):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'expirations': 0,
+            'invalidations': 0
+        }
+
+    @staticmethod
+    def make_key(query, parameters=None):
+        return (
+            normalize_query(query),
+            json.dumps(parameters or {}, sort_keys=True, default=str)
+        )
+
+    def get(self, key, generation):
+        """Return (True, result) for a valid entry, (False, None) else.
+
+        The result is a copy of the cached one.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return False, None
+            result, size, entry_generation, created = entry
+            hit = False
+            if entry_generation != generation:
+                self._stats['invalidations'] += 1
+            elif self.ttl is not None and time.time() - created > self.ttl:
+                self._stats['expirations'] += 1
+            else:
+                self._entries.move_to_end(key)
+                self._stats['hits'] += 1
+                hit = True
+            if not hit:
+                self._remove(key)
+                self._stats['misses'] += 1
+                return False, None
+        # cached results are never modified, so they can be copied unlocked
+        return True, copy.deepcopy(result)
+
+    def put(self, key, result, generation):
+        """Store a copy of a result computed for generation."""
+
+        size = result_size(result)
+        if size > self.max_bytes:
+            return
+        result = copy.deepcopy(result)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (result, size, generation, time.time())
+            self.bytes += size
+            while len(self._entries) > self.max_entries \
+                    or self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._stats['evictions'] += 1
+
+    def _remove(self, key):
+        self.bytes -= self._entries.pop(key)[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        """Return hit/miss counters and the current size of the cache."""
+
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self.bytes
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,243 @@
+"""Top-k next tool recommendations from workflow and usage data.
+
+Answers "which tools usually come next after tool X (version V)" from a
+precomputed table instead of walking
+
+Tool-[:HAS_VERSION]->Version-[:GENERATES_OUTPUT]->ToolOutput
+-[:IS_CONNECTED_BY]->WorkflowConnection-[:TO_INPUT]->ToolInput
+-[:FEEDS_INTO]->Version<-[:HAS_VERSION]-Tool
+
+for every request. Candidates are the tools (versions) following a tool
+(version) in workflows, as counted by graph_model.count_transitions.
+They are scored by the number of workflows they follow it in, weighted
+by their predicted usage from the tools_usage_prediction CSV:
+
+    score = workflows * (1 + usage_weight * log(1 + usage))
+
+The ranked lists are built once, persisted to a file and served through
+the Recommender API or a small local HTTP/JSON endpoint.
+"""
+
+import argparse
+import json
+import math
+import pickle
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from graph_model import count_transitions, iter_rows
+
+
+def load_usage(rows):
+    """Return the predicted usage of every (tool, version) as float."""
+
+    usage = {}
+    for row in rows:
+        tool_name, version, value = row[0], row[1], row[3]
+        try:
+            usage[(tool_name, version)] = float(value)
+        except ValueError:
+            continue
+    return usage
+
+
+def score(workflows, usage, usage_weight):
+    """Return the score of a candidate next tool."""
+
+    return workflows * (1 + usage_weight * math.log1p(max(usage, 0.0)))
+
+
+def _rank(candidates, k):
+    """Return the k best (score, workflows, *next) candidates as tuples."""
+
+    ranked = sorted(candidates, key=lambda c: (-c[0], -c[1], c[2:]))
+    return tuple(ranked[:k])
+
+
+class Recommender:
+    """Precomputed top-k next tools per tool and per tool version.
+
+    self.tools maps a tool name to tuples of (score, workflows, next
+    tool), self.versions maps a (tool, version) pair to tuples of
+    (score, workflows, next tool, next version), both best first.
+    """
+
+    def __init__(self, tools, versions, k):
+        self.tools = tools
+        self.versions = versions
+        self.k = k
+
+    @classmethod
+    def build(cls, workflow_rows, usage_rows=(), k=10, usage_weight=0.25):
+        """Build the recommendations from workflow and usage CSV rows."""
+
+        tool_transitions, version_transitions = count_transitions(workflow_rows)
+        version_usage = load_usage(usage_rows)
+        tool_usage = {}
+        for (tool_name, _), value in version_usage.items():
+            tool_usage[tool_name] = tool_usage.get(tool_name, 0.0) + value
+
+        tool_candidates = {}
+        for (tool_name, next_tool), props in tool_transitions.items():
+            tool_candidates.setdefault(tool_name, []).append((
+                score(props['workflows'], tool_usage.get(next_tool, 0.0), usage_weight),
+                props['workflows'], next_tool
+            ))
+        version_candidates = {}
+        for (tool_name, version, next_tool, next_version), props in version_transitions.items():
+            version_candidates.setdefault((tool_name, version), []).append((
+                score(
+                    props['workflows'],
+                    version_usage.get((next_tool, next_version), 0.0),
+                    usage_weight
+                ),
+                props['workflows'], next_tool, next_version
+            ))
+        return cls(
+            {t: _rank(c, k) for t, c in tool_candidates.items()},
+            {v: _rank(c, k) for v, c in version_candidates.items()},
+            k
+        )
+
+    @classmethod
+    def from_csv_files(cls, workflow_file, tool_usage_file=None, k=10,
+                       usage_weight=0.25):
+        """Build the recommendations from the files the graph import uses."""
+
+        usage_rows = iter_rows(tool_usage_file) if tool_usage_file else ()
+        return cls.build(iter_rows(workflow_file), usage_rows, k, usage_weight)
+
+    def recommend(self, tool, version=None, k=None):
+        """Return the best next tools after a tool, or a tool version.
+
+        Returns a list of dicts with the next tool, its version (for
+        version lookups), score and number of workflows, best first.
+        Unknown tools get an empty list.
+        """
+
+        k = self.k if k is None else k
+        if version is None:
+            return [
+                {'tool': c[2], 'score': c[0], 'workflows': c[1]}
+                for c in self.tools.get(tool, ())[:k]
+            ]
+        return [
+            {'tool': c[2], 'version': c[3], 'score': c[0], 'workflows': c[1]}
+            for c in self.versions.get((tool, version), ())[:k]
+        ]
+
+    def recommend_many(self, queries, k=None):
+        """Return recommend for every query, a dict with tool and version."""
+
+        return [
+            self.recommend(q['tool'], q.get('version'), q.get('k', k))
+            for q in queries
+        ]
+
+    def save(self, file_name):
+        """Persist the recommendations to file_name."""
+
+        with open(file_name, 'wb') as o:
+            pickle.dump(self, o, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, file_name):
+        """Load recommendations persisted with save."""
+
+        with open(file_name, 'rb') as i:
+            this = pickle.load(i)
+        if not isinstance(this, cls):
+            raise TypeError(
+                '{0} does not contain a {1}'.format(file_name, cls.__name__)
+            )
+        return this
+
+
+class RecommendationHandler(BaseHTTPRequestHandler):
+    """JSON endpoint for the Recommender of its server.
+
+    GET /recommend?tool=<name>[&version=<version>][&k=<n>] returns
+    {"results": [...]} for a single lookup, POST /recommend with a body
+    {"queries": [{"tool": ..., "version": ...}, ...], "k": n}, or just
+    the list of queries, returns {"results": [[...], ...]} for a batch.
+    """
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path != '/recommend':
+            return self._reply(404, {'error': 'not found'})
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if 'tool' not in params:
+            return self._reply(400, {'error': 'tool parameter required'})
+        try:
+            k = int(params['k']) if 'k' in params else None
+        except ValueError:
+            return self._reply(400, {'error': 'k has to be an integer'})
+        self._reply(200, {'results': self.server.recommender.recommend(
+            params['tool'], params.get('version'), k
+        )})
+
+    def do_POST(self):
+        if urlsplit(self.path).path != '/recommend':
+            return self._reply(404, {'error': 'not found'})
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            body = json.loads(self.rfile.read(length) or b'{}')
+            if isinstance(body, list):
+                body = {'queries': body}
+            results = self.server.recommender.recommend_many(
+                body['queries'], body.get('k')
+            )
+        except (ValueError, KeyError, TypeError) as e:
+            return self._reply(400, {'error': 'invalid request: {0}'.format(e)})
+        self._reply(200, {'results': results})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(recommender, host='127.0.0.1', port=8080):
+    """Return an HTTP server answering recommendation requests."""
+
+    server = ThreadingHTTPServer((host, port), RecommendationHandler)
+    server.recommender = recommender
+    return server
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description='Next tool recommendations')
+    subparsers = arg_parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="Precompute the recommendations")
+    build_parser.add_argument("-wf", "--workflow_file", required=True, help="Workflow file")
+    build_parser.add_argument("-tuf", "--tool_usage_file", help="Tool usage file")
+    build_parser.add_argument("-o", "--out_file", required=True, help="File to save the recommendations to")
+    build_parser.add_argument("-k", "--top_k", type=int, default=10, help="Recommendations kept per tool")
+    build_parser.add_argument("-uw", "--usage_weight", type=float, default=0.25, help="Weight of the predicted usage")
+    serve_parser = subparsers.add_parser("serve", help="Serve saved recommendations over HTTP")
+    serve_parser.add_argument("-i", "--in_file", required=True, help="Saved recommendations")
+    serve_parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    serve_parser.add_argument("-p", "--port", type=int, default=8080, help="Port to listen on")
+    args = vars(arg_parser.parse_args())
+
+    if args["command"] == "build":
+        s_time = time.time()
+        recommender = Recommender.from_csv_files(
+            args["workflow_file"], args["tool_usage_file"], args["top_k"], args["usage_weight"]
+        )
+        recommender.save(args["out_file"])
+        e_time = time.time()
+        print("Recommendations for %d tools and %d tool versions built in %d seconds" % (
+            len(recommender.tools), len(recommender.versions), int(e_time - s_time)))
+    else:
+        server = make_server(Recommender.load(args["in_file"]), args["host"], args["port"])
+        print("Serving recommendations on http://%s:%d/recommend" % (args["host"], args["port"]))
+        server.serve_forever()
@@ -0,0 +1,168 @@
+"""Generate scaled-up synthetic input data for the workflow graph.
+
+The generated tool_iformats, tool_oformats, workflow connections and
+tool usage CSVs are derived from the real files: every real tool is
+replicated scale times under a suffixed name, keeping its versions,
+inputs, outputs, datatypes and EDAM formats, so the distributions of
+the real data are preserved. Workflow connections are resampled from a
+real workflow connections file if one is given, otherwise generated by
+connecting outputs to inputs of the same datatype.
+"""
+
+import argparse
+import csv
+import os
+import random
+
+from graph_model import iter_rows
+
+
+IO_HEADER = '{0}_name,{0}_extension,{0}_edam_format'
+WORKFLOW_HEADER = [
+    'wf_id', 'in_tool', 'in_tool_version', 'in_tool_output',
+    'out_tool', 'out_tool_input', 'out_tool_version'
+]
+USAGE_HEADER = ['tool_id', 'tool_v', 'future_date', 'usage']
+
+
+def replica_name(tool_name, replica):
+    """Return the name of a tool in a replica, keeping replica 0 as is."""
+
+    if replica == 0:
+        return tool_name
+    return '{0}_s{1}'.format(tool_name, replica)
+
+
+def _write_csv(file_name, header, rows):
+    with open(file_name, 'w', newline='') as o:
+        w = csv.writer(o)
+        w.writerow(header)
+        n = 0
+        for row in rows:
+            w.writerow(row)
+            n += 1
+    return n
+
+
+def _replicate_io(rows, scale):
+    for replica in range(scale):
+        for row in rows:
+            yield (replica_name(row[0], replica),) + tuple(row[1:5])
+
+
+def _replicate_usage(rows, scale, rng):
+    for replica in range(scale):
+        for tool_id, tool_v, future_date, usage in (r[:4] for r in rows):
+            if replica:
+                # vary usage between replicas by up to +-50%
+                usage = '{0:.1f}'.format(
+                    round(float(usage) * rng.uniform(0.5, 1.5))
+                )
+            yield replica_name(tool_id, replica), tool_v, future_date, usage
+
+
+def _resample_workflows(rows, scale, rng):
+    """Replicate real workflow connections into scale copies.
+
+    Every copy of a workflow connects the tools of one replica, with a
+    small fraction of connections crossing to another replica so that
+    the replicas do not form disjoint graphs.
+    """
+
+    wf_offset = max((int(r[0]) for r in rows if r[0].isdigit()), default=0) + 1
+    for replica in range(scale):
+        for wf_id, in_tool, in_v, output, out_tool, input_, out_v in (r[:7] for r in rows):
+            out_replica = replica
+            if scale > 1 and rng.random() < 0.05:
+                out_replica = rng.randrange(scale)
+            if wf_id.isdigit():
+                wf_id = str(int(wf_id) + replica * wf_offset)
+            else:
+                wf_id = '{0}_s{1}'.format(wf_id, replica)
+            yield (
+                wf_id,
+                replica_name(in_tool, replica), in_v, output,
+                replica_name(out_tool, out_replica), input_, out_v
+            )
+
+
+def _generate_workflows(output_rows, input_rows, n_workflows, rng, mean_length=8):
+    """Connect outputs to inputs accepting the same extension."""
+
+    inputs_by_ext = {}
+    for row in input_rows:
+        inputs_by_ext.setdefault(row[3], []).append(row)
+    for wf_id in range(1, n_workflows + 1):
+        length = max(1, int(rng.expovariate(1 / mean_length)))
+        for _ in range(length):
+            out = rng.choice(output_rows)
+            inp = rng.choice(inputs_by_ext.get(out[3]) or input_rows)
+            yield str(wf_id), out[0], out[1], out[2], inp[0], inp[2], inp[1]
+
+
+def generate(out_dir, scale, tool_inputs_file, tool_outputs_file,
+             tool_usage_file, workflow_file=None, n_workflows=None, seed=0):
+    """Write synthetic input files scale times the size of the real ones.
+
+    Returns a dict of the files written and their number of rows.
+    """
+
+    rng = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    input_rows = list(iter_rows(tool_inputs_file))
+    output_rows = list(iter_rows(tool_outputs_file))
+    usage_rows = list(iter_rows(tool_usage_file))
+    files = {
+        'tool_inputs': os.path.join(out_dir, 'tool_iformats.csv'),
+        'tool_outputs': os.path.join(out_dir, 'tool_oformats.csv'),
+        'tool_usage': os.path.join(out_dir, 'tools_usage_prediction.csv'),
+        'workflows': os.path.join(out_dir, 'workflow_connections.csv')
+    }
+    rows = {}
+    rows['tool_inputs'] = _write_csv(
+        files['tool_inputs'],
+        ['tool_name', 'tool_version'] + IO_HEADER.format('input').split(','),
+        _replicate_io(input_rows, scale)
+    )
+    rows['tool_outputs'] = _write_csv(
+        files['tool_outputs'],
+        ['tool_name', 'tool_version'] + IO_HEADER.format('output').split(','),
+        _replicate_io(output_rows, scale)
+    )
+    rows['tool_usage'] = _write_csv(
+        files['tool_usage'], USAGE_HEADER,
+        _replicate_usage(usage_rows, scale, rng)
+    )
+    if workflow_file:
+        wf_rows = _resample_workflows(
+            list(iter_rows(workflow_file)), scale, rng
+        )
+    else:
+        all_outputs = list(_replicate_io(output_rows, scale))
+        all_inputs = list(_replicate_io(input_rows, scale))
+        wf_rows = _generate_workflows(
+            all_outputs, all_inputs, n_workflows or 2000 * scale, rng
+        )
+    rows['workflows'] = _write_csv(files['workflows'], WORKFLOW_HEADER, wf_rows)
+    return {kind: {'file': files[kind], 'rows': rows[kind]} for kind in files}
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        description='Generate scaled-up synthetic workflow graph input data'
+    )
+    arg_parser.add_argument("-s", "--scale", type=int, required=True, help="Scale factor relative to the real data")
+    arg_parser.add_argument("-o", "--out_dir", required=True, help="Directory to write the generated files to")
+    arg_parser.add_argument("-ti", "--tool_inputs_file", default="data/tool_iformats.csv", help="Real tool inputs file")
+    arg_parser.add_argument("-to", "--tool_outputs_file", default="data/tool_oformats.csv", help="Real tool outputs file")
+    arg_parser.add_argument("-tuf", "--tool_usage_file", default="data/tools_usage_prediction.csv", help="Real tool usage file")
+    arg_parser.add_argument("-wf", "--workflow_file", help="Real workflow file to resample connections from")
+    arg_parser.add_argument("-nw", "--n_workflows", type=int, help="Number of workflows to generate without -wf")
+    arg_parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = vars(arg_parser.parse_args())
+    written = generate(
+        args["out_dir"], args["scale"], args["tool_inputs_file"], args["tool_outputs_file"],
+        args["tool_usage_file"], args["workflow_file"], args["n_workflows"], args["seed"]
+    )
+    for kind, entry in sorted(written.items()):
+        print("%s: %d rows -> %s" % (kind, entry['rows'], entry['file']))
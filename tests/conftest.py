@@ -0,0 +1,149 @@
+"""Shared fixtures: a stub Galaxy /api/tools server on a local port."""
+
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+# the modules of this repo are top-level scripts
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class StubGalaxy(ThreadingHTTPServer):
+    """Answers toolbox and tool IO requests like a Galaxy server.
+
+    tools maps (tool id, version) to the IO details returned for it,
+    all of them are listed in the toolbox. Responses carry an ETag and
+    Last-Modified and conditional requests matching them get a 304.
+    failures maps a request path (without query) or 'toolbox' to a list
+    of status codes returned, one per request, before answering
+    normally; 429 and 503 responses ask to be retried right away. delay holds every response back, so that concurrent
+    requests overlap.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, tools=(), delay=0.0):
+        super().__init__(('127.0.0.1', 0), _StubHandler)
+        self.tools = dict(tools)
+        self.delay = delay
+        self.failures = {}
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return 'http://127.0.0.1:{0}/'.format(self.server_address[1])
+
+    def tool_requests(self, tool_id):
+        return [r for r in self.requests if r['path'] == '/api/tools/' + tool_id]
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        server = self.server
+        url = urlsplit(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        with server._lock:
+            server.requests.append({
+                'path': url.path, 'params': params, 'time': time.monotonic(),
+                'headers': dict(self.headers)
+            })
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            time.sleep(server.delay)
+            self._answer(server, url.path, params)
+        finally:
+            with server._lock:
+                server.in_flight -= 1
+
+    def _answer(self, server, path, params):
+        failure_key = 'toolbox' if path == '/api/tools/' else path
+        failures = server.failures.get(failure_key)
+        if failures:
+            status = failures.pop(0)
+            # let clients retry overload responses right away
+            headers = {'Retry-After': '0'} if status in (429, 503) else None
+            return self._reply(status, b'server error', 'text/plain', headers)
+        if path == '/api/tools/':
+            body = [
+                {'model_class': 'ToolSection', 'elems': [
+                    {'model_class': 'Tool', 'id': tool_id, 'version': version}
+                    for tool_id, version in server.tools
+                ]}
+            ]
+            return self._reply(200, json.dumps(body).encode('utf-8'))
+        key = (path[len('/api/tools/'):], params.get('tool_version'))
+        if key not in server.tools:
+            return self._reply(404, b'no such tool', 'text/plain')
+        etag = '"{0}"'.format(abs(hash(json.dumps(server.tools[key]))))
+        last_modified = 'Tue, 01 Oct 2019 00:00:00 GMT'
+        if 'If-None-Match' in self.headers:
+            # If-None-Match takes precedence over If-Modified-Since
+            not_modified = self.headers['If-None-Match'] == etag
+        else:
+            not_modified = self.headers.get('If-Modified-Since') == last_modified
+        if not_modified:
+            return self._reply(304, b'', headers={'ETag': etag})
+        self._reply(200, json.dumps(server.tools[key]).encode('utf-8'),
+                    headers={'ETag': etag, 'Last-Modified': last_modified})
+
+    def _reply(self, status, body, content_type='application/json', headers=None):
+        self.send_response(status)
+        if status != 304:
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if status != 304:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def tool_io(tool_id, version, n_inputs=1):
+    """Return minimal IO details of a tool as served by /api/tools."""
+
+    return {
+        'id': tool_id,
+        'name': tool_id,
+        'version': version,
+        'inputs': [
+            {'model_class': 'DataToolParameter', 'name': 'input{0}'.format(i),
+             'extensions': ['fastqsanger'], 'edam': {'edam_formats': ['format_1930']}}
+            for i in range(n_inputs)
+        ],
+        'outputs': [
+            {'model_class': 'ToolOutput', 'name': 'output', 'format': 'bam',
+             'edam_format': 'format_2572'}
+        ]
+    }
+
+
+@pytest.fixture
+def galaxy_stub():
+    """Return a factory of running StubGalaxy servers."""
+
+    servers = []
+
+    def start(tools=(), delay=0.0):
+        server = StubGalaxy(tools, delay)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,20 @@
+import os
+
+from admin_import import SCHEMA_NAME, verify_export, write_admin_import_files
+from graph_model import SCHEMA, GraphBuilder
+
+
+def test_schema_statements_are_written_with_the_import_files(tmp_path):
+    builder = GraphBuilder()
+    builder.add_workflow_row(('wf1', 'fastqc', '1', 'out', 'bwa', 'in', '2'))
+    out_dir = str(tmp_path / 'import_files')
+
+    manifest = write_admin_import_files(builder, out_dir)
+
+    assert verify_export(out_dir) == []
+    assert manifest['schema'] == SCHEMA_NAME
+    with open(os.path.join(out_dir, SCHEMA_NAME)) as i:
+        statements = i.read().splitlines()
+    assert len(statements) == len(SCHEMA)
+    assert 'CREATE CONSTRAINT ON (n:`Tool`) ASSERT n.`uid` IS UNIQUE;' in statements
+    assert 'CREATE INDEX ON :`Version`(`name`);' in statements
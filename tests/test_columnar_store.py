@@ -0,0 +1,83 @@
+import pytest
+
+pytest.importorskip('pyarrow')
+
+import columnar_store
+from columnar_store import ColumnarWriter, iter_table_rows, write_table
+
+
+COLUMNS = ['tool_name', 'tool_version', 'output_name', 'output_extension', 'output_edam_format']
+
+ROWS = [
+    ('tool%d' % (i % 37), '1.%d' % (i % 5), 'out', 'ext%d' % (i % 11), 'format_%d' % (i % 11))
+    for i in range(1000)
+]
+
+
+@pytest.mark.parametrize('ext', ['.arrow', '.parquet'])
+def test_rows_of_many_batches_round_trip(tmp_path, ext):
+    file_name = str(tmp_path / ('outputs' + ext))
+
+    assert write_table(COLUMNS, iter(ROWS), file_name, batch_size=64) == len(ROWS)
+
+    assert list(iter_table_rows(file_name)) == ROWS
+    table = columnar_store.read_table(file_name)
+    assert table.column_names == COLUMNS
+    assert table.column('tool_name').num_chunks == -(-len(ROWS) // 64)
+
+
+@pytest.mark.parametrize('compression', [None, 'lz4'])
+def test_compression_can_be_chosen(tmp_path, compression):
+    file_name = str(tmp_path / 'outputs.arrow')
+
+    write_table(COLUMNS, ROWS, file_name, batch_size=100, compression=compression)
+
+    assert list(iter_table_rows(file_name)) == ROWS
+
+
+def test_compressed_files_are_much_smaller_than_csv(tmp_path):
+    csv_file = tmp_path / 'outputs.csv'
+    csv_file.write_text('\n'.join(','.join(row) for row in [COLUMNS] + ROWS) + '\n')
+    sizes = {}
+    for name, compression in [('zstd.arrow', 'zstd'), ('plain.arrow', None), ('zstd.parquet', 'zstd')]:
+        columnar_store.convert_csv(str(csv_file), str(tmp_path / name), compression=compression)
+        sizes[name] = (tmp_path / name).stat().st_size
+
+    assert sizes['zstd.arrow'] * 5 < csv_file.stat().st_size
+    assert sizes['zstd.parquet'] * 5 < csv_file.stat().st_size
+    assert sizes['zstd.arrow'] < sizes['plain.arrow']
+
+
+def test_arrow_batches_share_one_dictionary(tmp_path):
+    file_name = str(tmp_path / 'outputs.arrow')
+    write_table(COLUMNS, ROWS, file_name, batch_size=100)
+
+    chunks = columnar_store.read_table(file_name).column('tool_name').chunks
+    assert all(len(chunk.dictionary) == 37 for chunk in chunks)
+
+
+def test_writer_takes_rows_incrementally(tmp_path):
+    file_name = str(tmp_path / 'outputs.arrow')
+    with ColumnarWriter(COLUMNS, file_name, batch_size=300) as writer:
+        for i in range(0, len(ROWS), 7):
+            writer.writerows(ROWS[i:i + 7])
+
+    assert writer.rows == len(ROWS)
+    assert list(iter_table_rows(file_name)) == ROWS
+
+
+def test_failed_write_leaves_no_file(tmp_path):
+    file_name = tmp_path / 'outputs.parquet'
+
+    with pytest.raises(RuntimeError):
+        with ColumnarWriter(COLUMNS, str(file_name)) as writer:
+            writer.writerow(ROWS[0])
+            raise RuntimeError('interrupted')
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_empty_table(tmp_path):
+    file_name = str(tmp_path / 'outputs.arrow')
+
+    assert write_table(COLUMNS, [], file_name) == 0
+    assert list(iter_table_rows(file_name)) == []
@@ -0,0 +1,182 @@
+import csv
+import random
+
+import pytest
+
+from delta_import import DeltaManifest, build_graph
+from graph_model import iter_rows
+
+
+HEADERS = {
+    'tool_outputs': ['tool', 'version', 'output', 'extension', 'edam'],
+    'tool_inputs': ['tool', 'version', 'input', 'extension', 'edam'],
+    'workflows': ['wf_id', 'in_tool', 'in_v', 'output', 'out_tool', 'input', 'out_v'],
+    'tool_usage': ['tool', 'version', 'date', 'usage']
+}
+
+
+def random_rows(rng, n_tools=12, n_workflows=15):
+    tools = [('tool%d' % i, '1.%d' % (i % 3)) for i in range(n_tools)]
+    datatypes = [('dt%d' % i, 'format_%d' % i) for i in range(4)]
+    rows = {
+        'tool_outputs': [(t, v, 'out', *rng.choice(datatypes)) for t, v in tools],
+        'tool_inputs': [(t, v, 'in', *rng.choice(datatypes)) for t, v in tools],
+        'tool_usage': [(t, v, '2020-01-01', str(rng.randint(1, 100))) for t, v in tools],
+        'workflows': []
+    }
+    for wf in range(n_workflows):
+        for _ in range(rng.randint(1, 4)):
+            (t1, v1), (t2, v2) = rng.sample(tools, 2)
+            rows['workflows'].append(('wf%d' % wf, t1, v1, 'out', t2, 'in', v2))
+    # connections listed more than once are counted like in a full import
+    rows['workflows'].extend(rng.sample(rows['workflows'], 2))
+    rows['tool_outputs'].append(rows['tool_outputs'][0])
+    return rows
+
+
+def write_files(tmp_path, rows):
+    files = {}
+    for kind, kind_rows in rows.items():
+        files[kind] = str(tmp_path / (kind + '.csv'))
+        with open(files[kind], 'w', newline='') as o:
+            writer = csv.writer(o)
+            writer.writerow(HEADERS[kind])
+            writer.writerows(kind_rows)
+    return files
+
+
+def apply(graph, delta):
+    nodes, relationships = graph
+    for key in delta.removed_relationships:
+        del relationships[key]
+    for nid in delta.removed_nodes:
+        # like DETACH DELETE
+        del nodes[nid]
+        for key in [k for k in relationships if nid in (k[0], k[2])]:
+            del relationships[key]
+    nodes.update(delta.added_nodes)
+    for key, props in delta.added_relationships.items():
+        assert key[0] in nodes and key[2] in nodes
+        relationships[key] = props
+
+
+def ingest(manifest, files, graph):
+    changes, states = manifest.diff(files)
+    delta = manifest.graph_delta(changes)
+    apply(graph, delta)
+    manifest.update(states)
+    return changes, delta
+
+
+def full_graph(files):
+    builder = build_graph({kind: list(iter_rows(f)) for kind, f in files.items()})
+    return builder.nodes, builder.relationships
+
+
+def mutate(rng, rows):
+    rows = {kind: list(r) for kind, r in rows.items()}
+    for kind in ('workflows', 'tool_outputs'):
+        for row in rng.sample(rows[kind], 3):
+            rows[kind].remove(row)
+    rows['tool_usage'][0] = rows['tool_usage'][0][:3] + ('1000',)
+    added = random_rows(rng, n_tools=15)
+    for kind in rows:
+        rows[kind] = rows[kind] + rng.sample(added[kind], 2)
+    rows['workflows'].append(rng.choice(rows['workflows']))
+    return rows
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_deltas_match_a_full_rebuild(tmp_path, seed):
+    rng = random.Random(seed)
+    rows = random_rows(rng)
+    graph = ({}, {})
+    manifest = DeltaManifest(str(tmp_path / 'manifest.db'))
+
+    ingest(manifest, write_files(tmp_path, rows), graph)
+    assert graph == full_graph(write_files(tmp_path, rows))
+    for _ in range(4):
+        rows = mutate(rng, rows)
+        files = write_files(tmp_path, rows)
+        ingest(manifest, files, graph)
+        assert graph == full_graph(files)
+
+
+def test_unchanged_files_give_no_delta(tmp_path):
+    files = write_files(tmp_path, random_rows(random.Random(1)))
+    manifest = DeltaManifest(str(tmp_path / 'manifest.db'))
+    ingest(manifest, files, ({}, {}))
+
+    changes, delta = ingest(manifest, files, ({}, {}))
+
+    assert changes == {}
+    assert not delta
+
+
+def test_shared_nodes_are_removed_with_their_last_row(tmp_path):
+    rows = {
+        'tool_outputs': [('bwa', '1', 'bam', 'bam', 'format_2572'),
+                         ('bowtie2', '2', 'bam', 'bam', 'format_2572')],
+        'tool_inputs': [], 'workflows': [], 'tool_usage': []
+    }
+    manifest = DeltaManifest(str(tmp_path / 'manifest.db'))
+    graph = ({}, {})
+    ingest(manifest, write_files(tmp_path, rows), graph)
+
+    rows['tool_outputs'].pop()
+    _, delta = ingest(manifest, write_files(tmp_path, rows), graph)
+    assert sorted(delta.removed_nodes.values()) == ['Tool', 'ToolOutput', 'Version']
+
+    rows['tool_outputs'].pop()
+    _, delta = ingest(manifest, write_files(tmp_path, rows), graph)
+    assert 'Datatype' in delta.removed_nodes.values()
+    assert graph == ({}, {})
+
+
+def test_transition_counts_follow_workflow_changes(tmp_path):
+    wf = [('wf1', 'a', '1', 'out', 'b', 'in', '1'),
+          ('wf1', 'a', '1', 'out2', 'b', 'in', '1'),
+          ('wf2', 'a', '1', 'out', 'b', 'in', '1')]
+    rows = {'tool_outputs': [], 'tool_inputs': [], 'workflows': wf, 'tool_usage': []}
+    manifest = DeltaManifest(str(tmp_path / 'manifest.db'))
+    graph = ({}, {})
+    ingest(manifest, write_files(tmp_path, rows), graph)
+
+    rows['workflows'] = wf[:2]
+    _, delta = ingest(manifest, write_files(tmp_path, rows), graph)
+
+    followed_by = [p for k, p in delta.added_relationships.items() if k[1] == 'FOLLOWED_BY']
+    assert followed_by == [{'workflows': 1, 'connections': 2}] * 2
+    assert graph == full_graph(write_files(tmp_path, rows))
+
+
+def test_manifest_of_another_version_is_discarded(tmp_path):
+    path = tmp_path / 'manifest.db'
+    path.write_text('{"version": 1, "files": {}}')
+    files = write_files(tmp_path, random_rows(random.Random(2)))
+
+    graph = ({}, {})
+    ingest(DeltaManifest(str(path)), files, graph)
+
+    assert graph == full_graph(files)
+
+
+def test_identical_workflow_rows_are_separate_connections(tmp_path):
+    row = ('wf1', 'a', '1', 'out', 'b', 'in', '1')
+    rows = {'tool_outputs': [], 'tool_inputs': [], 'workflows': [row, row], 'tool_usage': []}
+    manifest = DeltaManifest(str(tmp_path / 'manifest.db'))
+    graph = ({}, {})
+    ingest(manifest, write_files(tmp_path, rows), graph)
+    assert graph == full_graph(write_files(tmp_path, rows))
+
+    rows['workflows'].append(row)
+    _, delta = ingest(manifest, write_files(tmp_path, rows), graph)
+    followed_by = [p for k, p in delta.added_relationships.items() if k[1] == 'FOLLOWED_BY']
+    assert followed_by == [{'workflows': 1, 'connections': 3}] * 2
+    assert graph == full_graph(write_files(tmp_path, rows))
+
+    rows['workflows'] = [row]
+    _, delta = ingest(manifest, write_files(tmp_path, rows), graph)
+    assert not delta.removed_nodes
+    assert graph == full_graph(write_files(tmp_path, rows))
+    assert manifest.rows('workflows') == [row]
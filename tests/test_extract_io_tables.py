@@ -0,0 +1,76 @@
+import json
+
+import pytest
+
+from extract_tools import extract_io_tables, write_io_data_to_csv
+
+from conftest import tool_io
+
+
+def tools_json(tmp_path):
+    tools = [tool_io('tool%d' % i, '1.0', n_inputs=i % 3) for i in range(20)]
+    tools[3]['outputs'].append({
+        'model_class': 'ToolOutputCollection', 'name': 'split', 'default_format': 'fastqsanger',
+        'edam_format': 'format_1930'
+    })
+    file_name = str(tmp_path / 'tools.json')
+    with open(file_name, 'w') as o:
+        json.dump(tools, o)
+    return file_name
+
+
+def read(file_name):
+    with open(file_name) as i:
+        return i.read()
+
+
+def test_tables_match_write_io_data_to_csv(tmp_path):
+    ifn = tools_json(tmp_path)
+    write_io_data_to_csv(ifn, str(tmp_path / 'inputs.csv'), 'inputs')
+    write_io_data_to_csv(ifn, str(tmp_path / 'outputs.csv'), 'outputs')
+
+    n_tools, n_inputs, n_outputs = extract_io_tables(
+        ifn, str(tmp_path / 'i.csv'), str(tmp_path / 'o.csv'), processes=1, chunk_size=3
+    )
+
+    assert (n_tools, n_inputs, n_outputs) == (20, 19, 20)
+    assert read(tmp_path / 'i.csv') == read(tmp_path / 'inputs.csv')
+    assert read(tmp_path / 'o.csv') == read(tmp_path / 'outputs.csv')
+
+
+def test_collection_outputs_on_request(tmp_path):
+    ifn = tools_json(tmp_path)
+
+    extract_io_tables(ifn, str(tmp_path / 'i.csv'), str(tmp_path / 'o.csv'), collections=True,
+                      processes=1)
+
+    assert 'tool3,1.0,split,fastqsanger,format_1930' in read(tmp_path / 'o.csv').splitlines()
+
+
+def test_columnar_tables(tmp_path):
+    pytest.importorskip('pyarrow')
+    import columnar_store
+    ifn = tools_json(tmp_path)
+    write_io_data_to_csv(ifn, str(tmp_path / 'outputs.csv'), 'outputs')
+
+    extract_io_tables(ifn, str(tmp_path / 'i.arrow'), str(tmp_path / 'o.parquet'), processes=1,
+                      chunk_size=3)
+
+    columnar_store.export_csv(str(tmp_path / 'o.parquet'), str(tmp_path / 'o.csv'))
+    assert read(tmp_path / 'o.csv') == read(tmp_path / 'outputs.csv')
+
+
+@pytest.mark.parametrize('ext', ['.csv', '.arrow'])
+def test_truncated_json_leaves_no_tables(tmp_path, ext):
+    if ext == '.arrow':
+        pytest.importorskip('pyarrow')
+    ifn = tools_json(tmp_path)
+    content = read(ifn)
+    with open(ifn, 'w') as o:
+        o.write(content[:len(content) * 2 // 3])
+
+    with pytest.raises(ValueError):
+        extract_io_tables(ifn, str(tmp_path / ('i' + ext)), str(tmp_path / ('o' + ext)),
+                          processes=1, chunk_size=3)
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['tools.json']
@@ -0,0 +1,97 @@
+import re
+
+from create_workflow_graph import WorkflowGraphDatabase
+
+
+class Record(dict):
+
+    def data(self):
+        return dict(self)
+
+
+class StreamingGraph:
+    """Answers the queries of iter_nodes/iter_relationships with lazy cursors."""
+
+    def __init__(self, nodes=(), relationships=()):
+        self.nodes = list(nodes)
+        self.relationships = list(relationships)
+        self.queries = []
+        self.fetched = 0
+
+    def run(self, query, parameters=None, **kwparameters):
+        parameters = dict(parameters or {}, **kwparameters)
+        self.queries.append((query, parameters))
+        assert 'ORDER BY' not in query and 'LIMIT' not in query and 'id(n) >' not in query
+        m = re.match(r'MATCH \(n(?::`(\w+)`)?\) ', query)
+        if m:
+            label = m.group(1)
+            records = [n for n in self.nodes if label is None or (
+                label in n['labels'] and not set(n['labels']) & set(parameters['seen']))]
+        else:
+            m = re.match(r'MATCH \(a\)-\[r(?::`(\w+)`)?\]->\(b\) ', query)
+            records = [r for r in self.relationships if m.group(1) in (None, r['type'])]
+        return self._cursor(records)
+
+    def _cursor(self, records):
+        for record in records:
+            self.fetched += 1
+            yield Record(record)
+
+
+def database(graph):
+    db = WorkflowGraphDatabase.__new__(WorkflowGraphDatabase)
+    db.graph = graph
+    return db
+
+
+NODES = [
+    {'id': 0, 'labels': ['Tool'], 'properties': {'name': 'bwa'}},
+    {'id': 3, 'labels': ['Version'], 'properties': {'name': '1'}},
+    {'id': 7, 'labels': ['Tool', 'Version'], 'properties': {}},
+    {'id': 9, 'labels': ['Datatype'], 'properties': {}},
+]
+
+RELATIONSHIPS = [
+    {'id': i, 'type': rel_type, 'start': 0, 'end': 3, 'properties': {}}
+    for i, rel_type in enumerate(['HAS_VERSION', 'USAGE', 'HAS_VERSION'])
+]
+
+
+def test_all_nodes_are_read_by_one_query():
+    db = database(StreamingGraph(NODES))
+
+    assert list(db.iter_nodes()) == NODES
+    assert len(db.graph.queries) == 1
+
+
+def test_nodes_are_streamed_from_the_cursor():
+    db = database(StreamingGraph(NODES))
+
+    nodes = db.iter_nodes()
+    assert next(nodes) == NODES[0]
+    assert db.graph.fetched == 1
+
+
+def test_every_label_is_scanned_once():
+    db = database(StreamingGraph(NODES))
+
+    assert [n['id'] for n in db.iter_nodes(labels=['Tool', 'Version'])] == [0, 7, 3]
+    queries = [query for query, _ in db.graph.queries]
+    assert [re.match(r'MATCH \(n:`(\w+)`\)', q).group(1) for q in queries] == ['Tool', 'Version']
+    # nodes of several labels are only read with the first of them
+    assert [parameters['seen'] for _, parameters in db.graph.queries] == [[], ['Tool']]
+
+
+def test_relationships_are_read_per_type():
+    db = database(StreamingGraph(relationships=RELATIONSHIPS))
+
+    assert list(db.iter_relationships()) == RELATIONSHIPS
+    assert [r['id'] for r in db.iter_relationships(types=['USAGE', 'HAS_VERSION'])] == [1, 0, 2]
+    assert len(db.graph.queries) == 3
+
+
+def test_empty_graph():
+    db = database(StreamingGraph())
+
+    assert list(db.iter_nodes()) == []
+    assert list(db.iter_relationships()) == []
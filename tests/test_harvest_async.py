@@ -0,0 +1,113 @@
+import asyncio
+import socket
+
+import pytest
+
+pytest.importorskip('aiohttp')
+
+from harvest_async import failure_name, harvest_instances
+
+from conftest import tool_io
+
+
+def tools(*keys):
+    return {key: tool_io(*key) for key in keys}
+
+
+def harvest(instances, **kwargs):
+    return asyncio.run(harvest_instances([s if isinstance(s, str) else s.base_url for s in instances],
+                                         **kwargs))
+
+
+def closed_port_url():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return 'http://127.0.0.1:{0}/'.format(s.getsockname()[1])
+
+
+def test_toolboxes_are_merged(galaxy_stub):
+    main = galaxy_stub(tools(('bwa', '1'), ('fastqc', '2')))
+    eu = galaxy_stub(tools(('fastqc', '2'), ('bowtie2', '3')))
+
+    merged, failures, stats = harvest([main, eu])
+
+    assert list(merged) == [('bwa', '1'), ('fastqc', '2'), ('bowtie2', '3')]
+    assert merged[('fastqc', '2')]['instances'] == [main.base_url, eu.base_url]
+    assert merged[('bowtie2', '3')]['instances'] == [eu.base_url]
+    # every tool is fetched once, from the first instance listing it
+    assert len(main.tool_requests('fastqc')) == 1
+    assert eu.tool_requests('fastqc') == []
+    assert failures == {}
+    assert stats['requests'] == 5
+
+
+def test_concurrency_is_limited_per_host(galaxy_stub):
+    keys = [('tool%d' % i, '1') for i in range(8)]
+    first = galaxy_stub(tools(*keys[:4]), delay=0.05)
+    second = galaxy_stub(tools(*keys[4:]), delay=0.05)
+
+    merged, _, _ = harvest([first, second], concurrency=2)
+
+    assert len(merged) == 8
+    assert first.max_in_flight == second.max_in_flight == 2
+
+
+def test_requests_are_rate_limited_per_host(galaxy_stub):
+    server = galaxy_stub(tools(*(('tool%d' % i, '1') for i in range(5))))
+
+    harvest([server], rate=20)
+
+    times = [r['time'] for r in server.requests]
+    assert len(times) == 6
+    assert times[-1] - times[0] >= 5 * 0.05 * 0.9
+
+
+def test_transient_errors_are_retried(galaxy_stub):
+    server = galaxy_stub(tools(('bwa', '1')))
+    server.failures['toolbox'] = [503]
+    server.failures['/api/tools/bwa'] = [429, 503]
+
+    merged, failures, stats = harvest([server])
+
+    assert list(merged) == [('bwa', '1')]
+    assert len(server.tool_requests('bwa')) == 3
+    assert stats['retries'] == 3
+    assert failures == {}
+
+
+def test_failing_tool_is_fetched_from_the_next_instance(galaxy_stub):
+    main = galaxy_stub(tools(('bwa', '1')))
+    eu = galaxy_stub(tools(('bwa', '1')))
+    main.failures['/api/tools/bwa'] = [404]
+
+    merged, failures, stats = harvest([main, eu])
+
+    assert merged[('bwa', '1')]['instances'] == [eu.base_url, main.base_url]
+    assert failures == {}
+    assert stats['failed'] == 0
+
+
+def test_tool_failing_everywhere_is_reported(galaxy_stub):
+    server = galaxy_stub(tools(('bwa', '1'), ('fastqc', '2')))
+    server.failures['/api/tools/bwa'] = [404]
+
+    merged, failures, stats = harvest([server])
+
+    assert list(merged) == [('fastqc', '2')]
+    assert list(failures) == [('bwa', '1')]
+    assert failure_name(('bwa', '1')) == 'bwa 1'
+    assert stats['failed'] == 1
+
+
+def test_failing_toolbox_does_not_stop_the_others(galaxy_stub):
+    broken = galaxy_stub(tools(('bwa', '1')))
+    broken.failures['toolbox'] = [500]
+    down = closed_port_url()
+    main = galaxy_stub(tools(('fastqc', '2')))
+
+    merged, failures, stats = harvest([broken, down, main], max_retries=0)
+
+    assert list(merged) == [('fastqc', '2')]
+    assert set(failures) == {broken.base_url, down}
+    assert failure_name(down) == 'toolbox of ' + down
+    assert stats['failed_toolboxes'] == 2
@@ -0,0 +1,110 @@
+import copy
+import csv
+import re
+
+from create_workflow_graph import WorkflowGraphDatabase
+from graph_model import COMPONENTS, count_transitions, iter_rows
+from import_metrics import ImportMetrics
+
+
+ROWS = [
+    ('wf1', 'fastqc', '1', 'out', 'bwa', 'in', '2'),
+    ('wf1', 'fastqc', '1', 'out', 'bwa', 'in', '2'),
+    ('wf1', 'fastqc', '1', 'report', 'bwa', 'in2', '2'),
+    ('wf2', 'fastqc', '1', 'out', 'bwa', 'in', '3'),
+    ('wf2', 'bwa', '3', 'bam', 'samtools', 'in', '1'),
+    # skipped like by a full import
+    ('wf3', 'bwa', '', 'bam', 'samtools', 'in', '1'),
+]
+
+
+class Result:
+
+    def stats(self):
+        return {}
+
+    def plan(self):
+        return None
+
+
+class TransitionGraph:
+    """Runs the statements of materialize_transitions on Tool and Version nodes."""
+
+    def __init__(self, versions):
+        self.versions = set(versions)
+        self.tools = {tool for tool, _ in versions}
+        self.followed_by = []
+
+    def run(self, query, parameters=None):
+        m = re.match(r'MATCH \(:(\w+)\)-\[r:FOLLOWED_BY\]->\(:\1\) DELETE r$', query)
+        if m:
+            self.followed_by = [r for r in self.followed_by if r[0] != m.group(1)]
+            return Result()
+        assert query.startswith('UNWIND $rows AS row MATCH') and 'CREATE (a)-[r:FOLLOWED_BY]->(b)' in query
+        for row in parameters['rows']:
+            if 'start_tool' in row:
+                start, end = (row['start_tool'], row['start']), (row['end_tool'], row['end'])
+                if start in self.versions and end in self.versions:
+                    self.followed_by.append(('Version', start + end, dict(row['props'])))
+            elif row['start'] in self.tools and row['end'] in self.tools:
+                self.followed_by.append(('Tool', (row['start'], row['end']), dict(row['props'])))
+        return Result()
+
+
+def database(graph):
+    db = WorkflowGraphDatabase.__new__(WorkflowGraphDatabase)
+    db.graph = graph
+    db.generation = 0
+    db.components = copy.deepcopy(COMPONENTS)
+    db.import_metrics = ImportMetrics()
+    db.profile = False
+    db.progress_callback = None
+    db.plan_check = 'off'
+    return db
+
+
+def workflow_file(tmp_path):
+    file_name = str(tmp_path / 'workflow_connections.csv')
+    with open(file_name, 'w', newline='') as o:
+        writer = csv.writer(o)
+        writer.writerow(['wf_id', 'in_tool', 'in_v', 'output', 'out_tool', 'input', 'out_v'])
+        writer.writerows(ROWS)
+    return file_name
+
+
+def transitions(graph):
+    return sorted(graph.followed_by, key=repr)
+
+
+def expected(file_name):
+    tools, versions = count_transitions(iter_rows(file_name))
+    return sorted(
+        [('Tool', key, props) for key, props in tools.items()]
+        + [('Version', key, props) for key, props in versions.items()],
+        key=repr
+    )
+
+
+def test_transitions_match_count_transitions(tmp_path):
+    file_name = workflow_file(tmp_path)
+    graph = TransitionGraph({(row[1], row[2]) for row in ROWS} | {(row[4], row[6]) for row in ROWS})
+    graph.followed_by.append(('Tool', ('samtools', 'fastqc'), {'workflows': 9, 'connections': 9}))
+
+    database(graph).materialize_transitions(file_name, batch_size=2)
+
+    assert transitions(graph) == expected(file_name)
+    assert ('Tool', ('fastqc', 'bwa'), {'workflows': 2, 'connections': 4}) in graph.followed_by
+    assert ('Version', ('fastqc', '1', 'bwa', '2'), {'workflows': 1, 'connections': 3}) in graph.followed_by
+
+
+def test_materializing_again_changes_nothing(tmp_path):
+    file_name = workflow_file(tmp_path)
+    graph = TransitionGraph({(row[1], row[2]) for row in ROWS} | {(row[4], row[6]) for row in ROWS})
+    db = database(graph)
+
+    db.materialize_transitions(file_name)
+    first = transitions(graph)
+    db.materialize_transitions(file_name)
+
+    assert transitions(graph) == first
+    assert db.generation == 2
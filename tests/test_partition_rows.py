@@ -0,0 +1,39 @@
+from create_workflow_graph import partition_rows
+
+
+def _nodes(part, keys):
+    return {row[key] for row in part for key in keys}
+
+
+def test_partitions_share_no_node():
+    rows = [
+        {'start': 'o1', 'end': 'bam'}, {'start': 'o2', 'end': 'bam'},
+        {'start': 'o3', 'end': 'vcf'}, {'start': 'o4', 'end': 'txt'},
+        {'start': 'o5', 'end': 'txt'}, {'start': 'o2', 'end': 'sam'},
+    ]
+
+    parts = partition_rows(rows, ('start', 'end'), 3)
+
+    assert sorted(map(id, sum(parts, []))) == sorted(map(id, rows))
+    for i, a in enumerate(parts):
+        for b in parts[i + 1:]:
+            assert not _nodes(a, ('start', 'end')) & _nodes(b, ('start', 'end'))
+    # o2 links bam and sam, so their relationships are written together
+    bam = next(p for p in parts if {'start': 'o1', 'end': 'bam'} in p)
+    assert {'start': 'o2', 'end': 'sam'} in bam
+
+
+def test_rows_keep_their_order_and_are_balanced():
+    rows = [{'uid': str(i)} for i in range(100)]
+
+    parts = partition_rows(rows, ('uid',), 4)
+
+    assert [len(p) for p in parts] == [25] * 4
+    for part in parts:
+        assert part == sorted(part, key=lambda row: int(row['uid']))
+
+
+def test_hub_node_serializes_its_relationships():
+    rows = [{'start': 'o{0}'.format(i), 'end': 'bam'} for i in range(10)]
+
+    assert partition_rows(rows, ('start', 'end'), 4) == [rows]
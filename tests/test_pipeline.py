@@ -0,0 +1,159 @@
+import json
+
+import pytest
+
+import pipeline
+from pipeline import (
+    LOAD_FILES, is_up_to_date, load_state, pipeline_status, run_pipeline, select_stages,
+    stage_key
+)
+
+from conftest import tool_io
+
+
+def write_tools(file_name, tools, indent=None):
+    with open(file_name, 'w') as o:
+        json.dump(tools, o, indent=indent)
+
+
+@pytest.fixture
+def config(tmp_path):
+    """Return a config running tool_inputs, tool_outputs and copy_import."""
+
+    (tmp_path / 'import').mkdir()
+    config = {
+        'galaxy': None,
+        'tool_cache': str(tmp_path / 'tool_cache'),
+        'tools_json': str(tmp_path / 'tools.json'),
+        'tool_inputs': str(tmp_path / 'tool_iformats.csv'),
+        'tool_outputs': str(tmp_path / 'tool_oformats.csv'),
+        'raw_workflows': None,
+        'workflows': str(tmp_path / 'workflow_connections.csv'),
+        'workflow_ids': str(tmp_path / 'wf_ids.csv'),
+        'popularity': str(tmp_path / 'popularity.tsv'),
+        'tool_usage': str(tmp_path / 'tools_usage_prediction.csv'),
+        'forecast_model': 'median',
+        'forecast_cache': str(tmp_path / 'forecast_cache'),
+        'usage_series': str(tmp_path / 'usage_series.pkl'),
+        'url': None,
+        'mode': 'csv',
+        'csv_mode': True
+    }
+    for key in LOAD_FILES:
+        config['import_' + key] = str(tmp_path / 'import' / key)
+    write_tools(config['tools_json'], [tool_io('bwa', '1'), tool_io('fastqc', '2', n_inputs=2)])
+    for key in ('workflows', 'workflow_ids', 'tool_usage'):
+        (tmp_path / config[key]).write_text(key + '\n')
+    return config
+
+
+def run(config, tmp_path, **kwargs):
+    return run_pipeline(config, str(tmp_path / 'state.json'), jobs=1, **kwargs)
+
+
+def test_stages_are_selected_with_their_dependencies(config):
+    assert select_stages(config) == ['tool_inputs', 'tool_outputs', 'copy_import']
+    assert select_stages(config, ['tool_outputs']) == ['tool_outputs']
+
+    config['galaxy'] = ['http://127.0.0.1/']
+    assert select_stages(config, ['copy_import', 'tool_inputs']) == [
+        'harvest', 'tool_inputs', 'tool_outputs', 'copy_import'
+    ]
+
+
+@pytest.mark.parametrize('target', ['clusters', 'load', 'forecast'])
+def test_unavailable_stages_are_refused(config, target):
+    with pytest.raises(ValueError):
+        select_stages(config, [target])
+
+
+def test_stage_key_follows_inputs_and_params(config):
+    forecast = pipeline._STAGES_BY_NAME['forecast']
+    assert stage_key(forecast, config, {}) is None
+
+    with open(config['popularity'], 'w') as o:
+        o.write('tool_name\tmonth\tcount\n')
+    key = stage_key(forecast, config, {})
+    assert key == stage_key(forecast, dict(config, forecast_cache='elsewhere'), {})
+    assert key != stage_key(forecast, dict(config, forecast_model='svr'), {})
+    with open(config['popularity'], 'a') as o:
+        o.write('bwa\t2020-01\t12\n')
+    assert key != stage_key(forecast, config, {})
+
+
+def test_up_to_date_stages_are_not_run_again(config, tmp_path):
+    assert run(config, tmp_path) == {
+        'tool_inputs': 'done', 'tool_outputs': 'done', 'copy_import': 'done'
+    }
+    with open(config['import_tool_outputs']) as i:
+        assert 'bwa,1,output,bam,format_2572' in i.read().splitlines()
+
+    assert set(run(config, tmp_path).values()) == {'cached'}
+
+    # a new layout of the same tools gives the same tables
+    with open(config['tools_json']) as i:
+        tools = json.load(i)
+    write_tools(config['tools_json'], tools, indent=2)
+    assert run(config, tmp_path) == {
+        'tool_inputs': 'done', 'tool_outputs': 'done', 'copy_import': 'cached'
+    }
+
+
+def test_changed_outputs_make_a_stage_stale(config, tmp_path):
+    run(config, tmp_path)
+    with open(config['import_tool_inputs'], 'a') as o:
+        o.write('edited,by,hand\n')
+
+    assert run(config, tmp_path)['copy_import'] == 'done'
+
+
+def test_forced_stages_run(config, tmp_path):
+    run(config, tmp_path)
+
+    assert run(config, tmp_path, force=['tool_outputs']) == {
+        'tool_inputs': 'cached', 'tool_outputs': 'done', 'copy_import': 'cached'
+    }
+    assert set(run(config, tmp_path, force=['all']).values()) == {'done'}
+
+
+def test_failure_skips_the_stages_after_it(config, tmp_path):
+    run(config, tmp_path)
+    with open(config['tools_json'], 'w') as o:
+        o.write('[{"id": ')
+
+    assert run(config, tmp_path) == {
+        'tool_inputs': 'failed', 'tool_outputs': 'failed', 'copy_import': 'skipped'
+    }
+    # the failed stages are rerun next time
+    assert set(load_state(str(tmp_path / 'state.json'))) == {'copy_import'}
+    assert run(config, tmp_path)['tool_inputs'] == 'failed'
+
+
+def test_missing_import_directory_fails_copy_only(config, tmp_path):
+    (tmp_path / 'import').rmdir()
+
+    assert run(config, tmp_path) == {
+        'tool_inputs': 'done', 'tool_outputs': 'done', 'copy_import': 'failed'
+    }
+
+
+def test_harvest_always_runs_and_revalidates(config, tmp_path, galaxy_stub):
+    pytest.importorskip('aiohttp')
+    server = galaxy_stub({('bwa', '1'): tool_io('bwa', '1')})
+    config['galaxy'] = [server.base_url]
+    state_file = str(tmp_path / 'state.json')
+    harvest = pipeline._STAGES_BY_NAME['harvest']
+
+    assert run(config, tmp_path, targets=['tool_inputs']) == {
+        'harvest': 'done', 'tool_inputs': 'done'
+    }
+    assert not is_up_to_date(harvest, config, load_state(state_file),
+                             stage_key(harvest, config, load_state(state_file)))
+    assert ('harvest', 'always run', []) in pipeline_status(config, state_file)
+
+    assert run(config, tmp_path, targets=['tool_inputs']) == {
+        'harvest': 'done', 'tool_inputs': 'cached'
+    }
+    requests = server.tool_requests('bwa')
+    assert len(requests) == 2
+    assert 'If-None-Match' in requests[1]['headers']
@@ -0,0 +1,61 @@
+import pytest
+
+from create_workflow_graph import WorkflowGraphDatabase
+
+
+SCAN_PLAN = {'operatorType': 'NodeByLabelScan', 'identifiers': ['t'], 'children': []}
+SEEK_PLAN = {'operatorType': 'NodeUniqueIndexSeek', 'identifiers': ['t'], 'children': []}
+
+QUERY = 'UNWIND $rows AS row MATCH (t:Tool {name: row.name}) SET t += row.props'
+
+
+class ExplainingGraph:
+    """Answers EXPLAIN queries with a fixed plan and records them."""
+
+    def __init__(self, plan):
+        self._plan = plan
+        self.explained = []
+
+    def run(self, query, parameters=None):
+        assert query.startswith('EXPLAIN ')
+        self.explained.append(query)
+        return self
+
+    def plan(self):
+        return self._plan
+
+
+def database(plan, plan_check):
+    db = WorkflowGraphDatabase.__new__(WorkflowGraphDatabase)
+    db.graph = ExplainingGraph(plan)
+    db.plan_check = plan_check
+    db._checked_plans = {}
+    return db
+
+
+def test_every_query_is_explained_once():
+    db = database(SEEK_PLAN, 'warn')
+
+    for batch in range(10):
+        db._enforce_plan(QUERY, {'rows': [{'name': 'tool%d' % batch}]})
+    db._enforce_plan(QUERY.replace('Tool', 'Datatype'))
+
+    assert len(db.graph.explained) == 2
+
+
+def test_label_scan_warning_is_printed_once(capsys):
+    db = database(SCAN_PLAN, 'warn')
+
+    for _ in range(3):
+        db._enforce_plan(QUERY)
+
+    assert capsys.readouterr().out.count('WARNING') == 1
+
+
+def test_label_scan_is_refused_every_time():
+    db = database(SCAN_PLAN, 'refuse')
+
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            db._enforce_plan(QUERY)
+    assert len(db.graph.explained) == 1
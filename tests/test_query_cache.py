@@ -0,0 +1,62 @@
+import pytest
+
+from create_workflow_graph import WorkflowGraphDatabase, changes_graph
+from query_cache import QueryCache
+
+
+def test_cached_results_are_copies():
+    cache = QueryCache()
+    key = cache.make_key('MATCH (t:Tool) RETURN t.name AS name')
+    records = [{'name': 'bwa'}]
+    cache.put(key, records, 0)
+    records.append({'name': 'bowtie2'})
+
+    _, first = cache.get(key, 0)
+    first[0]['name'] = 'changed'
+    _, second = cache.get(key, 0)
+
+    assert second == [{'name': 'bwa'}]
+
+
+def test_other_generation_is_a_miss():
+    cache = QueryCache()
+    key = cache.make_key('MATCH (n) RETURN count(n)')
+    cache.put(key, [{'count(n)': 1}], 0)
+
+    assert cache.get(key, 1) == (False, None)
+    assert cache.stats()['invalidations'] == 1
+
+
+class Importer:
+    generation = 0
+    bump_generation = WorkflowGraphDatabase.bump_generation
+
+    @changes_graph
+    def import_data(self, fail):
+        if fail:
+            raise RuntimeError('connection lost')
+        return 'done'
+
+
+def test_generation_is_bumped_after_an_import():
+    importer = Importer()
+
+    assert importer.import_data(False) == 'done'
+    assert importer.generation == 1
+
+
+def test_generation_is_bumped_after_a_failed_import():
+    importer = Importer()
+
+    with pytest.raises(RuntimeError):
+        importer.import_data(True)
+    assert importer.generation == 1
+
+
+@pytest.mark.parametrize('name', [
+    'delete_all', 'create_graph_bulk_merge', 'materialize_transitions', 'write_usage_series',
+    'load_io_data_from_csv', 'ingest_streamed', 'write_graph_streamed', 'ingest_delta',
+    'restore_snapshot'
+])
+def test_import_methods_change_the_graph(name):
+    assert getattr(WorkflowGraphDatabase, name).__wrapped__
@@ -0,0 +1,76 @@
+import json
+import threading
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import pytest
+
+from recommend import Recommender, make_server
+
+
+WORKFLOWS = [
+    ('wf1', 'fastqc', '1', 'out', 'bwa', 'in', '2'),
+    ('wf2', 'fastqc', '1', 'out', 'bwa', 'in', '2'),
+    ('wf3', 'fastqc', '1', 'out', 'bowtie2', 'in', '3'),
+]
+
+
+@pytest.fixture
+def server():
+    server = make_server(Recommender.build(WORKFLOWS), port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield 'http://127.0.0.1:{0}/recommend'.format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+def request(url, body=None):
+    data = None if body is None else (body if isinstance(body, bytes) else json.dumps(body).encode())
+    try:
+        with urlopen(Request(url, data=data)) as response:
+            return response.status, json.loads(response.read())
+    except HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def test_get(server):
+    status, body = request(server + '?tool=fastqc&k=1')
+
+    assert status == 200
+    assert [r['tool'] for r in body['results']] == ['bwa']
+    assert body['results'][0]['workflows'] == 2
+
+
+def test_get_version(server):
+    _, body = request(server + '?tool=fastqc&version=1')
+
+    assert [(r['tool'], r['version']) for r in body['results']] == [('bwa', '2'), ('bowtie2', '3')]
+
+
+def test_post_queries(server):
+    status, body = request(server, {'queries': [{'tool': 'fastqc'}, {'tool': 'unknown'}], 'k': 1})
+
+    assert status == 200
+    assert [[r['tool'] for r in results] for results in body['results']] == [['bwa'], []]
+
+
+def test_post_bare_list(server):
+    status, body = request(server, [{'tool': 'fastqc', 'version': '1', 'k': 1}])
+
+    assert status == 200
+    assert [r['tool'] for r in body['results'][0]] == ['bwa']
+
+
+@pytest.mark.parametrize('url, body', [
+    ('', None),
+    ('?tool=fastqc&k=many', None),
+    ('', b'not json'),
+    ('', {'k': 3}),
+    ('', [{'version': '1'}]),
+    ('', '"fastqc"'.encode()),
+])
+def test_bad_requests(server, url, body):
+    status, reply = request(server + url, body)
+
+    assert status == 400
+    assert 'error' in reply
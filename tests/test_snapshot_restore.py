@@ -0,0 +1,183 @@
+import re
+
+import pytest
+
+import graph_snapshot
+from create_workflow_graph import SNAPSHOT_LABEL, WorkflowGraphDatabase
+from graph_model import SCHEMA, GraphBuilder
+from graph_snapshot import write_snapshot
+from import_metrics import ImportMetrics
+
+
+class Result:
+
+    def __init__(self, records=()):
+        self.records = list(records)
+
+    def data(self):
+        return self.records
+
+    def stats(self):
+        return {}
+
+    def plan(self):
+        return None
+
+
+class MemoryGraph:
+    """Runs the statements of restore_snapshot on an in-memory graph.
+
+    Relationship end nodes may only be looked up by indexed properties.
+    """
+
+    def __init__(self):
+        self.nodes = {}
+        self.relationships = []
+        self.indexes = {}
+
+    def run(self, query, parameters=None, **kwparameters):
+        rows = dict(parameters or {}, **kwparameters).get('rows', [])
+        m = re.match(r'UNWIND \$rows AS row CREATE \(n((?::`[^`]+`)+)\) '
+                     r'SET n = row.properties(, n.`_snapshot_id` = row.id)?$', query)
+        if m:
+            for row in rows:
+                props = dict(row['properties'])
+                if m.group(2):
+                    props['_snapshot_id'] = row['id']
+                self.nodes[len(self.nodes)] = (set(re.findall('`([^`]+)`', m.group(1))), props)
+            return Result()
+        m = re.match(r'UNWIND \$rows AS row MATCH \(a:`([^`]+)` \{`?(\w+)`?: row.start\}\) '
+                     r'MATCH \(b:`([^`]+)` \{`?(\w+)`?: row.end\}\) '
+                     r'CREATE \(a\)-\[r:`([^`]+)`\]->\(b\) SET r = row.properties$', query)
+        if m:
+            start_label, start_prop, end_label, end_prop, rel_type = m.groups()
+            for row in rows:
+                a = self._seek(start_label, start_prop, row['start'])
+                b = self._seek(end_label, end_prop, row['end'])
+                self.relationships.append((rel_type, a, b, row['properties']))
+            return Result()
+        m = re.match(r'MATCH \(n:`_SnapshotNode`\) WITH n LIMIT (\d+) REMOVE', query)
+        if m:
+            tagged = [n for n, (labels, _) in self.nodes.items() if SNAPSHOT_LABEL in labels]
+            for n in tagged[:int(m.group(1))]:
+                self.nodes[n][0].remove(SNAPSHOT_LABEL)
+                del self.nodes[n][1]['_snapshot_id']
+            return Result([{'removed': len(tagged[:int(m.group(1))])}])
+        if query == 'CALL db.indexes()':
+            return Result({'tokenNames': [label], 'properties': [prop],
+                           'type': 'node_unique_property' if unique else 'node_label_property'}
+                          for (label, prop), unique in self.indexes.items())
+        m = re.match(r'CREATE CONSTRAINT ON \(n:`([^`]+)`\) ASSERT n.`([^`]+)` IS UNIQUE', query)
+        if m:
+            self.indexes[m.groups()] = True
+            return Result()
+        m = re.match(r'CREATE INDEX ON :`([^`]+)`\(`([^`]+)`\)', query)
+        if m:
+            self.indexes[m.groups()] = False
+            return Result()
+        m = re.match(r'DROP (?:INDEX ON :|CONSTRAINT ON \(n:)`([^`]+)`.*`([^`]+)`', query)
+        if m:
+            del self.indexes[m.groups()]
+            return Result()
+        if query.startswith('CALL db.awaitIndexes'):
+            return Result()
+        raise AssertionError('unexpected statement: ' + query)
+
+    def _seek(self, label, prop, value):
+        assert (label, prop) in self.indexes, 'no index on :%s(%s)' % (label, prop)
+        found = [n for n, (labels, props) in self.nodes.items()
+                 if label in labels and props.get(prop) == value]
+        assert len(found) == 1
+        return found[0]
+
+
+def database(graph):
+    db = WorkflowGraphDatabase.__new__(WorkflowGraphDatabase)
+    db.graph = graph
+    db.generation = 0
+    db.import_metrics = ImportMetrics()
+    db.profile = False
+    db.progress_callback = None
+    db._checked_plans = {}
+    db._schema_ready = False
+    db.graph_statistics = lambda: {'nodes': len(graph.nodes)}
+    return db
+
+
+def source_graph(with_uids):
+    builder = GraphBuilder()
+    builder.add_workflow_row(('wf1', 'fastqc', '1', 'out', 'bwa', 'in', '2'))
+    builder.add_io_row(('bwa', '2', 'bam', 'bam', 'format_2572'), 'ToolOutput')
+    builder.add_usage_row(('bwa', '2', '2020-01', '12'))
+    ids = {uid: i for i, uid in enumerate(builder.nodes)}
+    nodes = [
+        {'id': ids[uid], 'labels': [label],
+         'properties': dict(props, uid=uid) if with_uids else dict(props)}
+        for uid, (label, props) in builder.nodes.items()
+    ]
+    relationships = [
+        {'type': rel_type, 'start': ids[start], 'end': ids[end], 'properties': props,
+         'start_label': builder.nodes[start][0], 'start_uid': start if with_uids else None,
+         'end_label': builder.nodes[end][0], 'end_uid': end if with_uids else None}
+        for (start, rel_type, end), props in builder.relationships.items()
+    ]
+    return nodes, relationships
+
+
+def restored(graph):
+    """Return the restored graph keyed by node properties."""
+
+    key = {n: (tuple(sorted(labels)), tuple(sorted(props.items())))
+           for n, (labels, props) in graph.nodes.items()}
+    return (sorted(key.values()),
+            sorted((t, key[a], key[b], tuple(sorted(p.items()))) for t, a, b, p in graph.relationships))
+
+
+def expected(nodes, relationships):
+    key = {n['id']: ((n['labels'][0],), tuple(sorted(n['properties'].items()))) for n in nodes}
+    return (sorted(key.values()),
+            sorted((r['type'], key[r['start']], key[r['end']], tuple(sorted(r['properties'].items())))
+                   for r in relationships))
+
+
+@pytest.mark.parametrize('with_uids', [True, False])
+def test_restore(tmp_path, with_uids):
+    nodes, relationships = source_graph(with_uids)
+    file_name = str(tmp_path / 'graph.snap')
+    write_snapshot(file_name, [('Tool', 'name', True), ('Workflow', 'created', False)],
+                   nodes, relationships)
+    graph = MemoryGraph()
+
+    stats = database(graph).restore_snapshot(file_name, batch_size=2)
+
+    assert restored(graph) == expected(nodes, relationships)
+    assert stats['snapshot_ids'] == (0 if with_uids else len(nodes))
+    # the schema of graph_model and of the snapshot, without the snapshot id index
+    assert set(graph.indexes) == {(label, prop) for label, prop, _ in SCHEMA} | {('Workflow', 'created')}
+
+
+def test_restore_version_1_snapshot(tmp_path, monkeypatch):
+    nodes, relationships = source_graph(True)
+    for rel in relationships:
+        for field in ('start_label', 'start_uid', 'end_label', 'end_uid'):
+            del rel[field]
+    file_name = str(tmp_path / 'graph.snap')
+    monkeypatch.setattr(graph_snapshot, 'SNAPSHOT_VERSION', 1)
+    write_snapshot(file_name, [], nodes, relationships)
+    graph = MemoryGraph()
+
+    database(graph).restore_snapshot(file_name)
+
+    assert restored(graph) == expected(nodes, relationships)
+
+
+def test_restore_into_non_empty_graph_is_refused(tmp_path):
+    nodes, relationships = source_graph(True)
+    file_name = str(tmp_path / 'graph.snap')
+    write_snapshot(file_name, [], nodes, relationships)
+    graph = MemoryGraph()
+    graph.nodes[0] = ({'Tool'}, {'name': 'bwa'})
+
+    with pytest.raises(RuntimeError):
+        database(graph).restore_snapshot(file_name)
+    assert len(graph.nodes) == 1
@@ -0,0 +1,125 @@
+import json
+import os
+
+import pytest
+import requests
+
+import extract_tools
+from extract_tools import APIToolbox, APIToolIO, ToolResponseCache, store_tool_io_data
+
+from conftest import tool_io
+
+
+TOOLS = {
+    ('bwa_mem', '0.7.17.1'): tool_io('bwa_mem', '0.7.17.1'),
+    ('fastqc', '0.72'): tool_io('fastqc', '0.72'),
+    ('bowtie2', '2.3.4'): tool_io('bowtie2', '2.3.4'),
+}
+
+
+def toolbox(server):
+    return APIToolbox.from_query(galaxy_base=server.base_url)
+
+
+def test_cached_response_is_revalidated(galaxy_stub, tmp_path):
+    server = galaxy_stub(TOOLS)
+    cache = ToolResponseCache(str(tmp_path))
+
+    first = APIToolIO.from_query('fastqc', server.base_url, '0.72', cache=cache)
+    second = APIToolIO.from_query('fastqc', server.base_url, '0.72', cache=cache)
+
+    assert first.data == second.data == TOOLS[('fastqc', '0.72')]
+    assert cache.stats == {'downloaded': 1, 'revalidated': 1, 'unchecked': 0}
+    conditional = server.tool_requests('fastqc')[1]['headers']
+    assert conditional['If-None-Match'] == cache.get(('fastqc', '0.72'))['etag']
+    assert conditional['If-Modified-Since'] == 'Tue, 01 Oct 2019 00:00:00 GMT'
+
+
+def test_changed_tool_is_downloaded_again(galaxy_stub, tmp_path):
+    server = galaxy_stub(TOOLS)
+    cache = ToolResponseCache(str(tmp_path))
+    APIToolIO.from_query('fastqc', server.base_url, '0.72', cache=cache)
+
+    changed = tool_io('fastqc', '0.72', n_inputs=2)
+    server.tools[('fastqc', '0.72')] = changed
+    tool = APIToolIO.from_query('fastqc', server.base_url, '0.72', cache=cache)
+
+    assert tool.data == changed
+    assert cache.get(('fastqc', '0.72'))['data'] == changed
+    assert cache.stats['downloaded'] == 2
+
+
+def test_revalidate_false_does_not_contact_the_server(galaxy_stub, tmp_path):
+    server = galaxy_stub(TOOLS)
+    cache = ToolResponseCache(str(tmp_path))
+    APIToolIO.from_query('bwa_mem', server.base_url, '0.7.17.1', cache=cache)
+
+    tool = APIToolIO.from_query(
+        'bwa_mem', server.base_url, '0.7.17.1', cache=cache, revalidate=False
+    )
+
+    assert tool.data == TOOLS[('bwa_mem', '0.7.17.1')]
+    assert len(server.tool_requests('bwa_mem')) == 1
+    assert cache.stats['unchecked'] == 1
+
+
+def test_entries_of_other_urls_are_ignored(galaxy_stub, tmp_path):
+    server = galaxy_stub(TOOLS)
+    other = galaxy_stub(TOOLS)
+    cache = ToolResponseCache(str(tmp_path))
+    APIToolIO.from_query('fastqc', server.base_url, '0.72', cache=cache)
+
+    APIToolIO.from_query('fastqc', other.base_url, '0.72', cache=cache, revalidate=False)
+
+    assert len(other.tool_requests('fastqc')) == 1
+    assert 'If-None-Match' not in other.tool_requests('fastqc')[0]['headers']
+
+
+def test_interrupted_harvest_resumes_from_checkpoint(galaxy_stub, tmp_path):
+    server = galaxy_stub(TOOLS)
+    cache = ToolResponseCache(str(tmp_path / 'cache'))
+    ofn = str(tmp_path / 'tools.json')
+    box = toolbox(server)
+    # the third tool in toolbox order is not found and breaks the run
+    failing = list(box.get_tools())[2]
+    broken = server.tools.pop((failing['id'], failing['version']))
+
+    with pytest.raises(ValueError):
+        store_tool_io_data(box, ofn, galaxy_base=server.base_url, cache=cache)
+    with open(ofn + '.checkpoint') as i:
+        done = [tuple(json.loads(line)) for line in i]
+    assert len(done) == 2
+
+    server.tools[(failing['id'], failing['version'])] = broken
+    n_requests = len(server.requests)
+    store_tool_io_data(box, ofn, galaxy_base=server.base_url, cache=cache)
+
+    resumed = [r['path'].rsplit('/', 1)[1] for r in server.requests[n_requests:]]
+    assert resumed == [failing['id']]
+    assert not os.path.exists(ofn + '.checkpoint')
+    with open(ofn) as i:
+        assert json.load(i) == [TOOLS[(t['id'], t['version'])] for t in box.get_tools()]
+
+
+def test_session_retries_transient_errors(galaxy_stub):
+    server = galaxy_stub(TOOLS)
+    server.failures['/api/tools/fastqc'] = [503, 502]
+
+    tool = APIToolIO.from_query('fastqc', server.base_url, '0.72')
+
+    assert tool.data == TOOLS[('fastqc', '0.72')]
+    assert len(server.tool_requests('fastqc')) == 3
+
+
+def test_session_gives_up_after_retries(galaxy_stub):
+    server = galaxy_stub(TOOLS)
+    server.failures['/api/tools/fastqc'] = [503] * 4
+
+    with pytest.raises(requests.exceptions.RetryError):
+        APIToolIO.from_query('fastqc', server.base_url, '0.72')
+    # one request plus Retry(total=3)
+    assert len(server.tool_requests('fastqc')) == 4
+
+
+def test_session_is_pooled():
+    assert extract_tools.get_session() is extract_tools.get_session()
@@ -0,0 +1,63 @@
+from usage_series import UsageSeries, month_name
+
+GUID = 'toolshed.g2.bx.psu.edu/repos/devteam/{0}/{0}/{1}'
+
+
+def rows(month, counts):
+    return [(GUID.format(tool, version), month + '-01', str(count))
+            for (tool, version), count in counts.items()]
+
+
+def test_new_months_are_appended():
+    store = UsageSeries()
+    store.append(rows('2019-01', {('bwa', '1'): 5}))
+
+    n_months, skipped = store.append(rows('2019-03', {('bwa', '1'): 7, ('fastqc', '2'): 1}))
+
+    assert (n_months, skipped) == (1, 0)
+    assert store.months('bwa', '1') == {'2019-01': 5, '2019-02': 0, '2019-03': 7}
+    assert store.months('fastqc', '2') == {'2019-03': 1}
+    assert store.aggregates[('bwa', '1')]['usage_3m'] == 12
+
+
+def test_last_month_is_replaced():
+    store = UsageSeries()
+    store.append(rows('2019-01', {('bwa', '1'): 5}) + rows('2019-02', {('bwa', '1'): 2}))
+
+    # the complete February and a new month
+    n_months, skipped = store.append(
+        rows('2019-02', {('bwa', '1'): 4, ('fastqc', '2'): 3}) + rows('2019-03', {('bwa', '1'): 1})
+    )
+
+    assert (n_months, skipped) == (2, 0)
+    assert store.months('bwa', '1') == {'2019-01': 5, '2019-02': 4, '2019-03': 1}
+    assert store.months('fastqc', '2') == {'2019-02': 3, '2019-03': 0}
+    assert store.aggregates[('bwa', '1')]['usage_3m'] == 10
+    assert month_name(store.last_month) == '2019-03'
+
+
+def snapshot(store):
+    return {key: (first, values.tolist()) for key, (first, values) in store.series.items()}
+
+
+def test_replacing_the_last_month_again_gives_the_same_series():
+    store = UsageSeries()
+    data = rows('2019-01', {('bwa', '1'): 5}) + rows('2019-02', {('bwa', '1'): 2, ('fastqc', '2'): 1})
+    store.append(data)
+    before = snapshot(store), dict(store.aggregates)
+
+    store.append(data)
+
+    assert (snapshot(store), store.aggregates) == before
+
+
+def test_older_months_and_guids_without_version_are_skipped():
+    store = UsageSeries()
+    store.append(rows('2019-02', {('bwa', '1'): 5}))
+
+    n_months, skipped = store.append(
+        rows('2019-01', {('bwa', '1'): 9}) + [('upload1', '2019-02-01', '3')]
+    )
+
+    assert (n_months, skipped) == (0, 2)
+    assert store.months('bwa', '1') == {'2019-02': 5}
@@ -0,0 +1,243 @@
+"""Monthly usage series of tool versions with rolling aggregates.
+
+The tool popularity TSV (tool guid, month, count) holds the complete
+usage history of every tool, of which the ToolUsage nodes only keep a
+single forecast. UsageSeries keeps the history as one compact series of
+monthly counts per (tool id, version) and precomputes the usage over
+the last 3, 6 and 12 months and the trend (slope of the least squares
+line over the last 12 months, in uses per month).
+
+New months are appended incrementally: all series are extended by the
+new months only and the aggregates are recomputed from the last 12
+months of every series, so the history is never reprocessed. Rows of
+the last month stored replace its counts, so a month appended before
+it was complete is corrected by appending it again with the rest of
+its rows; rows of older months are skipped. The input of an update is
+still read as a whole, so it should hold only the new months (and
+possibly the last one stored) rather than the complete history.
+
+WorkflowGraphDatabase.write_usage_series stores the series and the
+aggregates as numeric properties of the Version nodes (see
+UsageSeries.properties), where they can be indexed and filtered without
+conversion, e.g. WHERE v.usage_12m > 1000.
+"""
+
+import argparse
+import csv
+import os
+import pickle
+import re
+import time
+from array import array
+
+
+# Rolling windows, in months, of the precomputed usage totals
+WINDOWS = (3, 6, 12)
+
+# Months the usage trend is fitted over
+TREND_MONTHS = 12
+
+# short tool id and version at the end of a toolshed guid
+_GUID_RE = re.compile(r'([^/]*)/([^/]*)$')
+
+
+def month_index(date):
+    """Return the number of a month given as 'YYYY-MM[-DD]'."""
+
+    year, month = date[:7].split('-')
+    return int(year) * 12 + int(month) - 1
+
+
+def month_name(index):
+    """Return the 'YYYY-MM' name of a month number."""
+
+    year, month = divmod(index, 12)
+    return '{0:04d}-{1:02d}'.format(year, month + 1)
+
+
+def tool_key(guid):
+    """Return the (tool id, version) of a toolshed guid, or None.
+
+    Tools not installed from a toolshed (e.g. upload1) have no version
+    in their guid and are not tracked, like in forecast_tool_usage.
+    """
+
+    m = _GUID_RE.search(guid)
+    return (m.group(1), m.group(2)) if m else None
+
+
+def iter_popularity(file_name):
+    """Iterate over the (guid, date, count) rows of a tool popularity TSV."""
+
+    with open(file_name, 'r', newline='') as i:
+        for row in csv.reader(i, delimiter='\t'):
+            if len(row) >= 3:
+                yield row[0], row[1], row[2]
+
+
+def trend(values):
+    """Return the slope of the least squares line through values."""
+
+    n = len(values)
+    if n < 2:
+        return 0.0
+    mean_x = (n - 1) / 2
+    mean_y = sum(values) / n
+    cov = sum((x - mean_x) * (y - mean_y) for x, y in enumerate(values))
+    var = n * (n * n - 1) / 12
+    return cov / var
+
+
+def aggregate(values):
+    """Return the rolling totals and trend of a series ending this month."""
+
+    ret = {
+        'usage_{0}m'.format(w): sum(values[-w:]) for w in WINDOWS
+    }
+    ret['usage_trend'] = trend(values[-TREND_MONTHS:])
+    return ret
+
+
+class UsageSeries:
+    """Monthly usage counts per (tool id, version).
+
+    self.series maps a (tool id, version) to its first month and an
+    array of its counts from that month up to self.last_month, with
+    zeros for months without usage. self.aggregates holds the aggregate
+    of every series as of self.last_month.
+    """
+
+    def __init__(self):
+        self.series = {}
+        self.aggregates = {}
+        self.last_month = None
+
+    def append(self, rows):
+        """Append the months of rows from the last month stored on.
+
+        rows are (guid, date, count) tuples as read by iter_popularity.
+        The counts of several guids with the same tool id and version
+        are summed. Rows of the last month stored replace all of its
+        counts, rows of newer months are appended. Returns the number
+        of months appended or replaced and the number of rows skipped
+        because their month is older than the last month stored or
+        their guid has no version.
+        """
+
+        months = {}
+        skipped = 0
+        for guid, date, count in rows:
+            key = tool_key(guid)
+            month = month_index(date)
+            if key is None or (self.last_month is not None and month < self.last_month):
+                skipped += 1
+                continue
+            counts = months.setdefault(month, {})
+            counts[key] = counts.get(key, 0) + int(float(count))
+        last_month = self.last_month
+        if last_month in months:
+            self._replace_last_month(months[last_month])
+        for month in sorted(months):
+            if month != last_month:
+                self._append_month(month, months[month])
+        if months:
+            self.aggregates = {
+                key: aggregate(values) for key, (_, values) in self.series.items()
+            }
+        return len(months), skipped
+
+    def append_file(self, file_name):
+        """Append the new months of a tool popularity TSV.
+
+        The whole file is read, see append for the rows used.
+        """
+
+        return self.append(iter_popularity(file_name))
+
+    def _append_month(self, month, counts):
+        for key, (first, values) in self.series.items():
+            # months without usage of a tool are missing from the TSV
+            values.extend([0] * (month - first - len(values)))
+            values.append(counts.pop(key, 0))
+        for key, count in counts.items():
+            self.series[key] = (month, array('i', [count]))
+        self.last_month = month
+
+    def _replace_last_month(self, counts):
+        for key, (first, values) in self.series.items():
+            values[-1] = counts.pop(key, 0)
+        for key, count in counts.items():
+            self.series[key] = (self.last_month, array('i', [count]))
+
+    def __len__(self):
+        return len(self.series)
+
+    def months(self, tool_id, version):
+        """Return the usage of a tool version as {'YYYY-MM': count}."""
+
+        first, values = self.series.get((tool_id, version), (0, ()))
+        return {month_name(first + i): count for i, count in enumerate(values)}
+
+    def properties(self, tool_id, version):
+        """Return the Version node properties of a tool version.
+
+        usage_months holds the monthly counts from usage_first_month to
+        usage_last_month, usage_3m, usage_6m, usage_12m and usage_trend
+        the aggregates, all as numbers.
+        """
+
+        first, values = self.series[(tool_id, version)]
+        props = {
+            'usage_months': values.tolist(),
+            'usage_first_month': month_name(first),
+            'usage_last_month': month_name(self.last_month)
+        }
+        props.update(self.aggregates[(tool_id, version)])
+        return props
+
+    def iter_graph_rows(self):
+        """Iterate over the tool, version and properties of every series."""
+
+        for tool_id, version in self.series:
+            yield {
+                'tool': tool_id,
+                'version': version,
+                'props': self.properties(tool_id, version)
+            }
+
+    def save(self, file_name):
+        """Persist the series to file_name."""
+
+        tmp = file_name + '.tmp'
+        with open(tmp, 'wb') as o:
+            pickle.dump(self, o, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, file_name)
+
+    @classmethod
+    def load(cls, file_name):
+        """Load series persisted with save."""
+
+        with open(file_name, 'rb') as i:
+            this = pickle.load(i)
+        if not isinstance(this, cls):
+            raise TypeError(
+                '{0} does not contain a {1}'.format(file_name, cls.__name__)
+            )
+        return this
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        description='Append monthly tool popularity data to a usage series store'
+    )
+    arg_parser.add_argument("-i", "--usage_file", required=True, help="Tool popularity TSV with the new months")
+    arg_parser.add_argument("-s", "--store", required=True, help="Usage series file, created if missing")
+    args = vars(arg_parser.parse_args())
+    s_time = time.time()
+    store = UsageSeries.load(args["store"]) if os.path.exists(args["store"]) else UsageSeries()
+    n_months, n_skipped = store.append_file(args["usage_file"])
+    store.save(args["store"])
+    e_time = time.time()
+    print("Appended %d months (%d rows skipped), %d tool versions up to %s in %.1f seconds" % (
+        n_months, n_skipped, len(store),
+        month_name(store.last_month) if store.last_month is not None else "-", e_time - s_time))